@@ -0,0 +1,170 @@
+import logging
+import threading
+from collections import OrderedDict
+from block_device import BlockDevice
+
+
+class CachedBlockDevice(BlockDevice):
+    """带LRU缓存的块设备
+
+    按line_size对齐的缓存行缓存底层设备的数据，总占用不超过budget字节，
+    超出时淘汰最久未使用的缓存行。大块读取(超过预算的1/4)直接穿透到设备，
+    避免一次批量读取冲掉全部缓存。
+    """
+
+    def __init__(self, device: BlockDevice, line_size: int = 64 * 1024, budget: int = 64 * 1024 * 1024):
+        super().__init__(device.path)
+        self.device = device
+        self.sector_size = device.sector_size
+        self.physical_sector_size = device.physical_sector_size
+        # 缓存行按物理扇区对齐
+        self.line_size = max(line_size, device.physical_sector_size)
+        self.budget = budget
+        self._lines = OrderedDict()
+        self._used = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    @property
+    def size(self) -> int:
+        return self.device.size
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        if length <= 0:
+            return b''
+        if length > self.budget // 4:
+            with self._lock:
+                self.bypassed += 1
+            return self.device.read_at(offset, length)
+
+        first_line = offset // self.line_size
+        last_line = (offset + length - 1) // self.line_size
+        if first_line == last_line:
+            line = self._get_line(first_line)
+            start = offset - first_line * self.line_size
+            return line[start:start + length]
+
+        result = bytearray()
+        for index in range(first_line, last_line + 1):
+            line = self._get_line(index)
+            line_start = index * self.line_size
+            start = max(offset, line_start) - line_start
+            end = min(offset + length, line_start + self.line_size) - line_start
+            result += line[start:end]
+            if len(line) < self.line_size:
+                break  # 已到设备末尾
+        return bytes(result)
+
+    def readv(self, offset: int, buffers) -> int:
+        views = [memoryview(buffer).cast('B') for buffer in buffers]
+        length = sum(len(view) for view in views)
+        if length == 0:
+            return 0
+        if length > self.budget // 4:
+            with self._lock:
+                self.bypassed += 1
+            return self.device.readv(offset, views)
+        # 先用一次分散读取补齐范围内所有未命中的缓存行，再从缓存行拷贝到各缓冲区；
+        # 刚读入的行直接使用，不再按命中计数，其余的行各计一次命中
+        first_line = offset // self.line_size
+        last_line = (offset + length - 1) // self.line_size
+        filled = self._fill_lines(first_line, last_line)
+        parts = []
+        for index in range(first_line, last_line + 1):
+            line = filled.get(index)
+            if line is None:
+                line = self._get_line(index)
+            line_start = index * self.line_size
+            parts.append(line[max(offset, line_start) - line_start:min(offset + length, line_start + self.line_size) - line_start])
+            if len(line) < self.line_size:
+                break  # 已到设备末尾
+        data = memoryview(b''.join(parts))
+        position = 0
+        for view in views:
+            piece = data[position:position + len(view)]
+            view[:len(piece)] = piece
+            position += len(piece)
+            if len(piece) < len(view):
+                break
+        return position
+
+    def _fill_lines(self, first_line: int, last_line: int) -> dict:
+        """把[first_line, last_line]中未缓存的连续缓存行合并成一次readv读入，返回读入的{行号: 数据}"""
+        with self._lock:
+            missing = [index for index in range(first_line, last_line + 1) if index not in self._lines]
+        filled = {}
+        runs = []
+        for index in missing:
+            if runs and runs[-1][-1] + 1 == index:
+                runs[-1].append(index)
+            else:
+                runs.append([index])
+        for run in runs:
+            buffers = [bytearray(self.line_size) for _ in run]
+            got = self.device.readv(run[0] * self.line_size, buffers)
+            with self._lock:
+                self.misses += len(run)
+                for i, index in enumerate(run):
+                    line_got = min(self.line_size, max(0, got - i * self.line_size))
+                    if line_got == 0:
+                        break
+                    filled[index] = bytes(buffers[i][:line_got])
+                    self._store_line(index, filled[index])
+        return filled
+
+    def _get_line(self, index: int) -> bytes:
+        """取出一个缓存行，未命中时从设备读取并按LRU淘汰"""
+        with self._lock:
+            line = self._lines.get(index)
+            if line is not None:
+                self._lines.move_to_end(index)
+                self.hits += 1
+                return line
+            self.misses += 1
+        # 读取设备时不持有锁，多个线程的未命中可以同时进行
+        line = bytes(self.device.read_at(index * self.line_size, self.line_size))
+        with self._lock:
+            self._store_line(index, line)
+        return line
+
+    def _store_line(self, index: int, line: bytes):
+        """放入一个缓存行并按LRU淘汰(调用方持有锁)"""
+        if index in self._lines:
+            self._used -= len(self._lines.pop(index))
+        self._lines[index] = line
+        self._used += len(line)
+        while self._used > self.budget and len(self._lines) > 1:
+            _, evicted = self._lines.popitem(last=False)
+            self._used -= len(evicted)
+            self.evictions += 1
+
+    def data_extents(self, offset: int, length: int):
+        return self.device.data_extents(offset, length)
+
+    def invalidate(self):
+        """清空缓存(设备内容可能已变化时调用)"""
+        with self._lock:
+            self._lines.clear()
+            self._used = 0
+
+    def stats(self) -> dict:
+        """返回缓存命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'bypassed': self.bypassed,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'used_bytes': self._used,
+                'budget': self.budget,
+            }
+
+    def close(self):
+        logging.info(f"设备 {self.path} 缓存统计: {self.stats()}")
+        self.invalidate()
+        self.device.close()
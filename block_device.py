@@ -0,0 +1,601 @@
+import os
+import mmap
+import stat
+import errno
+import struct
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import win32file
+except ImportError:  # 非Windows环境下没有pywin32
+    win32file = None
+
+try:
+    import msvcrt
+except ImportError:  # 非Windows环境
+    msvcrt = None
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl
+    fcntl = None
+
+# IOCTL_DISK_GET_LENGTH_INFO，获取物理磁盘/分区的字节数
+IOCTL_DISK_GET_LENGTH_INFO = 0x7405c
+
+# IOCTL_DISK_GET_DRIVE_GEOMETRY，获取磁盘/卷的逻辑扇区大小(DISK_GEOMETRY.BytesPerSector)
+IOCTL_DISK_GET_DRIVE_GEOMETRY = 0x70000
+# IOCTL_STORAGE_QUERY_PROPERTY + StorageAccessAlignmentProperty，获取物理扇区大小
+IOCTL_STORAGE_QUERY_PROPERTY = 0x2D1400
+STORAGE_ACCESS_ALIGNMENT_PROPERTY = 6
+
+# Linux块设备的逻辑/物理扇区大小
+BLKSSZGET = 0x1268
+BLKPBSZGET = 0x127B
+# macOS块设备的逻辑/物理扇区大小
+DKIOCGETBLOCKSIZE = 0x40046418
+DKIOCGETPHYSICALBLOCKSIZE = 0x4004644D
+
+# 合法的扇区大小
+VALID_SECTOR_SIZES = (512, 1024, 2048, 4096)
+
+# 批量并发读取的默认队列深度
+DEFAULT_QUEUE_DEPTH = 8
+
+# FSCTL_QUERY_ALLOCATED_RANGES，查询NTFS稀疏文件中已分配的区间
+FSCTL_QUERY_ALLOCATED_RANGES = 0x940CF
+
+# 一次preadv允许的最大缓冲区个数
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+if IOV_MAX <= 0:
+    IOV_MAX = 1024
+
+
+def file_data_extents(fileno: int, offset: int, length: int):
+    """查询文件[offset, offset+length)内已分配(非空洞)的区间
+
+    POSIX上使用lseek的SEEK_DATA/SEEK_HOLE，Windows上使用FSCTL_QUERY_ALLOCATED_RANGES。
+    会移动文件指针，调用方需要保证没有其他线程同时依赖该描述符的文件指针。
+
+    Returns:
+        (起始偏移, 长度)列表；平台或文件系统不支持时返回None
+    """
+    end = offset + length
+    extents = []
+    if hasattr(os, 'SEEK_DATA'):
+        position = offset
+        while position < end:
+            try:
+                data = os.lseek(fileno, position, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    break  # 之后全是空洞
+                return None
+            if data >= end:
+                break
+            hole = os.lseek(fileno, data, os.SEEK_HOLE)
+            extents.append((data, min(hole, end) - data))
+            position = hole
+        return extents
+    if win32file is not None and msvcrt is not None:
+        handle = msvcrt.get_osfhandle(fileno)
+        position = offset
+        while position < end:
+            try:
+                out = win32file.DeviceIoControl(handle, FSCTL_QUERY_ALLOCATED_RANGES,
+                                                struct.pack('<qq', position, end - position), 16 * 256)
+            except Exception:
+                return None
+            if not out:
+                break
+            ranges = [struct.unpack_from('<qq', out, i) for i in range(0, len(out) - 15, 16)]
+            for start, size in ranges:
+                extents.append((start, min(start + size, end) - start))
+            if len(ranges) < 256:
+                break
+            position = ranges[-1][0] + ranges[-1][1]
+        return extents
+    return None
+
+
+def merge_extents(extents):
+    """合并相邻或重叠的(起始, 长度)区间"""
+    merged = []
+    for start, length in sorted(extents):
+        if length <= 0:
+            continue
+        if merged and merged[-1][0] + merged[-1][1] >= start:
+            last_start, last_length = merged[-1]
+            merged[-1] = (last_start, max(last_start + last_length, start + length) - last_start)
+        else:
+            merged.append((start, length))
+    return merged
+
+
+def query_win32_sector_sizes(handle):
+    """通过IOCTL查询Windows磁盘/卷的(逻辑扇区大小, 物理扇区大小)，失败时返回None"""
+    try:
+        geometry = win32file.DeviceIoControl(handle, IOCTL_DISK_GET_DRIVE_GEOMETRY, None, 24)
+        logical = struct.unpack_from('<I', geometry, 20)[0]
+    except Exception as e:
+        logging.debug(f"查询逻辑扇区大小失败: {str(e)}")
+        return None
+    physical = logical
+    try:
+        query = struct.pack('<II4x', STORAGE_ACCESS_ALIGNMENT_PROPERTY, 0)
+        descriptor = win32file.DeviceIoControl(handle, IOCTL_STORAGE_QUERY_PROPERTY, query, 28)
+        physical = struct.unpack_from('<I', descriptor, 20)[0] or logical
+    except Exception as e:
+        # 老系统和部分USB设备不支持对齐属性查询，按逻辑扇区处理
+        logging.debug(f"查询物理扇区大小失败: {str(e)}")
+    return logical, physical
+
+
+def query_posix_sector_sizes(fileno: int):
+    """通过ioctl查询Linux/macOS块设备的(逻辑扇区大小, 物理扇区大小)，普通文件返回None"""
+    if fcntl is None or not stat.S_ISBLK(os.fstat(fileno).st_mode):
+        return None
+    if hasattr(os, 'O_DIRECT'):
+        requests = (BLKSSZGET, BLKPBSZGET)
+    else:
+        requests = (DKIOCGETBLOCKSIZE, DKIOCGETPHYSICALBLOCKSIZE)
+    sizes = []
+    for request in requests:
+        try:
+            buf = fcntl.ioctl(fileno, request, b'\x00' * 4)
+            sizes.append(struct.unpack('I', buf)[0])
+        except OSError as e:
+            logging.debug(f"ioctl查询扇区大小失败: {str(e)}")
+            sizes.append(0)
+    if not sizes[0]:
+        return None
+    return sizes[0], sizes[1] or sizes[0]
+
+
+def probe_image_sector_size(device) -> int:
+    """从镜像内容推断逻辑扇区大小
+
+    4Kn镜像的GPT头位于4096字节处；卷镜像以引导扇区BPB中的每扇区字节数为准；
+    MBR镜像检查第一个分区按512和4096换算后哪一个位置是合法的引导扇区。
+    """
+    head = device.read_at(0, 8192)
+    if len(head) < 512 or head[510:512] != b'\x55\xAA':
+        return 512
+    if head[512:520] != b'EFI PART' and head[4096:4104] == b'EFI PART':
+        return 4096
+    if head[0] in (0xEB, 0xE9):
+        bytes_per_sector = struct.unpack_from('<H', head, 11)[0]
+        if bytes_per_sector in VALID_SECTOR_SIZES:
+            return bytes_per_sector
+    for i in range(4):
+        start_lba = struct.unpack_from('<I', head, 446 + i * 16 + 8)[0]
+        if start_lba == 0:
+            continue
+        for sector_size in (512, 4096):
+            boot = device.read_at(start_lba * sector_size, 512)
+            if (len(boot) == 512 and boot[510:512] == b'\x55\xAA' and
+                    struct.unpack_from('<H', boot, 11)[0] == sector_size):
+                return sector_size
+        break
+    return 512
+
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+
+def _get_batch_executor() -> ThreadPoolExecutor:
+    """批量并发读取共用的线程池"""
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="batch-read")
+        return _batch_executor
+
+
+def normalize_device_path(disk_path: str) -> str:
+    """把盘符(C:)统一成设备路径(\\\\.\\C:)，其余路径保持不变"""
+    if len(disk_path) == 2 and disk_path[1] == ':':
+        return f"\\\\.\\{disk_path}"
+    return disk_path
+
+
+class BlockDevice:
+    """块设备接口
+
+    所有读取都是按绝对偏移的定位读取，不依赖共享的文件指针。
+    子类至少实现read_at或readinto其中之一。
+    """
+
+    # 为True表示read_view返回的是不经复制的设备数据切片
+    zero_copy = False
+
+    def __init__(self, path: str):
+        self.path = path
+        # 逻辑扇区大小(寻址单位)和物理扇区大小(批量读取的对齐单位)
+        self.sector_size = 512
+        self.physical_sector_size = 512
+
+    def set_sector_sizes(self, sizes):
+        """设置检测到的(逻辑扇区大小, 物理扇区大小)，sizes为None时保持默认值"""
+        if not sizes:
+            return
+        logical, physical = sizes
+        if logical in VALID_SECTOR_SIZES:
+            self.sector_size = logical
+            self.physical_sector_size = max(logical, physical if physical in VALID_SECTOR_SIZES else logical)
+
+    @property
+    def size(self) -> int:
+        """设备总字节数"""
+        raise NotImplementedError
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        """从offset处读取最多length字节，到达设备末尾时返回的数据可能更短"""
+        buffer = bytearray(length)
+        got = self.readinto(offset, buffer)
+        if got < length:
+            del buffer[got:]
+        return buffer
+
+    def readinto(self, offset: int, buffer) -> int:
+        """从offset处读取数据填入buffer，返回实际读取的字节数"""
+        view = memoryview(buffer).cast('B')
+        data = self.read_at(offset, len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def read_view(self, offset: int, length: int) -> memoryview:
+        """以只读memoryview的形式返回数据，支持的后端不产生复制"""
+        return memoryview(self.read_at(offset, length))
+
+    def data_extents(self, offset: int, length: int):
+        """返回[offset, offset+length)内含有数据的区间列表
+
+        区间之外的部分是稀疏镜像中的空洞，内容全为0，批量扫描可以直接跳过。
+        不支持空洞查询的后端把设备范围内的部分整体视为数据。
+        """
+        length = min(length, max(0, self.size - offset))
+        return [(offset, length)] if length > 0 else []
+
+    def read_batch(self, requests, queue_depth: int = DEFAULT_QUEUE_DEPTH, return_exceptions: bool = False):
+        """并发读取多个(偏移, 长度)请求，按完成顺序逐个产出(请求序号, 数据)
+
+        同时在途的请求不超过queue_depth个，适合目录簇、文件头这类分散的小块随机读取。
+        内存映射设备直接按顺序返回视图，不经过线程池。
+
+        Args:
+            return_exceptions: 为True时读取失败的请求产出(请求序号, 异常)并继续读取其余请求，
+                否则第一个失败的请求抛出异常
+        """
+        requests = list(requests)
+        if self.zero_copy:
+            for index, (offset, length) in enumerate(requests):
+                try:
+                    data = self.read_view(offset, length)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    data = e
+                yield index, data
+            return
+        pending = {}
+        next_index = 0
+        while next_index < len(requests) or pending:
+            while next_index < len(requests) and len(pending) < max(1, queue_depth):
+                offset, length = requests[next_index]
+                pending[self._submit_read(offset, length)] = next_index
+                next_index += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                if return_exceptions and future.exception() is not None:
+                    yield index, future.exception()
+                else:
+                    yield index, future.result()
+
+    def _submit_read(self, offset: int, length: int) -> Future:
+        """异步发起一次读取(供read_batch使用)"""
+        # 带上调用线程的上下文，线程池中的读取沿用调用方的I/O优先级
+        context = contextvars.copy_context()
+        return _get_batch_executor().submit(context.run, self.read_at, offset, length)
+
+    def readv(self, offset: int, buffers) -> int:
+        """分散读取：从offset处连续读取数据依次填满buffers，返回实际读取的总字节数
+
+        默认逐个缓冲区调用readinto，遇到短读时停止；支持preadv的后端一次系统调用完成。
+        """
+        total = 0
+        for buffer in buffers:
+            size = memoryview(buffer).nbytes
+            got = self.readinto(offset + total, buffer)
+            total += got
+            if got < size:
+                break
+        return total
+
+    def close(self):
+        """关闭设备"""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PosixBlockDevice(BlockDevice):
+    """基于os.pread的块设备，适用于Linux/macOS上的磁盘镜像和块设备
+
+    pread不移动文件指针，多个线程可以同时读取同一个描述符。
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        self._size = None
+        self.set_sector_sizes(query_posix_sector_sizes(self.fd))
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            # 块设备的st_size为0，用lseek到末尾获取真实大小
+            self._size = os.fstat(self.fd).st_size or os.lseek(self.fd, 0, os.SEEK_END)
+        return self._size
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        return os.pread(self.fd, length, offset)
+
+    def readinto(self, offset: int, buffer) -> int:
+        if hasattr(os, 'preadv'):
+            return os.preadv(self.fd, [buffer], offset)
+        return super().readinto(offset, buffer)
+
+    def data_extents(self, offset: int, length: int):
+        length = min(length, max(0, self.size - offset))
+        if length <= 0:
+            return []
+        # pread不使用文件指针，查询空洞时移动指针不影响读取
+        extents = file_data_extents(self.fd, offset, length)
+        return [(offset, length)] if extents is None else extents
+
+    def readv(self, offset: int, buffers) -> int:
+        if not hasattr(os, 'preadv'):
+            return super().readv(offset, buffers)
+        buffers = list(buffers)
+        total = 0
+        # 单次preadv的缓冲区个数不能超过IOV_MAX
+        for i in range(0, len(buffers), IOV_MAX):
+            group = buffers[i:i + IOV_MAX]
+            expected = sum(memoryview(b).nbytes for b in group)
+            got = os.preadv(self.fd, group, offset + total)
+            total += got
+            if got < expected:
+                break
+        return total
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FileBlockDevice(BlockDevice):
+    """基于普通文件对象的块设备，用于没有pread的平台(Windows上的镜像文件)"""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.file = open(path, "rb")
+        self.lock = threading.Lock()
+        if fcntl is not None:
+            self.set_sector_sizes(query_posix_sector_sizes(self.file.fileno()))
+
+    @property
+    def size(self) -> int:
+        with self.lock:
+            return self.file.seek(0, os.SEEK_END)
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(length)
+
+    def readinto(self, offset: int, buffer) -> int:
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.readinto(memoryview(buffer).cast('B')) or 0
+
+    def data_extents(self, offset: int, length: int):
+        length = min(length, max(0, self.size - offset))
+        if length <= 0:
+            return []
+        with self.lock:
+            extents = file_data_extents(self.file.fileno(), offset, length)
+        return [(offset, length)] if extents is None else extents
+
+    def close(self):
+        self.file.close()
+
+
+class MmapBlockDevice(BlockDevice):
+    """基于内存映射的镜像文件设备
+
+    整个文件只读映射到地址空间，read_view直接返回映射区的切片，
+    由操作系统的页缓存负责换入换出，浏览超大镜像时不需要整体读入内存。
+    """
+
+    zero_copy = True
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+    @property
+    def size(self) -> int:
+        return len(self.mmap)
+
+    def read_view(self, offset: int, length: int) -> memoryview:
+        return self.view[offset:offset + length]
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        return self.mmap[offset:offset + length]
+
+    def readinto(self, offset: int, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        data = self.view[offset:offset + len(view)]
+        view[:len(data)] = data
+        return len(data)
+
+    def data_extents(self, offset: int, length: int):
+        length = min(length, max(0, self.size - offset))
+        if length <= 0:
+            return []
+        # 映射建立后文件已关闭，查询空洞时临时打开一次
+        with open(self.path, "rb") as f:
+            extents = file_data_extents(f.fileno(), offset, length)
+        return [(offset, length)] if extents is None else extents
+
+    def close(self):
+        self.view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            # 仍有外部切片引用映射区，等最后一个切片释放后由垃圾回收关闭
+            logging.debug(f"镜像 {self.path} 的映射区仍被引用，延迟关闭")
+
+
+class Win32BlockDevice(BlockDevice):
+    """基于win32file的块设备，用于物理磁盘(\\\\.\\PhysicalDriveN)和逻辑卷(\\\\.\\C:)"""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.handle = win32file.CreateFile(
+            path,
+            win32file.GENERIC_READ,
+            win32file.FILE_SHARE_READ | win32file.FILE_SHARE_WRITE,
+            None,
+            win32file.OPEN_EXISTING,
+            0,
+            None
+        )
+        self.lock = threading.Lock()
+        self._size = None
+        self.set_sector_sizes(query_win32_sector_sizes(self.handle))
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            try:
+                buf = win32file.DeviceIoControl(self.handle, IOCTL_DISK_GET_LENGTH_INFO, None, 8)
+                self._size = int.from_bytes(buf[:8], 'little')
+            except Exception as e:
+                logging.error(f"获取设备 {self.path} 容量失败: {str(e)}")
+                self._size = win32file.GetFileSize(self.handle)
+        return self._size
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        with self.lock:
+            win32file.SetFilePointer(self.handle, offset, win32file.FILE_BEGIN)
+            return win32file.ReadFile(self.handle, length)[1]
+
+    def close(self):
+        self.handle.Close()
+
+
+def open_block_device(disk_path: str, use_mmap: bool = True, direct: bool = False) -> BlockDevice:
+    """根据路径创建合适的块设备后端
+
+    Windows设备路径使用win32file；普通镜像文件默认使用内存映射；
+    其余路径在有pread的平台上使用pread，否则退回到普通文件方式。
+    分段原始镜像(.001/.002/...)拼接成一个设备。
+    镜像文件如果是VHD/VMDK/E01容器，再包装成对应的虚拟磁盘设备。
+    分区路径打开为按偏移换算的分区子设备。
+
+    Args:
+        disk_path: 磁盘路径
+        use_mmap: 是否允许对镜像文件使用内存映射
+        direct: 为True时使用绕过系统页缓存的无缓冲读取(用于批量读取)，
+            文件系统不支持时退回到普通读取
+    """
+    path = normalize_device_path(disk_path)
+    if '::p' in path:
+        # 分区路径(<磁盘路径>::p<分区号>)，打开为分区子设备
+        from partition_table import open_partition
+        return open_partition(path, direct)
+    if not path.startswith('\\\\.\\'):
+        from split_image import split_segment_paths, SplitRawDevice
+        segments = split_segment_paths(path)
+        if len(segments) > 1:
+            # 分段原始镜像(.001/.002/...)拼接成一个设备
+            if direct:
+                opener = lambda p: _open_direct(p) or _open_image_file(p, False)
+            else:
+                opener = lambda p: _open_image_file(p, use_mmap)
+            return _wrap_virtual_disk(SplitRawDevice(path, segments, opener))
+    if direct:
+        base = _open_direct(path)
+        if base is not None:
+            if path.startswith('\\\\.\\'):
+                return base
+            return _wrap_virtual_disk(base)
+        use_mmap = False
+    if path.startswith('\\\\.\\') and win32file is not None:
+        try:
+            device = Win32BlockDevice(path)
+            logging.info(f"使用win32file打开设备: {path}")
+            return device
+        except Exception as e:
+            if path.startswith('\\\\.\\PhysicalDrive'):
+                raise
+            logging.error(f"win32file打开 {path} 失败，尝试open方式: {str(e)}")
+            return FileBlockDevice(path)
+    return _wrap_virtual_disk(_open_image_file(path, use_mmap))
+
+
+def _wrap_virtual_disk(base: BlockDevice) -> BlockDevice:
+    """镜像文件是VHD/VMDK/E01容器时包装成虚拟磁盘设备，原始镜像按内容推断扇区大小"""
+    try:
+        from virtual_disk import open_virtual_disk
+        device = open_virtual_disk(base)
+        if device is base and os.path.isfile(base.path):
+            sector_size = probe_image_sector_size(device)
+            device.set_sector_sizes((sector_size, sector_size))
+        return device
+    except Exception:
+        base.close()
+        raise
+
+
+def _open_direct(path: str):
+    """尝试以无缓冲方式打开，不支持时返回None"""
+    from direct_io import DirectBlockDevice
+    try:
+        device = DirectBlockDevice(path)
+        logging.info(f"使用无缓冲读取打开设备: {path}")
+        return device
+    except Exception as e:
+        # tmpfs等文件系统不支持O_DIRECT
+        logging.error(f"无缓冲方式打开 {path} 失败，改用普通读取: {str(e)}")
+        return None
+
+
+def _open_image_file(path: str, use_mmap: bool) -> BlockDevice:
+    """打开普通文件或块设备节点"""
+    if use_mmap and os.path.isfile(path) and os.path.getsize(path) > 0:
+        try:
+            return MmapBlockDevice(path)
+        except (OSError, OverflowError, ValueError) as e:
+            # 32位进程映射不了超大文件等情况，退回到普通读取
+            logging.error(f"内存映射 {path} 失败，改用普通读取: {str(e)}")
+    if hasattr(os, 'pread'):
+        return PosixBlockDevice(path)
+    return FileBlockDevice(path)
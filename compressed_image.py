@@ -0,0 +1,220 @@
+import sys
+import zlib
+import struct
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from block_device import BlockDevice
+
+# 分块压缩镜像文件签名
+COMPRESSED_IMAGE_SIGNATURE = b'OHXZIMG\x00'
+COMPRESSED_IMAGE_VERSION = 1
+COMPRESSED_IMAGE_EXTENSION = '.ohxz'
+
+# 文件头: 签名、版本、chunk大小、逻辑/物理扇区大小、镜像大小、chunk数、索引位置、
+# MD5/SHA-1/SHA-256摘要、源路径
+COMPRESSED_IMAGE_HEADER = struct.Struct("<8sIIIIQQQ16s20s32s256s")
+COMPRESSED_IMAGE_HEADER_SIZE = 4096
+
+# 索引项的最高位表示该chunk未压缩(压缩后不比原数据小)
+CHUNK_STORED_RAW = 1 << 63
+CHUNK_OFFSET_MASK = CHUNK_STORED_RAW - 1
+
+
+def _uint64_array() -> array:
+    table = array('Q')
+    if table.itemsize != 8:
+        table = array('L')
+    return table
+
+
+def compress_chunks(data, chunk_size: int, level: int = 1) -> list:
+    """把一段数据按chunk_size切分并逐块压缩
+
+    Returns:
+        (存储数据, 是否未压缩)列表；全0的chunk存储为空数据，读取时还原为0
+    """
+    view = memoryview(data)
+    zero = bytes(chunk_size)
+    chunks = []
+    for start in range(0, len(view), chunk_size):
+        chunk = bytes(view[start:start + chunk_size])
+        if chunk == zero[:len(chunk)]:
+            chunks.append((b'', False))
+            continue
+        compressed = zlib.compress(chunk, level)
+        if len(compressed) >= len(chunk):
+            chunks.append((chunk, True))
+        else:
+            chunks.append((compressed, False))
+    return chunks
+
+
+class CompressedImageWriter:
+    """顺序写出分块压缩镜像
+
+    chunk数据紧跟在文件头后面依次写入，finish时在文件末尾写入chunk偏移索引
+    (chunk_count+1项，相邻两项之差即存储长度)并回填文件头。
+    """
+
+    def __init__(self, path: str, image_size: int, chunk_size: int = 64 * 1024,
+                 sector_sizes=(512, 512), source: str = ""):
+        self.path = path
+        self.image_size = image_size
+        self.chunk_size = chunk_size
+        self.sector_sizes = sector_sizes
+        self.source = source
+        self.index = _uint64_array()
+        self.file = open(path, 'wb')
+        self.file.write(bytes(COMPRESSED_IMAGE_HEADER_SIZE))
+        self.position = COMPRESSED_IMAGE_HEADER_SIZE
+        self.stored_bytes = 0
+
+    def write_chunks(self, chunks: list):
+        """按顺序追加compress_chunks的结果"""
+        for data, stored_raw in chunks:
+            self.index.append(self.position | (CHUNK_STORED_RAW if stored_raw else 0))
+            if data:
+                self.file.write(data)
+                self.position += len(data)
+                self.stored_bytes += len(data)
+
+    def finish(self, digests: dict = None):
+        """写入索引和文件头并关闭文件
+
+        Args:
+            digests: 算法名到摘要(bytes)的映射，记录md5/sha1/sha256
+        """
+        digests = digests or {}
+        chunk_count = len(self.index)
+        self.index.append(self.position)
+        index = array(self.index.typecode, self.index)
+        if sys.byteorder == 'big':
+            index.byteswap()
+        self.file.write(index.tobytes())
+        self.file.seek(0)
+        self.file.write(COMPRESSED_IMAGE_HEADER.pack(
+            COMPRESSED_IMAGE_SIGNATURE, COMPRESSED_IMAGE_VERSION, self.chunk_size,
+            self.sector_sizes[0], self.sector_sizes[1], self.image_size, chunk_count, self.position,
+            digests.get('md5', b''), digests.get('sha1', b''), digests.get('sha256', b''),
+            self.source.encode('utf-8')[:256]))
+        self.file.close()
+        logging.info(f"分块压缩镜像 {self.path}: {chunk_count} 个chunk, "
+                     f"{self.image_size} 字节压缩为 {self.stored_bytes} 字节")
+
+    def abort(self):
+        """出错或取消时关闭文件(不写索引)"""
+        self.file.close()
+
+
+class CompressedImageDevice(BlockDevice):
+    """分块压缩镜像(.ohxz)
+
+    打开时读入chunk偏移索引，读取时按chunk解压，解压后的chunk保存在
+    容量为cache_chunks的LRU中；空chunk(全0)不占存储空间，data_extents不报告。
+    """
+
+    def __init__(self, base: BlockDevice, header: bytes, cache_chunks: int = 64):
+        super().__init__(base.path)
+        self.base = base
+        self.cache_chunks = cache_chunks
+        (_, version, self.chunk_size, sector_size, physical_sector_size, self.image_size, chunk_count,
+         index_offset, md5, sha1, sha256, source) = COMPRESSED_IMAGE_HEADER.unpack_from(header, 0)
+        if version != COMPRESSED_IMAGE_VERSION:
+            raise Exception(f"不支持的压缩镜像版本: {version}")
+        if self.chunk_size == 0:
+            raise Exception("压缩镜像的chunk大小无效")
+        self.set_sector_sizes((sector_size, physical_sector_size))
+        self.digests = {name: digest.hex() for name, digest in
+                        (('md5', md5), ('sha1', sha1), ('sha256', sha256)) if any(digest)}
+        self.source = source.rstrip(b'\x00').decode('utf-8', errors='replace')
+        self.index = _uint64_array()
+        self.index.frombytes(bytes(base.read_at(index_offset, (chunk_count + 1) * 8)))
+        if sys.byteorder == 'big':
+            self.index.byteswap()
+        if len(self.index) < chunk_count + 1:
+            raise Exception("压缩镜像索引不完整")
+        self._chunks = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        logging.info(f"分块压缩镜像: 大小={self.image_size}, chunk大小={self.chunk_size}, chunk数={chunk_count}")
+
+    @property
+    def size(self) -> int:
+        return self.image_size
+
+    def _chunk_range(self, index: int):
+        """返回chunk的(存储偏移, 存储长度, 是否未压缩)"""
+        start = self.index[index]
+        end = self.index[index + 1] & CHUNK_OFFSET_MASK
+        offset = start & CHUNK_OFFSET_MASK
+        return offset, end - offset, bool(start & CHUNK_STORED_RAW)
+
+    def _read_chunk(self, index: int) -> bytes:
+        """取出解压后的chunk，优先从LRU中获取"""
+        with self._lock:
+            chunk = self._chunks.get(index)
+            if chunk is not None:
+                self._chunks.move_to_end(index)
+                self.hits += 1
+                return chunk
+            self.misses += 1
+
+        offset, stored, stored_raw = self._chunk_range(index)
+        if stored == 0:
+            chunk = bytes(self.chunk_size)
+        else:
+            data = self.base.read_at(offset, stored)
+            chunk = bytes(data) if stored_raw else zlib.decompress(data)
+
+        with self._lock:
+            self._chunks[index] = chunk
+            while len(self._chunks) > self.cache_chunks:
+                self._chunks.popitem(last=False)
+        return chunk
+
+    def readinto(self, offset: int, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        length = min(len(view), max(0, self.image_size - offset))
+        position = 0
+        while position < length:
+            index, within = divmod(offset + position, self.chunk_size)
+            chunk = self._read_chunk(index)
+            piece = min(self.chunk_size - within, length - position)
+            data = chunk[within:within + piece]
+            view[position:position + len(data)] = data
+            if len(data) < piece:
+                view[position + len(data):position + piece] = bytes(piece - len(data))
+            position += piece
+        return length
+
+    def data_extents(self, offset: int, length: int):
+        length = min(length, max(0, self.image_size - offset))
+        extents = []
+        position = offset
+        while position < offset + length:
+            index = position // self.chunk_size
+            end = min((index + 1) * self.chunk_size, offset + length)
+            if self._chunk_range(index)[1] > 0:
+                if extents and extents[-1][0] + extents[-1][1] == position:
+                    extents[-1] = (extents[-1][0], end - extents[-1][0])
+                else:
+                    extents.append((position, end - position))
+            position = end
+        return extents
+
+    def stats(self) -> dict:
+        """返回chunk缓存命中统计"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'cached_chunks': len(self._chunks),
+            }
+
+    def close(self):
+        with self._lock:
+            self._chunks.clear()
+        self.base.close()
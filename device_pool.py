@@ -0,0 +1,284 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from block_device import (BlockDevice, PosixBlockDevice, FileBlockDevice, MmapBlockDevice,
+                          open_block_device, normalize_device_path)
+from partition_table import split_partition_path
+from rescue_map import RescueMap, STATUS_BAD
+from block_cache import CachedBlockDevice
+from io_scheduler import IOScheduler, ScheduledDevice, PRIORITY_BULK
+from latency_map import LatencyMap
+
+
+class PoolEntry:
+    """设备池中的一个已打开设备、它的缓存层、无缓冲设备、I/O调度器及引用计数"""
+
+    def __init__(self, device: BlockDevice, cache: BlockDevice, scheduler: IOScheduler):
+        self.device = device
+        self.cache = cache
+        self.scheduler = scheduler
+        # 无缓冲设备在第一次以direct方式获取时才打开
+        self.direct = None
+        # (底层设备, 优先级) -> 经过调度器的设备视图
+        self.views = {}
+        self.ref_count = 0
+        self.last_used = time.monotonic()
+
+    def view(self, device: BlockDevice, priority) -> BlockDevice:
+        """返回经过调度器读取device的视图；内存映射设备由系统页缓存处理，不经过调度器"""
+        if device.zero_copy:
+            return device
+        key = (id(device), priority)
+        if key not in self.views:
+            self.views[key] = ScheduledDevice(self.scheduler, device, priority)
+        return self.views[key]
+
+    def owns(self, device: BlockDevice) -> bool:
+        return device in (self.device, self.cache, self.direct) or any(
+            device is view for view in self.views.values())
+
+
+class DeviceHandlePool:
+    """进程级设备句柄池
+
+    每个设备路径只保持一个打开的块设备，按引用计数共享；
+    引用计数归零且空闲超过idle_timeout秒的设备会被关闭。
+    每个设备附带一个cache_budget字节的LRU缓存，元数据和交互式浏览走缓存，
+    批量读取可以直接使用原始设备，或者使用绕过系统页缓存的无缓冲设备。
+    每个设备的全部读取(缓存未命中、批量、无缓冲)都经过同一个优先级I/O调度器，
+    后台扫描不会让十六进制浏览等在一次大块读取后面；调度器有queue_depth个工作线程，
+    read_batch发起的分散小块读取可以同时下发到设备。
+    调度器把每次实际下发到设备的读取耗时按区域记入该设备的LatencyMap，
+    用于观察设备哪些区域变慢(内存映射的镜像不经过调度器，不做统计)。
+    """
+
+    def __init__(self, idle_timeout: float = 30.0, cache_budget: int = 64 * 1024 * 1024,
+                 bulk_bandwidth: Optional[float] = None, queue_depth: int = 4):
+        self.idle_timeout = idle_timeout
+        self.cache_budget = cache_budget
+        self.bulk_bandwidth = bulk_bandwidth
+        # 每个设备的调度器工作线程数，即同时下发到设备的读取数
+        self.queue_depth = queue_depth
+        self._entries: Dict[str, PoolEntry] = {}
+        # 磁盘路径 -> 坏扇区图(偏移相对整个磁盘)，分区路径换算到所在磁盘上查询
+        self._bad_maps: Dict[str, RescueMap] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, disk_path: str, cached: bool = True, direct: bool = False,
+                priority: Optional[int] = None) -> BlockDevice:
+        """获取块设备并增加引用计数，用完后必须调用release
+
+        Args:
+            disk_path: 磁盘路径
+            cached: 为True时返回带缓存的设备，为False时返回原始设备(用于批量读取)
+            direct: 为True时返回无缓冲设备(用于整盘雕刻、镜像、校验)，优先于cached
+            priority: 非缓存设备的I/O优先级，为None时使用调用线程的当前优先级
+        """
+        path = normalize_device_path(disk_path)
+        # 打开设备可能很慢(解析E01/VMDK的表、等待磁盘启动)，在锁外进行，
+        # 不阻塞其他设备的获取和释放；放入池中时再检查一次，被别的线程抢先时关闭自己打开的
+        new_entry = None
+        direct_device = None
+        try:
+            while True:
+                with self._lock:
+                    self._close_idle_locked()
+                    entry = self._entries.get(path)
+                    if entry is None and new_entry is not None:
+                        entry, new_entry = new_entry, None
+                        self._entries[path] = entry
+                    if entry is not None and direct and entry.direct is None and direct_device is not None:
+                        entry.direct, direct_device = direct_device, None
+                    if entry is not None and (not direct or entry.direct is not None):
+                        entry.ref_count += 1
+                        entry.last_used = time.monotonic()
+                        if direct:
+                            return entry.view(entry.direct, PRIORITY_BULK if priority is None else priority)
+                        if cached:
+                            return entry.cache
+                        return entry.view(entry.device, priority)
+                if entry is None:
+                    new_entry = self._open_entry(path)
+                else:
+                    direct_device = open_block_device(path, direct=True)
+        finally:
+            if new_entry is not None:
+                self._close_entry(new_entry)
+            if direct_device is not None:
+                try:
+                    direct_device.close()
+                except Exception as e:
+                    logging.error(f"关闭设备 {path} 失败: {str(e)}")
+
+    def _open_entry(self, path: str) -> PoolEntry:
+        """打开设备并创建它的I/O调度器和缓存层(不持有锁时调用)"""
+        device = open_block_device(path)
+        scheduler = IOScheduler(path, self.bulk_bandwidth, workers=self.queue_depth,
+                                latency_map=LatencyMap(device.size, path=path))
+        # 内存映射的镜像已由系统页缓存管理，不再叠加一层缓存
+        if device.zero_copy:
+            cache = device
+        else:
+            cache = CachedBlockDevice(ScheduledDevice(scheduler, device), budget=self.cache_budget)
+        return PoolEntry(device, cache, scheduler)
+
+    def release(self, device: BlockDevice):
+        """释放一次引用，设备本身保留在池中直到空闲超时"""
+        with self._lock:
+            entry = self._entries.get(device.path)
+            if entry is None or not entry.owns(device):
+                return
+            entry.ref_count = max(0, entry.ref_count - 1)
+            entry.last_used = time.monotonic()
+
+    def read(self, disk_path: str, offset: int, length: int) -> bytes:
+        """借用池中设备完成一次读取"""
+        device = self.acquire(disk_path)
+        try:
+            return device.read_at(offset, length)
+        finally:
+            self.release(device)
+
+    def set_bad_sector_map(self, disk_path: str, rescue_map: Optional[RescueMap]):
+        """登记设备的坏扇区图(例如坏扇区抢救的mapfile)，None表示清除"""
+        path = normalize_device_path(disk_path)
+        with self._lock:
+            if rescue_map is None:
+                self._bad_maps.pop(path, None)
+            else:
+                self._bad_maps[path] = rescue_map
+
+    def _bad_map_location(self, disk_path: str, create: bool = False) -> Tuple[Optional[RescueMap], int]:
+        """返回disk_path自身或所在磁盘的坏扇区图，以及disk_path在图中的起始偏移"""
+        path = normalize_device_path(disk_path)
+        with self._lock:
+            rescue_map = self._bad_maps.get(path)
+        if rescue_map is not None:
+            return rescue_map, 0
+        base_path, index = split_partition_path(path)
+        key = normalize_device_path(base_path) if index is not None else path
+        with self._lock:
+            rescue_map = self._bad_maps.get(key)
+        if rescue_map is None and not create:
+            return None, 0
+        device = self.acquire(path, cached=False)
+        try:
+            with self._lock:
+                raw = self._entries[path].device
+            # 分区子设备记录了它在磁盘上的偏移
+            start = raw.offset if index is not None else 0
+            if rescue_map is None:
+                size = raw.base.size if index is not None else raw.size
+                with self._lock:
+                    rescue_map = self._bad_maps.setdefault(key, RescueMap(size))
+            return rescue_map, start
+        finally:
+            self.release(device)
+
+    def bad_extents(self, disk_path: str, offset: int, length: int) -> List[Tuple[int, int]]:
+        """返回[offset, offset+length)中已知读取失败的(偏移, 长度)区间，偏移相对disk_path"""
+        rescue_map, start = self._bad_map_location(disk_path)
+        if rescue_map is None or length <= 0:
+            return []
+        return [(begin - start, size) for begin, size in rescue_map.failed_extents(start + offset, length)]
+
+    def mark_bad(self, disk_path: str, offset: int, length: int):
+        """记录读取失败的区间，之后的扫描和浏览不再读取它们"""
+        rescue_map, start = self._bad_map_location(disk_path, create=True)
+        rescue_map.mark(start + offset, length, STATUS_BAD)
+
+    def invalidate(self, disk_path: str):
+        """丢弃指定设备的缓存内容"""
+        with self._lock:
+            entry = self._entries.get(normalize_device_path(disk_path))
+        if entry is not None and isinstance(entry.cache, CachedBlockDevice):
+            entry.cache.invalidate()
+
+    def cache_stats(self, disk_path: str) -> dict:
+        """返回指定设备的缓存命中统计，设备未打开时返回空字典"""
+        with self._lock:
+            entry = self._entries.get(normalize_device_path(disk_path))
+        if entry is None or not isinstance(entry.cache, CachedBlockDevice):
+            return {}
+        return entry.cache.stats()
+
+    def io_stats(self, disk_path: str) -> dict:
+        """返回指定设备I/O调度器各优先级的队列深度和等待时间，设备未打开时返回空字典"""
+        with self._lock:
+            entry = self._entries.get(normalize_device_path(disk_path))
+        return entry.scheduler.stats() if entry is not None else {}
+
+    def latency_map(self, disk_path: str) -> Optional[LatencyMap]:
+        """返回设备打开以来累计的按区域读取延迟统计，设备未打开时返回None"""
+        with self._lock:
+            entry = self._entries.get(normalize_device_path(disk_path))
+        return entry.scheduler.latency_map if entry is not None else None
+
+    def is_plain_file(self, disk_path: str) -> bool:
+        """池中的设备是否直接打开的普通文件
+
+        分段镜像、VHD/VMDK/E01、压缩镜像和分区的偏移与所在文件的偏移不一致，不能按偏移原地写回。
+        设备未打开时返回False。
+        """
+        path = normalize_device_path(disk_path)
+        with self._lock:
+            entry = self._entries.get(path)
+        return (entry is not None and isinstance(entry.device, (PosixBlockDevice, FileBlockDevice, MmapBlockDevice))
+                and os.path.isfile(path))
+
+    def set_bulk_bandwidth(self, bytes_per_second: Optional[float]):
+        """设置所有设备批量读取的带宽上限(字节/秒)，None表示不限速"""
+        with self._lock:
+            self.bulk_bandwidth = bytes_per_second
+            for entry in self._entries.values():
+                entry.scheduler.set_bulk_bandwidth(bytes_per_second)
+
+    def close_path(self, disk_path: str):
+        """立即关闭指定路径上无人引用的设备(例如覆盖写入镜像文件之前)"""
+        with self._lock:
+            path = normalize_device_path(disk_path)
+            entry = self._entries.get(path)
+            if entry is not None and entry.ref_count == 0:
+                self._close_entry(entry)
+                del self._entries[path]
+
+    def close_idle(self, max_idle: Optional[float] = None):
+        """关闭所有无人引用且空闲超过max_idle秒的设备"""
+        with self._lock:
+            self._close_idle_locked(max_idle)
+
+    def _close_idle_locked(self, max_idle: Optional[float] = None):
+        if max_idle is None:
+            max_idle = self.idle_timeout
+        now = time.monotonic()
+        for path, entry in list(self._entries.items()):
+            if entry.ref_count == 0 and now - entry.last_used >= max_idle:
+                logging.info(f"关闭空闲设备: {path}")
+                self._close_entry(entry)
+                del self._entries[path]
+
+    @staticmethod
+    def _close_entry(entry: PoolEntry):
+        entry.scheduler.close()
+        for device in (entry.cache, entry.device, entry.direct):
+            if device is None or (device is entry.device and entry.cache is entry.device):
+                continue
+            try:
+                device.close()
+            except Exception as e:
+                logging.error(f"关闭设备 {entry.device.path} 失败: {str(e)}")
+
+    def close_all(self):
+        """关闭池中的全部设备(程序退出时调用)"""
+        with self._lock:
+            for entry in self._entries.values():
+                self._close_entry(entry)
+            self._entries.clear()
+
+
+# 全局共享的设备句柄池
+device_pool = DeviceHandlePool()
+atexit.register(device_pool.close_all)
@@ -0,0 +1,197 @@
+import os
+import mmap
+import ctypes
+import threading
+from contextlib import contextmanager
+from block_device import (BlockDevice, IOCTL_DISK_GET_LENGTH_INFO, file_data_extents,
+                          query_posix_sector_sizes, query_win32_sector_sizes)
+
+try:
+    import win32file
+except ImportError:  # 非Windows环境下没有pywin32
+    win32file = None
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl
+    fcntl = None
+
+# 直接I/O缓冲区按页对齐，满足O_DIRECT和FILE_FLAG_NO_BUFFERING对内存地址的要求
+BUFFER_ALIGNMENT = mmap.PAGESIZE
+
+
+def _round_up(value: int, alignment: int) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+
+def _buffer_address(view: memoryview) -> int:
+    """返回可写缓冲区的内存地址，只读缓冲区返回-1"""
+    if view.readonly or len(view) == 0:
+        return -1
+    return ctypes.addressof(ctypes.c_char.from_buffer(view))
+
+
+class AlignedBufferPool:
+    """预分配的页对齐缓冲区池
+
+    缓冲区用匿名内存映射分配，天然按页对齐，可以直接作为无缓冲读取的目标。
+    池中缓冲区用完时acquire阻塞等待其他使用者归还。
+    """
+
+    def __init__(self, buffer_size: int = 4 * 1024 * 1024, count: int = 4):
+        self.buffer_size = _round_up(buffer_size, BUFFER_ALIGNMENT)
+        self.count = count
+        self._free = [mmap.mmap(-1, self.buffer_size) for _ in range(count)]
+        self._cond = threading.Condition()
+
+    def acquire(self) -> mmap.mmap:
+        """取出一个空闲缓冲区，用完后必须调用release"""
+        with self._cond:
+            while not self._free:
+                self._cond.wait()
+            return self._free.pop()
+
+    def release(self, buffer: mmap.mmap):
+        """归还缓冲区"""
+        with self._cond:
+            self._free.append(buffer)
+            self._cond.notify()
+
+    @contextmanager
+    def borrow(self):
+        """以with语句借用一个缓冲区"""
+        buffer = self.acquire()
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+
+# 全局共享的对齐缓冲区池
+aligned_buffer_pool = AlignedBufferPool()
+
+
+class DirectBlockDevice(BlockDevice):
+    """绕过系统页缓存的无缓冲块设备
+
+    Linux上使用O_DIRECT，macOS上使用F_NOCACHE，Windows上使用FILE_FLAG_NO_BUFFERING。
+    无缓冲读取要求偏移、长度和内存地址都按扇区对齐：调用方传入的缓冲区满足对齐时
+    直接读入，否则经由对齐缓冲区池中的缓冲区中转。
+    适合雕刻、镜像、校验这类整盘顺序读取，交互浏览仍应使用带缓存的设备。
+    """
+
+    def __init__(self, path: str, buffer_pool: AlignedBufferPool = None):
+        super().__init__(path)
+        self.buffer_pool = buffer_pool or aligned_buffer_pool
+        self.fd = None
+        self.handle = None
+        self._size = None
+        if path.startswith('\\\\.\\') or (os.name == 'nt' and win32file is not None):
+            self._open_win32(path)
+            self.set_sector_sizes(query_win32_sector_sizes(self.handle))
+        else:
+            self._open_posix(path)
+            self.set_sector_sizes(query_posix_sector_sizes(self.fd))
+        self.lock = threading.Lock()
+
+    def _open_posix(self, path: str):
+        flags = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+        if hasattr(os, 'O_DIRECT'):
+            flags |= os.O_DIRECT
+        elif fcntl is None or not hasattr(fcntl, 'F_NOCACHE'):
+            raise OSError(f"当前平台不支持无缓冲读取: {path}")
+        self.fd = os.open(path, flags)
+        if not hasattr(os, 'O_DIRECT'):
+            fcntl.fcntl(self.fd, fcntl.F_NOCACHE, 1)
+
+    def _open_win32(self, path: str):
+        if win32file is None:
+            raise OSError(f"当前环境不支持无缓冲读取: {path}")
+        self.handle = win32file.CreateFile(
+            path,
+            win32file.GENERIC_READ,
+            win32file.FILE_SHARE_READ | win32file.FILE_SHARE_WRITE,
+            None,
+            win32file.OPEN_EXISTING,
+            win32file.FILE_FLAG_NO_BUFFERING,
+            None
+        )
+
+    @property
+    def alignment(self) -> int:
+        """偏移和长度的对齐粒度(物理扇区，512e磁盘上避免读-改-读)"""
+        return max(512, self.sector_size, self.physical_sector_size)
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            if self.handle is not None:
+                try:
+                    buf = win32file.DeviceIoControl(self.handle, IOCTL_DISK_GET_LENGTH_INFO, None, 8)
+                    self._size = int.from_bytes(buf[:8], 'little')
+                except Exception:
+                    self._size = win32file.GetFileSize(self.handle)
+            else:
+                self._size = os.fstat(self.fd).st_size or os.lseek(self.fd, 0, os.SEEK_END)
+        return self._size
+
+    def _read_aligned(self, offset: int, view: memoryview) -> int:
+        """偏移、长度、地址都已对齐的一次读取"""
+        if self.handle is not None:
+            with self.lock:
+                win32file.SetFilePointer(self.handle, offset, win32file.FILE_BEGIN)
+                _, data = win32file.ReadFile(self.handle, view)
+            return len(data)
+        if hasattr(os, 'preadv'):
+            return os.preadv(self.fd, [view], offset)
+        # 没有preadv的平台用lseek+readv，需要加锁保护文件指针
+        with self.lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            return os.readv(self.fd, [view])
+
+    def readinto(self, offset: int, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        total = len(view)
+        if total == 0:
+            return 0
+        alignment = self.alignment
+        if (offset % alignment == 0 and total % alignment == 0 and
+                _buffer_address(view) % BUFFER_ALIGNMENT == 0):
+            # 调用方的缓冲区已对齐(例如来自aligned_buffer_pool)，不需要中转
+            return self._read_aligned(offset, view)
+
+        done = 0
+        with self.buffer_pool.borrow() as bounce:
+            bounce_view = memoryview(bounce)
+            try:
+                while done < total:
+                    position = offset + done
+                    skip = position % alignment
+                    want = min(len(bounce_view), _round_up(skip + total - done, alignment))
+                    got = self._read_aligned(position - skip, bounce_view[:want])
+                    piece = min(max(0, got - skip), total - done)
+                    view[done:done + piece] = bounce_view[skip:skip + piece]
+                    done += piece
+                    if got < want:
+                        break
+            finally:
+                bounce_view.release()
+        return done
+
+    def data_extents(self, offset: int, length: int):
+        length = min(length, max(0, self.size - offset))
+        if length <= 0:
+            return []
+        if self.fd is None:
+            return [(offset, length)]
+        with self.lock:
+            extents = file_data_extents(self.fd, offset, length)
+        return [(offset, length)] if extents is None else extents
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.handle is not None:
+            self.handle.Close()
+            self.handle = None
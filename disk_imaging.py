@@ -0,0 +1,358 @@
+import os
+import time
+import queue
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Sequence
+from device_pool import device_pool
+from compressed_image import CompressedImageWriter, compress_chunks
+
+# 镜像输出格式
+IMAGE_FORMAT_RAW = 'raw'                # 原始镜像，逐字节对应源设备
+IMAGE_FORMAT_SPARSE = 'sparse'          # 原始镜像，全0的块写成文件空洞
+IMAGE_FORMAT_COMPRESSED = 'compressed'  # 分块压缩、带索引可随机读取的镜像(.ohxz)
+
+IMAGE_FORMAT_NAMES = {
+    IMAGE_FORMAT_RAW: "原始镜像",
+    IMAGE_FORMAT_SPARSE: "稀疏原始镜像",
+    IMAGE_FORMAT_COMPRESSED: "分块压缩镜像",
+}
+
+DEFAULT_HASH_ALGORITHMS = ('md5', 'sha1', 'sha256')
+
+# Windows上把输出文件标记为稀疏文件
+FSCTL_SET_SPARSE = 0x900C4
+
+try:
+    import msvcrt
+    import win32file
+except ImportError:  # 非Windows环境下seek跳过的区域自然成为空洞
+    msvcrt = None
+    win32file = None
+
+
+class _Block:
+    """流水线中的一个缓冲区及其在源设备上的位置"""
+
+    __slots__ = ('offset', 'length', 'buffer', 'pending')
+
+    def __init__(self, buffer: bytearray):
+        self.buffer = buffer
+        self.offset = 0
+        self.length = 0
+        self.pending = 0
+
+
+class DiskImager:
+    """流水线式磁盘镜像
+
+    读线程以无缓冲方式顺序读取源设备，写线程写出镜像，每种哈希各占一个线程，
+    三者通过固定数量的大缓冲区衔接：缓冲区被写线程和全部哈希线程处理完才回到
+    空闲队列，读线程没有空闲缓冲区时等待，因此内存占用恒定为
+    buffer_size * buffer_count，读取速度不受写入和哈希的串行开销拖累。
+    分块压缩格式的压缩在线程池中并行进行，按读取顺序写出。
+    读取失败的块按扇区重试，仍然失败的扇区填0并计入bad_sectors。
+    """
+
+    def __init__(self, source_path: str, output_path: str, image_format: str = IMAGE_FORMAT_RAW,
+                 hash_algorithms: Sequence[str] = DEFAULT_HASH_ALGORITHMS,
+                 buffer_size: int = 4 * 1024 * 1024, buffer_count: int = 8,
+                 chunk_size: int = 64 * 1024, compression_level: int = 1):
+        if image_format not in IMAGE_FORMAT_NAMES:
+            raise ValueError(f"未知的镜像格式: {image_format}")
+        self.source_path = source_path
+        self.output_path = output_path
+        self.image_format = image_format
+        self.hash_algorithms = list(hash_algorithms)
+        self.buffer_size = buffer_size
+        self.buffer_count = max(2, buffer_count)
+        self.chunk_size = chunk_size
+        self.compression_level = compression_level
+        self.total_bytes = 0
+        self.bytes_done = 0
+        self.bad_sectors = 0
+        self.error = None
+        self.result = None
+        self._device = None
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+        self._free = queue.Queue()
+        self._samples = deque()
+        self._started_at = None
+        self._threads = []
+
+    def start(self):
+        """打开源设备并启动读、写、哈希线程，立即返回"""
+        self._device = device_pool.acquire(self.source_path, direct=True)
+        self.total_bytes = self._device.size
+        self._hashers = {name: hashlib.new(name) for name in self.hash_algorithms}
+        # 缓冲区大小按物理扇区对齐
+        alignment = max(1, self._device.physical_sector_size)
+        self.buffer_size = max(alignment, self.buffer_size // alignment * alignment)
+        if self.image_format == IMAGE_FORMAT_COMPRESSED:
+            self.buffer_size = max(self.chunk_size, self.buffer_size // self.chunk_size * self.chunk_size)
+        for _ in range(self.buffer_count):
+            self._free.put(_Block(bytearray(self.buffer_size)))
+
+        self._started_at = time.monotonic()
+        self._samples.append((self._started_at, 0))
+        consumers = [(f"hash-{name}", lambda block, h=h: h.update(memoryview(block.buffer)[:block.length]))
+                     for name, h in self._hashers.items()]
+        self._queues = [queue.Queue() for _ in range(len(consumers) + 1)]
+        self._threads = [threading.Thread(target=self._read_loop, name="image-read", daemon=True),
+                         threading.Thread(target=self._write_loop, args=(self._queues[0],),
+                                          name="image-write", daemon=True)]
+        for (name, action), q in zip(consumers, self._queues[1:]):
+            self._threads.append(threading.Thread(target=self._consume_loop, args=(q, action),
+                                                  name=f"image-{name}", daemon=True))
+        threading.Thread(target=self._supervise, name="image-supervisor", daemon=True).start()
+        logging.info(f"开始创建镜像: {self.source_path} -> {self.output_path} "
+                     f"({IMAGE_FORMAT_NAMES[self.image_format]}, {self.total_bytes} 字节)")
+
+    def run(self) -> Dict:
+        """创建镜像并等待完成，返回结果，出错时抛出异常"""
+        self.start()
+        self.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待镜像完成，返回是否已结束"""
+        return self._finished.wait(timeout)
+
+    def cancel(self):
+        """取消镜像，已写出的输出文件保留"""
+        self._cancel.set()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def progress(self) -> Dict:
+        """返回已完成字节数、最近几秒的速度(字节/秒)和预计剩余秒数"""
+        with self._lock:
+            done = self.bytes_done
+            if len(self._samples) >= 2:
+                (t0, b0), (t1, b1) = self._samples[0], self._samples[-1]
+                speed = (b1 - b0) / (t1 - t0) if t1 > t0 else 0.0
+            else:
+                speed = 0.0
+        eta = (self.total_bytes - done) / speed if speed > 0 else None
+        return {
+            'bytes_done': done,
+            'total_bytes': self.total_bytes,
+            'speed': speed,
+            'eta': eta,
+            'bad_sectors': self.bad_sectors,
+        }
+
+    def _supervise(self):
+        """运行各线程，全部结束后汇总结果并归还源设备"""
+        for thread in self._threads:
+            thread.start()
+        for thread in self._threads:
+            thread.join()
+        elapsed = time.monotonic() - self._started_at
+        device_pool.release(self._device)
+        if self.error is None and self._cancel.is_set():
+            self.error = Exception("镜像已取消")
+        if self.error is None:
+            self.result = {
+                'source': self.source_path,
+                'output': self.output_path,
+                'format': self.image_format,
+                'bytes': self.bytes_done,
+                'elapsed': elapsed,
+                'speed': self.bytes_done / elapsed if elapsed > 0 else 0.0,
+                'bad_sectors': self.bad_sectors,
+                'hashes': {name: h.hexdigest() for name, h in self._hashers.items()},
+            }
+            logging.info(f"镜像完成: {self.result}")
+        else:
+            logging.error(f"创建镜像失败: {str(self.error)}")
+        self._finished.set()
+
+    def _fail(self, error: Exception):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+        self._cancel.set()
+
+    def _release(self, block: _Block):
+        """一个消费者处理完缓冲区，全部处理完时归还空闲队列"""
+        with self._lock:
+            block.pending -= 1
+            if block.pending:
+                return
+        self._free.put(block)
+
+    def _read_block(self, block: _Block):
+        """读取一个块，整块读取失败时按扇区重试"""
+        view = memoryview(block.buffer)[:block.length]
+        try:
+            got = self._device.readinto(block.offset, view)
+        except Exception as e:
+            # Windows上读取错误是pywintypes.error，不是OSError
+            logging.error(f"读取偏移 {block.offset} 失败，按扇区重试: {str(e)}")
+            sector_size = max(1, self._device.sector_size)
+            for start in range(0, block.length, sector_size):
+                piece = view[start:start + sector_size]
+                try:
+                    if self._device.readinto(block.offset + start, piece) == len(piece):
+                        continue
+                except Exception:
+                    pass
+                # 读不出的扇区以0填充并计数
+                piece[:] = bytes(len(piece))
+                with self._lock:
+                    self.bad_sectors += 1
+            got = block.length
+        if got < block.length:
+            view[got:] = bytes(block.length - got)
+
+    def _read_loop(self):
+        try:
+            offset = 0
+            while offset < self.total_bytes and not self._cancel.is_set():
+                try:
+                    block = self._free.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                block.offset = offset
+                block.length = min(self.buffer_size, self.total_bytes - offset)
+                self._read_block(block)
+                block.pending = len(self._queues)
+                for q in self._queues:
+                    q.put(block)
+                offset += block.length
+        except Exception as e:
+            self._fail(e)
+        finally:
+            for q in self._queues:
+                q.put(None)
+
+    def _consume_loop(self, q: queue.Queue, action):
+        """哈希线程：按顺序处理每个块；出错后继续取出并归还缓冲区，避免读线程卡住"""
+        for block in iter(q.get, None):
+            try:
+                if self.error is None:
+                    action(block)
+            except Exception as e:
+                self._fail(e)
+            finally:
+                self._release(block)
+
+    def _record_progress(self, length: int):
+        with self._lock:
+            self.bytes_done += length
+            now = time.monotonic()
+            self._samples.append((now, self.bytes_done))
+            # 速度按最近3秒计算
+            while len(self._samples) > 2 and now - self._samples[0][0] > 3.0:
+                self._samples.popleft()
+
+    def _write_loop(self, q: queue.Queue):
+        if self.image_format == IMAGE_FORMAT_COMPRESSED:
+            self._write_compressed(q)
+        else:
+            self._write_raw(q)
+
+    def _write_raw(self, q: queue.Queue):
+        sparse = self.image_format == IMAGE_FORMAT_SPARSE
+        zero = bytes(self.buffer_size)
+        output = None
+        try:
+            output = open(self.output_path, 'wb')
+            if sparse:
+                self._mark_sparse(output)
+        except Exception as e:
+            self._fail(e)
+        for block in iter(q.get, None):
+            try:
+                if self.error is None:
+                    data = memoryview(block.buffer)[:block.length]
+                    if sparse and (block.buffer == zero if block.length == self.buffer_size
+                                   else data == zero[:block.length]):
+                        # 全0的块不写入，留下文件空洞
+                        output.seek(block.length, os.SEEK_CUR)
+                    else:
+                        output.write(data)
+                    self._record_progress(block.length)
+            except Exception as e:
+                self._fail(e)
+            finally:
+                self._release(block)
+        if output is not None:
+            try:
+                if sparse and self.error is None:
+                    # 末尾是空洞时补齐文件长度
+                    output.truncate(self.bytes_done)
+                output.close()
+            except Exception as e:
+                self._fail(e)
+
+    def _mark_sparse(self, output):
+        """Windows上需要显式设置稀疏属性，seek跳过的区域才不占磁盘空间"""
+        if msvcrt is None or win32file is None:
+            return
+        try:
+            win32file.DeviceIoControl(msvcrt.get_osfhandle(output.fileno()), FSCTL_SET_SPARSE, None, 0)
+        except Exception as e:
+            logging.error(f"设置稀疏文件属性失败，全0块将占用磁盘空间: {str(e)}")
+
+    def _write_compressed(self, q: queue.Queue):
+        writer = None
+        workers = max(1, min(self.buffer_count - 1, os.cpu_count() or 1))
+        # 已提交压缩、等待按顺序写出的块
+        pending = deque()
+        try:
+            writer = CompressedImageWriter(self.output_path, self.total_bytes, self.chunk_size,
+                                           (self._device.sector_size, self._device.physical_sector_size),
+                                           self.source_path)
+        except Exception as e:
+            self._fail(e)
+
+        def flush_one():
+            block, future = pending.popleft()
+            try:
+                chunks = future.result()
+                if self.error is None:
+                    writer.write_chunks(chunks)
+                    self._record_progress(block.length)
+            except Exception as e:
+                self._fail(e)
+            finally:
+                self._release(block)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-compress") as executor:
+            for block in iter(q.get, None):
+                if self.error is not None:
+                    self._release(block)
+                    continue
+                pending.append((block, executor.submit(
+                    compress_chunks, memoryview(block.buffer)[:block.length], self.chunk_size,
+                    self.compression_level)))
+                # 按顺序写出已经压缩完成的块。在途的块最多占用buffer_count-1个缓冲区；
+                # 没有空闲缓冲区时先等最早的块压缩完写出，否则读线程拿不到缓冲区，这里也等不到下一块
+                limit = min(workers * 2, self.buffer_count - 1)
+                while pending and (pending[0][1].done() or len(pending) >= limit or self._free.empty()):
+                    flush_one()
+            while pending:
+                flush_one()
+
+        if writer is not None:
+            try:
+                if self.error is None and not self._cancel.is_set():
+                    # 哈希线程可能还没处理完最后一块，等它们结束后再写入摘要
+                    for thread in self._threads[2:]:
+                        thread.join()
+                    writer.finish({name: h.digest() for name, h in self._hashers.items()})
+                else:
+                    writer.abort()
+            except Exception as e:
+                self._fail(e)
@@ -0,0 +1,245 @@
+from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel,
+                            QPushButton, QProgressBar, QFileDialog, QMessageBox,
+                            QComboBox, QCheckBox, QLineEdit, QFormLayout)
+from PyQt6.QtCore import QTimer
+import os
+import logging
+from disk_imaging import (DiskImager, IMAGE_FORMAT_NAMES, IMAGE_FORMAT_COMPRESSED,
+                          DEFAULT_HASH_ALGORITHMS)
+from compressed_image import COMPRESSED_IMAGE_EXTENSION
+
+
+class DiskImagingDialog(QDialog):
+    """创建磁盘镜像对话框，镜像在后台线程中进行，定时刷新进度、速度和剩余时间"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("创建磁盘镜像")
+        self.setMinimumSize(700, 320)
+        self.setStyleSheet("""
+            QDialog {
+                background-color: #2c2c2c;
+            }
+            QLabel {
+                color: #ffffff;
+                font-size: 12pt;
+                font-weight: normal;
+            }
+            QPushButton {
+                padding: 5px 15px;
+                background-color: #0078d7;
+                color: white;
+                border: none;
+                border-radius: 3px;
+                font-size: 12pt;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #106ebe;
+            }
+            QPushButton:disabled {
+                background-color: #444444;
+                color: #999999;
+            }
+            QLineEdit, QComboBox {
+                padding: 5px;
+                border: 1px solid #555555;
+                border-radius: 3px;
+                background-color: #1e1e1e;
+                color: white;
+                font-size: 11pt;
+            }
+            QComboBox QAbstractItemView {
+                background-color: #1e1e1e;
+                color: white;
+                selection-background-color: #0078d7;
+            }
+            QCheckBox {
+                font-size: 11pt;
+                color: white;
+            }
+            QProgressBar {
+                border: 1px solid #555555;
+                border-radius: 3px;
+                text-align: center;
+                font-size: 10pt;
+                color: white;
+                background-color: #1e1e1e;
+            }
+            QProgressBar::chunk {
+                background-color: #0078d7;
+                width: 10px;
+            }
+        """)
+
+        # 正在进行的镜像任务
+        self.imager = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(500)
+        self.timer.timeout.connect(self.update_progress)
+
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+        layout.setSpacing(10)
+        form = QFormLayout()
+
+        # 源设备
+        source_layout = QHBoxLayout()
+        self.source_combo = QComboBox()
+        self.browse_source_button = QPushButton("镜像文件...")
+        self.browse_source_button.clicked.connect(self.browse_source)
+        source_layout.addWidget(self.source_combo, 1)
+        source_layout.addWidget(self.browse_source_button)
+        form.addRow("源设备:", source_layout)
+
+        # 输出文件
+        output_layout = QHBoxLayout()
+        self.output_edit = QLineEdit()
+        self.browse_output_button = QPushButton("浏览...")
+        self.browse_output_button.clicked.connect(self.browse_output)
+        output_layout.addWidget(self.output_edit, 1)
+        output_layout.addWidget(self.browse_output_button)
+        form.addRow("输出文件:", output_layout)
+
+        self.format_combo = QComboBox()
+        for image_format, name in IMAGE_FORMAT_NAMES.items():
+            self.format_combo.addItem(name, image_format)
+        form.addRow("镜像格式:", self.format_combo)
+
+        hash_layout = QHBoxLayout()
+        self.hash_checks = {}
+        for name in DEFAULT_HASH_ALGORITHMS:
+            check = QCheckBox(name.upper())
+            check.setChecked(True)
+            self.hash_checks[name] = check
+            hash_layout.addWidget(check)
+        hash_layout.addStretch()
+        form.addRow("校验值:", hash_layout)
+        layout.addLayout(form)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1000)
+        self.status_label = QLabel("")
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.status_label)
+        layout.addStretch()
+
+        buttons_layout = QHBoxLayout()
+        self.start_button = QPushButton("开始")
+        self.start_button.clicked.connect(self.start_imaging)
+        self.cancel_button = QPushButton("取消")
+        self.cancel_button.clicked.connect(self.cancel_imaging)
+        self.cancel_button.setEnabled(False)
+        self.close_button = QPushButton("关闭")
+        self.close_button.clicked.connect(self.close)
+        buttons_layout.addWidget(self.start_button)
+        buttons_layout.addWidget(self.cancel_button)
+        buttons_layout.addStretch()
+        buttons_layout.addWidget(self.close_button)
+        layout.addLayout(buttons_layout)
+
+        self.init_source_list()
+
+    def init_source_list(self):
+        """列出物理磁盘和逻辑驱动器"""
+        try:
+            from disk_utils import DiskUtils
+            drives, physicals = DiskUtils.get_disk_list_grouped()
+            for path, name in physicals:
+                self.source_combo.addItem(name, path)
+            for path, label in drives:
+                self.source_combo.addItem(label, path)
+        except Exception as e:
+            logging.error(f"获取磁盘列表失败: {str(e)}")
+
+    def browse_source(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "选择源镜像", "",
+                                                   "磁盘镜像 (*.img *.dd *.raw *.bin *.vhd *.vmdk *.E01 *.001 *.ohxz);;所有文件 (*.*)")
+        if file_name:
+            self.source_combo.addItem(os.path.basename(file_name), file_name)
+            self.source_combo.setCurrentIndex(self.source_combo.count() - 1)
+
+    def browse_output(self):
+        if self.format_combo.currentData() == IMAGE_FORMAT_COMPRESSED:
+            file_filter = f"分块压缩镜像 (*{COMPRESSED_IMAGE_EXTENSION});;所有文件 (*.*)"
+        else:
+            file_filter = "原始镜像 (*.img *.dd);;所有文件 (*.*)"
+        file_name, _ = QFileDialog.getSaveFileName(self, "保存镜像", "", file_filter)
+        if file_name:
+            self.output_edit.setText(file_name)
+
+    def start_imaging(self):
+        source = self.source_combo.currentData()
+        output = self.output_edit.text().strip()
+        if not source or not output:
+            QMessageBox.warning(self, "警告", "请选择源设备和输出文件")
+            return
+        image_format = self.format_combo.currentData()
+        if image_format == IMAGE_FORMAT_COMPRESSED and not output.lower().endswith(COMPRESSED_IMAGE_EXTENSION):
+            output += COMPRESSED_IMAGE_EXTENSION
+            self.output_edit.setText(output)
+        hashes = [name for name, check in self.hash_checks.items() if check.isChecked()]
+        try:
+            self.imager = DiskImager(source, output, image_format, hashes)
+            self.imager.start()
+        except Exception as e:
+            self.imager = None
+            logging.error(f"创建镜像失败: {str(e)}")
+            QMessageBox.critical(self, "错误", f"创建镜像失败: {str(e)}")
+            return
+        self.set_running(True)
+        self.progress_bar.setValue(0)
+        self.timer.start()
+
+    def cancel_imaging(self):
+        if self.imager is not None:
+            self.imager.cancel()
+
+    def set_running(self, running: bool):
+        for widget in (self.source_combo, self.browse_source_button, self.output_edit,
+                       self.browse_output_button, self.format_combo, self.start_button,
+                       *self.hash_checks.values()):
+            widget.setEnabled(not running)
+        self.cancel_button.setEnabled(running)
+
+    def update_progress(self):
+        if self.imager is None:
+            return
+        progress = self.imager.progress()
+        total = progress['total_bytes']
+        if total:
+            self.progress_bar.setValue(int(progress['bytes_done'] * 1000 / total))
+        eta = progress['eta']
+        eta_text = f"{int(eta) // 3600:d}:{int(eta) // 60 % 60:02d}:{int(eta) % 60:02d}" if eta is not None else "--"
+        status = (f"{progress['bytes_done'] / (1024 * 1024):.0f} / {total / (1024 * 1024):.0f} MB    "
+                  f"{progress['speed'] / (1024 * 1024):.1f} MB/s    剩余 {eta_text}")
+        if progress['bad_sectors']:
+            status += f"    坏扇区 {progress['bad_sectors']}"
+        self.status_label.setText(status)
+
+        if not self.imager.finished:
+            return
+        self.timer.stop()
+        self.set_running(False)
+        imager, self.imager = self.imager, None
+        if imager.error is not None:
+            QMessageBox.critical(self, "错误", f"创建镜像失败: {str(imager.error)}")
+            return
+        result = imager.result
+        self.progress_bar.setValue(1000)
+        lines = [f"镜像完成: {result['output']}",
+                 f"大小: {result['bytes']} 字节, 平均速度 {result['speed'] / (1024 * 1024):.1f} MB/s"]
+        if result['bad_sectors']:
+            lines.append(f"坏扇区: {result['bad_sectors']} (已填0)")
+        lines.extend(f"{name.upper()}: {digest}" for name, digest in result['hashes'].items())
+        QMessageBox.information(self, "镜像完成", "\n".join(lines))
+
+    def closeEvent(self, event):
+        # 关闭对话框时取消未完成的镜像
+        if self.imager is not None:
+            self.imager.cancel()
+            self.imager.wait()
+            self.timer.stop()
+        super().closeEvent(event)
@@ -0,0 +1,188 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, Optional
+from device_pool import device_pool
+from rescue_map import (RescueMap, STATUS_UNTRIED, STATUS_NON_TRIMMED, STATUS_NON_SCRAPED,
+                        STATUS_BAD, STATUS_GOOD)
+
+
+class DiskRescue:
+    """类似ddrescue的多轮坏扇区抢救
+
+    第1轮用大块顺序读取未读区域，读取失败的块标记为未修整(*)并向后跳过一段
+    (连续失败时跳过距离加倍)，尽快拿到好区域的数据；第2轮不再跳过，补读第1轮
+    跳过的区域。之后各轮只在失败区域内读取，每轮块大小缩小为上一轮的1/8，
+    直到逐扇区读取，仍然失败的扇区标记为坏扇区(-)，最后按retries次数重试坏扇区。
+    读到的数据写入输出镜像的相同偏移处；状态图定期保存到mapfile，中断后
+    用同一个mapfile再次运行会从上次的状态继续。
+    抢救期间状态图登记到设备句柄池，扫描和浏览会跳过已知的失败区域。
+    """
+
+    def __init__(self, source_path: str, output_path: str, map_path: str,
+                 block_size: int = 1024 * 1024, max_skip: int = 64 * 1024 * 1024,
+                 retries: int = 1, save_interval: float = 5.0):
+        self.source_path = source_path
+        self.output_path = output_path
+        self.map_path = map_path
+        self.block_size = block_size
+        self.max_skip = max_skip
+        self.retries = retries
+        self.save_interval = save_interval
+        self.rescue_map = None
+        self.sector_size = 512
+        self.current_pass = 0
+        self.error = None
+        self._device = None
+        self._output = None
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        self._last_save = 0.0
+
+    def start(self):
+        """打开源设备、输出镜像和mapfile，在后台线程中开始抢救"""
+        self._device = device_pool.acquire(self.source_path, direct=True)
+        try:
+            size = self._device.size
+            self.sector_size = max(1, self._device.sector_size)
+            # 块大小按扇区对齐
+            self.block_size = max(self.sector_size, self.block_size // self.sector_size * self.sector_size)
+            self.rescue_map = RescueMap.load(self.map_path, size)
+            self._output = open(self.output_path, 'r+b' if os.path.exists(self.output_path) else 'w+b')
+        except Exception:
+            device_pool.release(self._device)
+            raise
+        device_pool.set_bad_sector_map(self.source_path, self.rescue_map)
+        threading.Thread(target=self._run, name="disk-rescue", daemon=True).start()
+
+    def run(self) -> Dict:
+        """抢救并等待完成，返回各状态的字节数，出错时抛出异常"""
+        self.start()
+        self.wait()
+        if self.error is not None:
+            raise self.error
+        return self.rescue_map.totals()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def cancel(self):
+        """停止抢救，已读取的数据和状态图会保存，之后可以继续"""
+        self._cancel.set()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def progress(self) -> Dict:
+        """返回当前轮次、位置以及已抢救/失败/未读取的字节数"""
+        totals = self.rescue_map.totals() if self.rescue_map else {}
+        return {
+            'pass': self.current_pass,
+            'position': self.rescue_map.current_pos if self.rescue_map else 0,
+            'total_bytes': self.rescue_map.size if self.rescue_map else 0,
+            'rescued': totals.get(STATUS_GOOD, 0),
+            'bad': totals.get(STATUS_BAD, 0),
+            'failed': totals.get(STATUS_NON_TRIMMED, 0) + totals.get(STATUS_NON_SCRAPED, 0),
+            'untried': totals.get(STATUS_UNTRIED, 0),
+        }
+
+    def _run(self):
+        try:
+            self._copy_pass(1, skip=True)
+            self._copy_pass(2, skip=False)
+            block_size = self.block_size
+            pass_number = 3
+            while not self._cancel.is_set():
+                block_size = max(self.sector_size, block_size // 8 // self.sector_size * self.sector_size)
+                self._shrink_pass(pass_number, block_size)
+                pass_number += 1
+                if block_size == self.sector_size:
+                    break
+            for _ in range(self.retries):
+                if self._cancel.is_set():
+                    break
+                self._shrink_pass(pass_number, self.sector_size, (STATUS_BAD,))
+                pass_number += 1
+        except Exception as e:
+            self.error = e
+            logging.error(f"坏扇区抢救失败: {str(e)}")
+        finally:
+            try:
+                # 末尾是坏扇区或未读区域时补齐输出镜像的长度
+                self._output.seek(0, os.SEEK_END)
+                if self._output.tell() < self.rescue_map.size:
+                    self._output.truncate(self.rescue_map.size)
+                self._output.close()
+                self.rescue_map.save()
+            except Exception as e:
+                logging.error(f"保存抢救结果失败: {str(e)}")
+                if self.error is None:
+                    self.error = e
+            device_pool.release(self._device)
+            logging.info(f"坏扇区抢救结束: {self.rescue_map.totals()}")
+            self._finished.set()
+
+    def _read_block(self, offset: int, length: int) -> bool:
+        """读取一块并写入输出镜像，返回是否成功"""
+        buffer = bytearray(length)
+        try:
+            got = self._device.readinto(offset, buffer)
+        except Exception as e:
+            # Windows上读取错误是pywintypes.error，不是OSError
+            logging.debug(f"读取偏移 {offset} 长度 {length} 失败: {str(e)}")
+            return False
+        if got < length:
+            return False
+        self._output.seek(offset)
+        self._output.write(buffer)
+        return True
+
+    def _checkpoint(self, position: int, status: str):
+        self.rescue_map.current_pos = position
+        self.rescue_map.current_status = status
+        self.rescue_map.current_pass = self.current_pass
+        now = time.monotonic()
+        if now - self._last_save >= self.save_interval:
+            self._output.flush()
+            self.rescue_map.save()
+            self._last_save = now
+
+    def _copy_pass(self, pass_number: int, skip: bool):
+        """读取未读区域；skip为True时失败后向后跳过，跳过的区域留给下一轮"""
+        self.current_pass = pass_number
+        skip_size = self.block_size
+        for start, length, _ in self.rescue_map.extents((STATUS_UNTRIED,)):
+            position = start
+            end = start + length
+            while position < end and not self._cancel.is_set():
+                # 块边界按block_size对齐，重试轮次的小块不会跨越大块边界
+                piece = min(self.block_size - position % self.block_size, end - position)
+                if self._read_block(position, piece):
+                    self.rescue_map.mark(position, piece, STATUS_GOOD)
+                    skip_size = self.block_size
+                    position += piece
+                else:
+                    self.rescue_map.mark(position, piece, STATUS_NON_TRIMMED)
+                    position += piece
+                    if skip:
+                        position = min(end, position + skip_size)
+                        skip_size = min(self.max_skip, skip_size * 2)
+                self._checkpoint(position, STATUS_UNTRIED)
+
+    def _shrink_pass(self, pass_number: int, block_size: int,
+                     statuses=(STATUS_NON_TRIMMED, STATUS_NON_SCRAPED)):
+        """只在失败区域内以block_size重新读取，逐扇区仍然失败的标记为坏扇区"""
+        self.current_pass = pass_number
+        for start, length, _ in self.rescue_map.extents(statuses):
+            position = start
+            end = start + length
+            while position < end and not self._cancel.is_set():
+                piece = min(block_size - position % block_size, end - position)
+                if self._read_block(position, piece):
+                    self.rescue_map.mark(position, piece, STATUS_GOOD)
+                elif piece <= self.sector_size:
+                    self.rescue_map.mark(position, piece, STATUS_BAD)
+                position += piece
+                self._checkpoint(position, statuses[0])
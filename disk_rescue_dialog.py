@@ -0,0 +1,245 @@
+from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel,
+                            QPushButton, QProgressBar, QFileDialog, QMessageBox,
+                            QComboBox, QSpinBox, QLineEdit, QFormLayout)
+from PyQt6.QtCore import QTimer
+import os
+import logging
+from disk_rescue import DiskRescue
+
+
+class DiskRescueDialog(QDialog):
+    """坏扇区抢救对话框，抢救在后台线程中进行，定时刷新轮次和各状态的字节数
+
+    使用已有的mapfile再次开始时从上次的状态继续。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("坏扇区抢救")
+        self.setMinimumSize(700, 320)
+        self.setStyleSheet("""
+            QDialog {
+                background-color: #2c2c2c;
+            }
+            QLabel {
+                color: #ffffff;
+                font-size: 12pt;
+                font-weight: normal;
+            }
+            QPushButton {
+                padding: 5px 15px;
+                background-color: #0078d7;
+                color: white;
+                border: none;
+                border-radius: 3px;
+                font-size: 12pt;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #106ebe;
+            }
+            QPushButton:disabled {
+                background-color: #444444;
+                color: #999999;
+            }
+            QLineEdit, QComboBox, QSpinBox {
+                padding: 5px;
+                border: 1px solid #555555;
+                border-radius: 3px;
+                background-color: #1e1e1e;
+                color: white;
+                font-size: 11pt;
+            }
+            QComboBox QAbstractItemView {
+                background-color: #1e1e1e;
+                color: white;
+                selection-background-color: #0078d7;
+            }
+            QCheckBox {
+                font-size: 11pt;
+                color: white;
+            }
+            QProgressBar {
+                border: 1px solid #555555;
+                border-radius: 3px;
+                text-align: center;
+                font-size: 10pt;
+                color: white;
+                background-color: #1e1e1e;
+            }
+            QProgressBar::chunk {
+                background-color: #0078d7;
+                width: 10px;
+            }
+        """)
+
+        # 正在进行的抢救任务
+        self.rescue = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(500)
+        self.timer.timeout.connect(self.update_progress)
+
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+        layout.setSpacing(10)
+        form = QFormLayout()
+
+        # 源设备
+        source_layout = QHBoxLayout()
+        self.source_combo = QComboBox()
+        self.browse_source_button = QPushButton("镜像文件...")
+        self.browse_source_button.clicked.connect(self.browse_source)
+        source_layout.addWidget(self.source_combo, 1)
+        source_layout.addWidget(self.browse_source_button)
+        form.addRow("源设备:", source_layout)
+
+        # 输出镜像
+        output_layout = QHBoxLayout()
+        self.output_edit = QLineEdit()
+        self.browse_output_button = QPushButton("浏览...")
+        self.browse_output_button.clicked.connect(self.browse_output)
+        output_layout.addWidget(self.output_edit, 1)
+        output_layout.addWidget(self.browse_output_button)
+        form.addRow("输出镜像:", output_layout)
+
+        # mapfile
+        map_layout = QHBoxLayout()
+        self.map_edit = QLineEdit()
+        self.browse_map_button = QPushButton("浏览...")
+        self.browse_map_button.clicked.connect(self.browse_map)
+        map_layout.addWidget(self.map_edit, 1)
+        map_layout.addWidget(self.browse_map_button)
+        form.addRow("Mapfile:", map_layout)
+
+        self.retries_spin = QSpinBox()
+        self.retries_spin.setRange(0, 16)
+        self.retries_spin.setValue(1)
+        form.addRow("坏扇区重试次数:", self.retries_spin)
+        layout.addLayout(form)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1000)
+        self.status_label = QLabel("")
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.status_label)
+        layout.addStretch()
+
+        buttons_layout = QHBoxLayout()
+        self.start_button = QPushButton("开始")
+        self.start_button.clicked.connect(self.start_rescue)
+        self.cancel_button = QPushButton("停止")
+        self.cancel_button.clicked.connect(self.cancel_rescue)
+        self.cancel_button.setEnabled(False)
+        self.close_button = QPushButton("关闭")
+        self.close_button.clicked.connect(self.close)
+        buttons_layout.addWidget(self.start_button)
+        buttons_layout.addWidget(self.cancel_button)
+        buttons_layout.addStretch()
+        buttons_layout.addWidget(self.close_button)
+        layout.addLayout(buttons_layout)
+
+        self.init_source_list()
+
+    def init_source_list(self):
+        """列出物理磁盘和逻辑驱动器"""
+        try:
+            from disk_utils import DiskUtils
+            drives, physicals = DiskUtils.get_disk_list_grouped()
+            for path, name in physicals:
+                self.source_combo.addItem(name, path)
+            for path, label in drives:
+                self.source_combo.addItem(label, path)
+        except Exception as e:
+            logging.error(f"获取磁盘列表失败: {str(e)}")
+
+    def browse_source(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "选择源镜像", "",
+                                                   "磁盘镜像 (*.img *.dd *.raw *.bin *.vhd *.vmdk *.E01 *.001);;所有文件 (*.*)")
+        if file_name:
+            self.source_combo.addItem(os.path.basename(file_name), file_name)
+            self.source_combo.setCurrentIndex(self.source_combo.count() - 1)
+
+    def browse_output(self):
+        file_name, _ = QFileDialog.getSaveFileName(self, "保存镜像", "", "原始镜像 (*.img *.dd);;所有文件 (*.*)")
+        if file_name:
+            self.output_edit.setText(file_name)
+            if not self.map_edit.text().strip():
+                self.map_edit.setText(os.path.splitext(file_name)[0] + ".map")
+
+    def browse_map(self):
+        # mapfile可以是已有的(继续上次的抢救)，也可以是新文件
+        file_name, _ = QFileDialog.getSaveFileName(self, "选择Mapfile", "", "Mapfile (*.map *.log);;所有文件 (*.*)",
+                                                   options=QFileDialog.Option.DontConfirmOverwrite)
+        if file_name:
+            self.map_edit.setText(file_name)
+
+    def start_rescue(self):
+        source = self.source_combo.currentData()
+        output = self.output_edit.text().strip()
+        map_path = self.map_edit.text().strip()
+        if not source or not output or not map_path:
+            QMessageBox.warning(self, "警告", "请选择源设备、输出镜像和Mapfile")
+            return
+        try:
+            self.rescue = DiskRescue(source, output, map_path, retries=self.retries_spin.value())
+            self.rescue.start()
+        except Exception as e:
+            self.rescue = None
+            logging.error(f"坏扇区抢救失败: {str(e)}")
+            QMessageBox.critical(self, "错误", f"坏扇区抢救失败: {str(e)}")
+            return
+        self.set_running(True)
+        self.timer.start()
+        self.update_progress()
+
+    def cancel_rescue(self):
+        if self.rescue is not None:
+            self.rescue.cancel()
+
+    def set_running(self, running: bool):
+        for widget in (self.source_combo, self.browse_source_button, self.output_edit,
+                       self.browse_output_button, self.map_edit, self.browse_map_button,
+                       self.retries_spin, self.start_button):
+            widget.setEnabled(not running)
+        self.cancel_button.setEnabled(running)
+
+    def update_progress(self):
+        if self.rescue is None:
+            return
+        progress = self.rescue.progress()
+        total = progress['total_bytes']
+        if total:
+            self.progress_bar.setValue(int(progress['rescued'] * 1000 / total))
+        mb = 1024 * 1024
+        self.status_label.setText(
+            f"第 {progress['pass']} 轮  位置 {progress['position'] / mb:.0f} MB    "
+            f"已抢救 {progress['rescued'] / mb:.1f} MB    未读取 {progress['untried'] / mb:.1f} MB    "
+            f"待重试 {progress['failed'] / mb:.1f} MB    坏扇区 {progress['bad'] / mb:.2f} MB")
+
+        if not self.rescue.finished:
+            return
+        self.timer.stop()
+        self.set_running(False)
+        rescue, self.rescue = self.rescue, None
+        if rescue.error is not None:
+            QMessageBox.critical(self, "错误", f"坏扇区抢救失败: {str(rescue.error)}")
+            return
+        progress = rescue.progress()
+        lines = [f"输出镜像: {rescue.output_path}",
+                 f"Mapfile: {rescue.map_path}",
+                 f"已抢救: {progress['rescued']} / {progress['total_bytes']} 字节"]
+        if progress['bad'] or progress['failed']:
+            lines.append(f"无法读取: {progress['bad'] + progress['failed']} 字节 (输出镜像中为0)")
+        if progress['untried']:
+            lines.append(f"未读取: {progress['untried']} 字节，使用同一个Mapfile再次开始可以继续")
+        QMessageBox.information(self, "抢救结束", "\n".join(lines))
+
+    def closeEvent(self, event):
+        # 关闭对话框时停止抢救，状态图已保存，之后可以继续
+        if self.rescue is not None:
+            self.rescue.cancel()
+            self.rescue.wait()
+            self.timer.stop()
+        super().closeEvent(event)
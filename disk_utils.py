@@ -1,14 +1,28 @@
 import logging
-import win32api
-import win32file
 import string
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+from device_pool import device_pool
+from partition_table import Partition, get_partitions
+
+try:
+    import win32api
+    import win32file
+except ImportError:  # 非Windows环境下只能打开镜像文件，没有磁盘列表
+    win32api = None
+    win32file = None
 
 class DiskUtils:
+    # 批量读取时单次读取的最大字节数
+    MAX_BULK_READ = 4 * 1024 * 1024
+    # 读取范围达到该字节数时默认使用无缓冲读取，避免冲掉系统页缓存
+    DIRECT_IO_MIN_BYTES = 64 * 1024 * 1024
+
     @staticmethod
     def get_disk_list() -> List[Tuple[str, str]]:
         """获取所有可用的磁盘驱动器列表"""
         drives = []
+        if win32api is None:
+            return drives
         bitmask = win32api.GetLogicalDrives()
         for letter in string.ascii_uppercase:
             if bitmask & 1:
@@ -30,216 +44,223 @@ class DiskUtils:
             if not (len(drive_letter) == 2 and drive_letter[1] == ':'):
                 raise ValueError(f"无效的驱动器盘符格式: {drive_letter}")
             
-            # 尝试使用win32file方式读取
-            try:
-                logging.info(f"尝试使用win32file方式读取: {drive_letter}")
-                handle = win32file.CreateFile(
-                    f"\\\\.\\{drive_letter}",
-                    win32file.GENERIC_READ,
-                    win32file.FILE_SHARE_READ | win32file.FILE_SHARE_WRITE,
-                    None,
-                    win32file.OPEN_EXISTING,
-                    0,
-                    None
-                )
-                data = win32file.ReadFile(handle, 512)[1]
-                handle.Close()
-                if data:
-                    logging.info(f"win32file方式读取成功，数据长度: {len(data)}")
-                    return data
-            except Exception as e:
-                logging.error(f"win32file方式读取失败: {str(e)}")
-            
-            # 如果win32file方式失败，尝试使用open方式
-            logging.info(f"尝试使用open方式读取: {drive_letter}")
-            with open(drive_letter, "rb") as f:
-                data = f.read(512)
-                if not data:
-                    raise ValueError("读取到的数据为空")
-                logging.info(f"open方式读取成功，数据长度: {len(data)}")
-                return data
+            data = device_pool.read(drive_letter, 0, DiskUtils.get_sector_size(drive_letter)[0])
+            if not data:
+                raise ValueError("读取到的数据为空")
+            logging.info(f"读取成功，数据长度: {len(data)}")
+            return data
         except Exception as e:
             logging.error(f"打开磁盘失败: {str(e)}")
             raise
 
     @staticmethod
-    def read_sector(disk_path: str, sector_number: int, sector_size: int = 512) -> bytes:
-        """读取指定扇区的数据，支持分区、物理磁盘、虚拟磁盘文件"""
+    def get_sector_size(disk_path: str) -> Tuple[int, int]:
+        """返回设备的(逻辑扇区大小, 物理扇区大小)
+
+        磁盘和卷通过IOCTL/ioctl查询，镜像文件从镜像头或引导扇区推断，无法确定时为512。
+        """
+        device = device_pool.acquire(disk_path)
+        try:
+            return device.sector_size, device.physical_sector_size
+        finally:
+            device_pool.release(device)
+
+    @staticmethod
+    def read_sector(disk_path: str, sector_number: int, sector_size: Optional[int] = None) -> bytes:
+        """读取指定扇区的数据，支持分区、物理磁盘、虚拟磁盘文件
+
+        设备来自全局句柄池，由open_block_device按路径选择读取后端。
+        已知的坏扇区直接报错，不再去读取；读取出错的扇区登记为坏扇区。
+        """
         logging.info(f"尝试读取扇区: {disk_path}, 扇区号: {sector_number}")
         try:
-            # 物理磁盘
-            if disk_path.startswith('\\\\.\\PhysicalDrive'):
-                open_path = disk_path
-                logging.info(f"使用win32file读取物理磁盘: {open_path}")
-                try:
-                    handle = win32file.CreateFile(
-                        open_path,
-                        win32file.GENERIC_READ,
-                        win32file.FILE_SHARE_READ | win32file.FILE_SHARE_WRITE,
-                        None,
-                        win32file.OPEN_EXISTING,
-                        0,
-                        None
-                    )
-                    win32file.SetFilePointer(handle, sector_number * sector_size, win32file.FILE_BEGIN)
-                    data = win32file.ReadFile(handle, sector_size)[1]
-                    handle.Close()
-                    if not data:
-                        raise ValueError("读取到的数据为空")
-                    logging.info(f"物理磁盘读取成功，数据长度: {len(data)}")
-                    return data
-                except Exception as e:
-                    logging.error(f"物理磁盘读取失败: {str(e)}")
-                    raise
-            # 逻辑卷
-            elif len(disk_path) == 2 and disk_path[1] == ':':
-                # 首先尝试win32file方式
-                try:
-                    print(f"尝试使用win32file方式读取逻辑卷: {disk_path}")
-                    handle = win32file.CreateFile(
-                        f"\\\\.\\{disk_path}",
-                        win32file.GENERIC_READ,
-                        win32file.FILE_SHARE_READ | win32file.FILE_SHARE_WRITE,
-                        None,
-                        win32file.OPEN_EXISTING,
-                        0,
-                        None
-                    )
-                    win32file.SetFilePointer(handle, sector_number * sector_size, win32file.FILE_BEGIN)
-                    data = win32file.ReadFile(handle, sector_size)[1]
-                    handle.Close()
-                    if data:
-                        print(f"win32file方式读取成功，数据长度: {len(data)}")
-                        return data
-                except Exception as e:
-                    print(f"win32file方式读取失败: {str(e)}")
-                
-                # 如果win32file方式失败，尝试open方式
-                print(f"尝试使用open方式读取逻辑卷: {disk_path}")
-                try:
-                    with open(disk_path, "rb") as f:
-                        f.seek(sector_number * sector_size)
-                        data = f.read(sector_size)
-                        if not data:
-                            raise Exception("读取到的数据为空")
-                        print(f"open方式读取成功，数据长度: {len(data)}")
-                        return data
-                except Exception as e:
-                    print(f"open方式读取失败: {str(e)}")
-                    raise
-            # 虚拟磁盘文件
-            elif disk_path.lower().endswith(('.vhd', '.img', '.bin')):
-                print(f"使用open方式读取虚拟磁盘: {disk_path}")
+            if sector_size is None:
+                sector_size = DiskUtils.get_sector_size(disk_path)[0]
+            offset = sector_number * sector_size
+            if device_pool.bad_extents(disk_path, offset, sector_size):
+                raise Exception(f"扇区 {sector_number} 是已知的坏扇区")
+            try:
+                data = device_pool.read(disk_path, offset, sector_size)
+            except Exception:
+                # 缓存按64 KiB的缓存行读取，同一行中别的坏扇区也会让这次读取失败，
+                # 绕过缓存单独重试这个扇区，仍然失败才登记为坏扇区
+                # (Windows上读取错误是pywintypes.error，不是OSError)
+                device = device_pool.acquire(disk_path, cached=False)
                 try:
-                    with open(disk_path, "rb") as f:
-                        f.seek(sector_number * sector_size)
-                        data = f.read(sector_size)
-                        if not data:
-                            raise Exception("读取到的数据为空")
-                        print(f"虚拟磁盘读取成功，数据长度: {len(data)}")
-                        return data
-                except Exception as e:
-                    print(f"虚拟磁盘读取失败: {str(e)}")
+                    data = device.read_at(offset, sector_size)
+                except Exception:
+                    device_pool.mark_bad(disk_path, offset, sector_size)
                     raise
-            else:
-                raise Exception(f'不支持的磁盘路径: {disk_path}')
+                finally:
+                    device_pool.release(device)
+            if not data:
+                raise Exception("读取到的数据为空")
+            return data
         except Exception as e:
             print(f"读取扇区失败: {str(e)}")
             raise Exception(f"读取扇区失败: {str(e)}")
 
     @staticmethod
-    def read_sector_range(disk_path: str, start_sector: int, end_sector: int, sector_size: int = 512) -> bytes:
-        """读取指定扇区范围的数据"""
-        all_data = bytearray()
-        for sector in range(start_sector, end_sector + 1):
-            try:
-                data = DiskUtils.read_sector(disk_path, sector, sector_size)
-                all_data.extend(data)
-            except Exception as e:
-                print(f"读取扇区 {sector} 失败: {str(e)}")
-        return bytes(all_data)
+    def read_sector_range(disk_path: str, start_sector: int, end_sector: int,
+                          sector_size: Optional[int] = None) -> bytes:
+        """读取指定扇区范围的数据
+
+        读取失败的扇区以0填充，保证后续数据的偏移不变。
+        """
+        data, failed = DiskUtils.read_sector_range_ex(disk_path, start_sector, end_sector, sector_size)
+        for first, count in failed:
+            print(f"读取扇区 {first}-{first + count - 1} 失败，已用0填充")
+        return data
+
+    @staticmethod
+    def read_sector_range_ex(disk_path: str, start_sector: int, end_sector: int,
+                             sector_size: Optional[int] = None,
+                             direct: Optional[bool] = None) -> Tuple[bytearray, List[Tuple[int, int]]]:
+        """批量读取扇区范围，返回(数据, 失败区间列表)
+
+        整个范围按MAX_BULK_READ大小分块顺序读取，直接写入预分配的缓冲区。
+        稀疏镜像中的空洞不发起读取，直接保持为0。
+        某块读取失败时对半拆分重试，最终只有真正读不出的扇区被0填充，
+        失败区间以(起始扇区, 扇区数)的形式返回。
+        坏扇区图中已知的失败扇区不再读取，直接计入失败区间；新发现的失败扇区登记到坏扇区图。
+
+        Args:
+            sector_size: 扇区大小，为None时使用设备的逻辑扇区大小
+            direct: 是否使用无缓冲读取，为None时按范围大小自动选择
+        """
+        count = end_sector - start_sector + 1
+        if count <= 0:
+            return bytearray(), []
+        logical_size, physical_size = DiskUtils.get_sector_size(disk_path)
+        if sector_size is None:
+            sector_size = logical_size
+        buffer = bytearray(count * sector_size)
+        view = memoryview(buffer)
+        known_bad = DiskUtils._known_bad_sectors(disk_path, start_sector, end_sector, sector_size)
+        failed = []
+        if direct is None:
+            direct = count * sector_size >= DiskUtils.DIRECT_IO_MIN_BYTES
+        # 批量读取绕过缓存，避免冲掉元数据缓存行
+        device = device_pool.acquire(disk_path, cached=False, direct=direct)
+        try:
+            # 每块的扇区数取物理扇区的整数倍，块边界按物理扇区对齐
+            sectors_per_physical = max(1, physical_size // sector_size)
+            sectors_per_chunk = max(sectors_per_physical,
+                                    DiskUtils.MAX_BULK_READ // sector_size // sectors_per_physical * sectors_per_physical)
+            ranges = DiskUtils._sector_ranges_to_read(device, start_sector, end_sector, sector_size)
+            for first, last in DiskUtils._subtract_ranges(ranges, known_bad):
+                sector = first
+                while sector <= last:
+                    n = min(sectors_per_chunk - sector % sectors_per_chunk, last - sector + 1)
+                    DiskUtils._read_sectors_into(device, view, sector, n, start_sector, sector_size, failed)
+                    sector += n
+            # 设备范围内新发现的失败扇区登记为坏扇区(设备末尾之后的短读不算)
+            device_sectors = device.size // sector_size
+            for first, count in DiskUtils._merge_ranges(failed):
+                count = min(count, device_sectors - first)
+                if count > 0:
+                    device_pool.mark_bad(disk_path, first * sector_size, count * sector_size)
+        finally:
+            device_pool.release(device)
+        view.release()
+        return buffer, DiskUtils._merge_ranges(failed + known_bad)
+
+    @staticmethod
+    def _known_bad_sectors(disk_path: str, start_sector: int, end_sector: int,
+                           sector_size: int) -> List[Tuple[int, int]]:
+        """返回范围内坏扇区图中已知失败的(起始扇区, 扇区数)列表"""
+        start_byte = start_sector * sector_size
+        extents = device_pool.bad_extents(disk_path, start_byte, (end_sector - start_sector + 1) * sector_size)
+        ranges = []
+        for offset, length in extents:
+            first = max(start_sector, offset // sector_size)
+            last = min(end_sector, (offset + length - 1) // sector_size)
+            ranges.append((first, last - first + 1))
+        return DiskUtils._merge_ranges(ranges)
+
+    @staticmethod
+    def _subtract_ranges(ranges: List[Tuple[int, int]], excluded: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """从(起始扇区, 结束扇区)列表中去掉excluded中的(起始扇区, 扇区数)区间"""
+        result = []
+        for first, last in ranges:
+            for bad_first, bad_count in excluded:
+                bad_last = bad_first + bad_count - 1
+                if bad_last < first or bad_first > last:
+                    continue
+                if bad_first > first:
+                    result.append((first, bad_first - 1))
+                first = bad_last + 1
+                if first > last:
+                    break
+            if first <= last:
+                result.append((first, last))
+        return result
+
+    @staticmethod
+    def _sector_ranges_to_read(device, start_sector: int, end_sector: int,
+                               sector_size: int) -> List[Tuple[int, int]]:
+        """返回需要实际读取的(起始扇区, 结束扇区)列表，跳过稀疏镜像中的空洞
+
+        设备末尾之后的扇区仍然尝试读取，由短读把它们记为失败。
+        """
+        start_byte = start_sector * sector_size
+        end_byte = (end_sector + 1) * sector_size
+        covered_end = min(end_byte, max(start_byte, device.size))
+        extents = device.data_extents(start_byte, covered_end - start_byte) if covered_end > start_byte else []
+        ranges = [(offset // sector_size, (offset + length - 1) // sector_size) for offset, length in extents]
+        if covered_end < end_byte:
+            ranges.append(((covered_end + sector_size - 1) // sector_size, end_sector))
+        merged = []
+        for first, last in sorted(ranges):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+            else:
+                merged.append((first, last))
+        return merged
+
+    @staticmethod
+    def _read_sectors_into(device, view: memoryview, sector: int, count: int,
+                           base_sector: int, sector_size: int, failed: List[Tuple[int, int]]):
+        """把count个扇区读入view中对应位置，失败时对半拆分重试"""
+        pos = (sector - base_sector) * sector_size
+        length = count * sector_size
+        try:
+            got = device.readinto(sector * sector_size, view[pos:pos + length])
+        except Exception as e:
+            if count == 1:
+                logging.error(f"读取扇区 {sector} 失败: {str(e)}")
+                failed.append((sector, 1))
+                return
+            half = count // 2
+            DiskUtils._read_sectors_into(device, view, sector, half, base_sector, sector_size, failed)
+            DiskUtils._read_sectors_into(device, view, sector + half, count - half, base_sector, sector_size, failed)
+            return
+        if got < length:
+            # 读到设备末尾，剩余扇区视为失败
+            good = got // sector_size
+            view[pos + got:pos + length] = bytes(length - got)
+            failed.append((sector + good, count - good))
+
+    @staticmethod
+    def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """合并相邻的(起始, 数量)区间"""
+        merged = []
+        for first, count in sorted(ranges):
+            if merged and merged[-1][0] + merged[-1][1] == first:
+                merged[-1] = (merged[-1][0], merged[-1][1] + count)
+            else:
+                merged.append((first, count))
+        return merged
 
     @staticmethod
     def read_cluster(disk_path: str, cluster_number: int, cluster_size: int = 4096) -> bytes:
         """读取指定簇的数据，支持分区、物理磁盘、虚拟磁盘文件"""
         print(f"尝试读取簇: {disk_path}, 簇号: {cluster_number}")
         try:
-            # 物理磁盘
-            if disk_path.startswith('\\.\\PhysicalDrive'):
-                open_path = disk_path
-                print(f"使用win32file读取物理磁盘簇: {open_path}")
-                try:
-                    handle = win32file.CreateFile(
-                        open_path,
-                        win32file.GENERIC_READ,
-                        win32file.FILE_SHARE_READ | win32file.FILE_SHARE_WRITE,
-                        None,
-                        win32file.OPEN_EXISTING,
-                        0,
-                        None
-                    )
-                    win32file.SetFilePointer(handle, cluster_number * cluster_size, win32file.FILE_BEGIN)
-                    data = win32file.ReadFile(handle, cluster_size)[1]
-                    handle.Close()
-                    if not data:
-                        raise Exception("读取到的数据为空")
-                    print(f"物理磁盘簇读取成功，数据长度: {len(data)}")
-                    return data
-                except Exception as e:
-                    print(f"物理磁盘簇读取失败: {str(e)}")
-                    raise
-            # 逻辑卷
-            elif len(disk_path) == 2 and disk_path[1] == ':':
-                # 首先尝试win32file方式
-                try:
-                    print(f"尝试使用win32file方式读取逻辑卷簇: {disk_path}")
-                    handle = win32file.CreateFile(
-                        f"\\\\.\\{disk_path}",
-                        win32file.GENERIC_READ,
-                        win32file.FILE_SHARE_READ | win32file.FILE_SHARE_WRITE,
-                        None,
-                        win32file.OPEN_EXISTING,
-                        0,
-                        None
-                    )
-                    win32file.SetFilePointer(handle, cluster_number * cluster_size, win32file.FILE_BEGIN)
-                    data = win32file.ReadFile(handle, cluster_size)[1]
-                    handle.Close()
-                    if data:
-                        print(f"win32file方式读取成功，数据长度: {len(data)}")
-                        return data
-                except Exception as e:
-                    print(f"win32file方式读取失败: {str(e)}")
-                
-                # 如果win32file方式失败，尝试open方式
-                print(f"尝试使用open方式读取逻辑卷簇: {disk_path}")
-                try:
-                    with open(disk_path, "rb") as f:
-                        f.seek(cluster_number * cluster_size)
-                        data = f.read(cluster_size)
-                        if not data:
-                            raise Exception("读取到的数据为空")
-                        print(f"open方式读取成功，数据长度: {len(data)}")
-                        return data
-                except Exception as e:
-                    print(f"open方式读取失败: {str(e)}")
-                    raise
-            # 虚拟磁盘文件
-            elif disk_path.lower().endswith(('.vhd', '.img', '.bin')):
-                print(f"使用open方式读取虚拟磁盘簇: {disk_path}")
-                try:
-                    with open(disk_path, "rb") as f:
-                        f.seek(cluster_number * cluster_size)
-                        data = f.read(cluster_size)
-                        if not data:
-                            raise Exception("读取到的数据为空")
-                        print(f"虚拟磁盘簇读取成功，数据长度: {len(data)}")
-                        return data
-                except Exception as e:
-                    print(f"虚拟磁盘簇读取失败: {str(e)}")
-                    raise
-            else:
-                raise Exception(f'不支持的磁盘路径: {disk_path}')
+            data = device_pool.read(disk_path, cluster_number * cluster_size, cluster_size)
+            if not data:
+                raise Exception("读取到的数据为空")
+            return data
         except Exception as e:
             print(f"读取簇失败: {str(e)}")
             raise Exception(f"读取簇失败: {str(e)}")
@@ -248,6 +269,8 @@ class DiskUtils:
     def get_disk_list_grouped():
         """返回(分区列表, 物理磁盘列表)，用于树形分组显示"""
         drives = []
+        if win32api is None:
+            return drives, []
         bitmask = win32api.GetLogicalDrives()
         for letter in string.ascii_uppercase:
             if bitmask & 1:
@@ -306,6 +329,39 @@ class DiskUtils:
             physicals.append((phy_path, name))
         return drives, physicals
 
+    @staticmethod
+    def get_partition_list(disk_path: str) -> List[Partition]:
+        """获取磁盘(物理磁盘或整盘镜像)上的分区列表，分区表按设备缓存只解析一次"""
+        device = device_pool.acquire(disk_path)
+        try:
+            return get_partitions(disk_path, device)
+        finally:
+            device_pool.release(device)
+
+    @staticmethod
+    def get_fat32_partitions(disk_path: str) -> List[Tuple[str, str]]:
+        """返回磁盘上所有FAT32卷的(路径, 显示名)列表
+
+        磁盘本身没有分区表而是一个FAT32卷时，返回磁盘路径本身。
+        """
+        volumes = []
+        partitions = DiskUtils.get_partition_list(disk_path)
+        if not partitions:
+            boot_sector = DiskUtils.read_sector(disk_path, 0)
+            if boot_sector[82:90] == b'FAT32   ':
+                volumes.append((disk_path, "FAT32卷"))
+            return volumes
+        for partition in partitions:
+            try:
+                boot_sector = DiskUtils.read_sector(partition.path, 0)
+            except Exception as e:
+                logging.error(f"读取分区 {partition.path} 引导扇区失败: {str(e)}")
+                continue
+            if boot_sector[82:90] == b'FAT32   ':
+                size_gb = partition.size / (1024**3)
+                volumes.append((partition.path, f"分区{partition.index} (FAT32, {size_gb:.1f} GB)"))
+        return volumes
+
     @staticmethod
     def find_mft_location(disk_path: str) -> int:
         """查找 NTFS 的 $MFT 位置"""
@@ -315,7 +371,15 @@ class DiskUtils:
             boot_sector = DiskUtils.read_sector(disk_path, 0)
             
             # 检查是否为 NTFS 文件系统
-            if boot_sector[3:11].decode('ascii') != 'NTFS    ':
+            if boot_sector[3:11] != b'NTFS    ':
+                # 整盘路径：在分区表中查找第一个NTFS分区，返回相对整盘的扇区号
+                for partition in DiskUtils.get_partition_list(disk_path):
+                    try:
+                        if DiskUtils.read_sector(partition.path, 0)[3:11] == b'NTFS    ':
+                            sector_size = DiskUtils.get_sector_size(disk_path)[0]
+                            return partition.start // sector_size + DiskUtils.find_mft_location(partition.path)
+                    except Exception as e:
+                        print(f"读取分区 {partition.path} 失败: {str(e)}")
                 raise Exception("该磁盘不是 NTFS 文件系统")
             
             # 获取每簇扇区数
@@ -389,6 +453,18 @@ class DiskUtils:
             except UnicodeDecodeError:
                 print("解码 FAT16 标识符时出错")
         
+            # 整盘路径：逐个分区查找
+            results = []
+            sector_size = DiskUtils.get_sector_size(disk_path)[0]
+            for partition in DiskUtils.get_partition_list(disk_path):
+                try:
+                    info = DiskUtils.find_root_directory(partition.path)
+                    results.append(f"分区{partition.index}(起始扇区 {partition.start // sector_size}): {info}")
+                except Exception as e:
+                    print(f"分区 {partition.path} 查找根目录失败: {str(e)}")
+            if results:
+                return "\n".join(results)
+        
             print("暂不支持该文件系统的根目录查找")
             raise Exception("暂不支持该文件系统的根目录查找")
         except Exception as e:
@@ -0,0 +1,299 @@
+import os
+import struct
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from block_device import BlockDevice
+from device_pool import device_pool
+
+# 写时复制编辑层文件签名
+OVERLAY_SIGNATURE = b'OHXCOW\x00\x00'
+OVERLAY_VERSION = 1
+OVERLAY_EXTENSION = '.ohxcow'
+
+# 文件头: 签名、版本、块大小、底层设备大小、索引位置、索引项数、底层设备路径
+OVERLAY_HEADER = struct.Struct("<8sIIQQQ256s")
+OVERLAY_HEADER_SIZE = 4096
+# 索引项: 块号、块数据在编辑层文件中的偏移
+OVERLAY_INDEX_ENTRY = struct.Struct("<QQ")
+
+
+def overlay_path_for(path: str) -> str:
+    """返回设备或镜像对应的编辑层文件路径
+
+    镜像文件所在目录可写时放在镜像旁边，否则(设备、只读目录)放到临时目录中。
+    """
+    directory, name = os.path.split(path)
+    if directory and os.path.isfile(path) and os.access(directory, os.W_OK):
+        return path + OVERLAY_EXTENSION
+    safe_name = "".join(c if c.isalnum() or c in '._-' else '_' for c in path)
+    overlay_dir = os.path.join(tempfile.gettempdir(), 'openhex')
+    os.makedirs(overlay_dir, exist_ok=True)
+    return os.path.join(overlay_dir, safe_name + OVERLAY_EXTENSION)
+
+
+class EditOverlay(BlockDevice):
+    """底层设备之上的写时复制编辑层
+
+    修改按block_size大小的块记录在单独的编辑层文件中，底层设备始终不被改动；
+    读取时修改过的块取自编辑层，其余部分直接读取底层设备。
+    编辑层文件由文件头、修改块数据和末尾的块索引组成。上次flush之后第一次修改的块
+    总是追加到文件末尾，不覆盖上一次索引引用的数据；flush时在末尾写入新的索引再回填文件头，
+    上一次的索引在这之前一直有效，中途中断也能恢复到上一次flush的状态。
+    再次用同一个编辑层文件打开即可继续编辑。
+    commit只把修改过的块写回底层文件，不重写整个文件。
+    不拥有底层设备，close不关闭它。
+    """
+
+    def __init__(self, base: BlockDevice, overlay_path: str, block_size: int = 4096, cache_blocks: int = 256):
+        super().__init__(base.path)
+        self.base = base
+        self.overlay_path = overlay_path
+        self.block_size = max(block_size, base.physical_sector_size)
+        self.cache_blocks = cache_blocks
+        self.sector_size = base.sector_size
+        self.physical_sector_size = base.physical_sector_size
+        # 块号 -> 块数据在编辑层文件中的偏移
+        self._index: Dict[int, int] = {}
+        # 上次flush之后新分配位置的块，可以原地改写
+        self._unflushed = set()
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._flushed = True
+        if os.path.exists(overlay_path) and os.path.getsize(overlay_path) >= OVERLAY_HEADER_SIZE:
+            self._file = open(overlay_path, 'r+b')
+            self._load()
+        else:
+            self._file = open(overlay_path, 'w+b')
+            self._file.write(bytes(OVERLAY_HEADER_SIZE))
+            self._end = OVERLAY_HEADER_SIZE
+            self._write_header(0, 0)
+
+    def _load(self):
+        header = self._file.read(OVERLAY_HEADER.size)
+        signature, version, block_size, base_size, index_offset, entries, _ = OVERLAY_HEADER.unpack(header)
+        if signature != OVERLAY_SIGNATURE:
+            raise Exception(f"不是编辑层文件: {self.overlay_path}")
+        if version != OVERLAY_VERSION:
+            raise Exception(f"不支持的编辑层版本: {version}")
+        if base_size != self.base.size:
+            raise Exception(f"编辑层记录的设备大小({base_size})与当前设备({self.base.size})不一致")
+        self.block_size = block_size
+        if entries:
+            self._file.seek(index_offset)
+            table = self._file.read(entries * OVERLAY_INDEX_ENTRY.size)
+            for block, data_offset in OVERLAY_INDEX_ENTRY.iter_unpack(table):
+                self._index[block] = data_offset
+        # 上一次的索引保留在原位，新的块追加在它后面
+        self._end = os.path.getsize(self.overlay_path)
+        logging.info(f"打开编辑层 {self.overlay_path}: {len(self._index)} 个修改块")
+
+    def _write_header(self, index_offset: int, entries: int):
+        self._file.seek(0)
+        self._file.write(OVERLAY_HEADER.pack(OVERLAY_SIGNATURE, OVERLAY_VERSION, self.block_size, self.base.size,
+                                             index_offset, entries, self.base.path.encode('utf-8')[:256]))
+
+    @property
+    def size(self) -> int:
+        return self.base.size
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._index)
+
+    @property
+    def dirty_bytes(self) -> int:
+        """修改过的字节数(按块计)"""
+        return sum(length for _, length in self.dirty_extents())
+
+    def is_dirty(self, offset: int) -> bool:
+        return offset // self.block_size in self._index
+
+    def dirty_extents(self) -> List[Tuple[int, int]]:
+        """修改过的(偏移, 长度)区间，相邻的块合并"""
+        with self._lock:
+            blocks = sorted(self._index)
+        extents = []
+        for block in blocks:
+            start = block * self.block_size
+            length = min(self.block_size, self.size - start)
+            if extents and extents[-1][0] + extents[-1][1] == start:
+                extents[-1] = (extents[-1][0], extents[-1][1] + length)
+            else:
+                extents.append((start, length))
+        return extents
+
+    def _read_block(self, block: int) -> bytes:
+        """读取一个修改过的块，最近用过的块保存在LRU中"""
+        with self._lock:
+            data = self._cache.get(block)
+            if data is not None:
+                self._cache.move_to_end(block)
+                return data
+            self._file.seek(self._index[block])
+            data = self._file.read(self.block_size)
+            self._cache_block(block, data)
+            return data
+
+    def _cache_block(self, block: int, data: bytes):
+        self._cache[block] = data
+        self._cache.move_to_end(block)
+        while len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+
+    def byte_at(self, offset: int) -> int:
+        """读取单个字节(十六进制视图逐字节绘制时使用)"""
+        block, within = divmod(offset, self.block_size)
+        if block in self._index:
+            return self._read_block(block)[within]
+        return self.base.read_at(offset, 1)[0]
+
+    def readinto(self, offset: int, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        length = min(len(view), max(0, self.size - offset))
+        if not self._index:
+            return self.base.readinto(offset, view[:length])
+        position = 0
+        while position < length:
+            block, within = divmod(offset + position, self.block_size)
+            if block in self._index:
+                piece = min(self.block_size - within, length - position)
+                view[position:position + piece] = self._read_block(block)[within:within + piece]
+                position += piece
+                continue
+            # 连续的未修改块一次读取底层设备
+            end = position
+            while end < length and (offset + end) // self.block_size not in self._index:
+                end = min(length, ((offset + end) // self.block_size + 1) * self.block_size - offset)
+            got = self.base.readinto(offset + position, view[position:end])
+            if got < end - position:
+                view[position + got:end] = bytes(end - position - got)
+            position = end
+        return length
+
+    def data_extents(self, offset: int, length: int):
+        if not self._index:
+            return self.base.data_extents(offset, length)
+        # 修改过的块总是视为数据
+        extents = list(self.base.data_extents(offset, length))
+        end = offset + length
+        for start, size in self.dirty_extents():
+            begin, finish = max(start, offset), min(start + size, end)
+            if begin < finish:
+                extents.append((begin, finish - begin))
+        extents.sort()
+        merged = []
+        for start, size in extents:
+            if merged and start <= merged[-1][0] + merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], start + size - merged[-1][0]))
+            else:
+                merged.append((start, size))
+        return merged
+
+    def write(self, offset: int, data) -> int:
+        """把data写到offset处(只写入编辑层)，超出设备末尾的部分被丢弃
+
+        Returns:
+            实际写入的字节数
+        """
+        data = memoryview(data).cast('B')
+        length = min(len(data), max(0, self.size - offset))
+        position = 0
+        with self._lock:
+            while position < length:
+                block, within = divmod(offset + position, self.block_size)
+                piece = min(self.block_size - within, length - position)
+                block_start = block * self.block_size
+                if block in self._index:
+                    content = bytearray(self._read_block(block))
+                else:
+                    # 第一次修改的块先复制底层设备的原始内容
+                    content = bytearray(self.block_size)
+                    self.base.readinto(block_start, memoryview(content)[:min(self.block_size, self.size - block_start)])
+                content[within:within + piece] = data[position:position + piece]
+                if block not in self._unflushed:
+                    self._index[block] = self._end
+                    self._end += self.block_size
+                    self._unflushed.add(block)
+                self._file.seek(self._index[block])
+                self._file.write(content)
+                self._cache_block(block, bytes(content))
+                position += piece
+            self._flushed = False
+        return length
+
+    def flush(self):
+        """在编辑层文件末尾写入块索引并回填文件头，之后的中断不会丢失已写入的修改"""
+        with self._lock:
+            if self._flushed:
+                return
+            index_offset = self._end
+            self._file.seek(index_offset)
+            self._file.write(b''.join(OVERLAY_INDEX_ENTRY.pack(block, data_offset)
+                                      for block, data_offset in sorted(self._index.items())))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._write_header(index_offset, len(self._index))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            # 索引之后的空间留给后续追加的块，下一次flush的索引写在它们后面
+            self._end = index_offset + len(self._index) * OVERLAY_INDEX_ENTRY.size
+            self._unflushed.clear()
+            self._flushed = True
+
+    def commit(self, target_path: Optional[str] = None) -> int:
+        """把修改过的块写回底层文件(或target_path)，成功后清空编辑层
+
+        Args:
+            target_path: 写入的目标文件(按设备偏移写入)，默认为底层设备的路径，
+                此时底层设备必须是普通文件，容器镜像和分区不能原地写回
+
+        Returns:
+            写回的字节数
+        """
+        if target_path is None and not device_pool.is_plain_file(self.base.path):
+            raise Exception(f"{self.base.path} 不是普通镜像文件(分段/VHD/VMDK/E01/压缩镜像或分区)，不能写回")
+        target_path = target_path or self.base.path
+        written = 0
+        with self._lock:
+            extents = self.dirty_extents()
+            with open(target_path, 'r+b') as f:
+                for start, length in extents:
+                    data = bytearray(length)
+                    self.readinto(start, data)
+                    f.seek(start)
+                    f.write(data)
+                    written += length
+                f.flush()
+                os.fsync(f.fileno())
+            logging.info(f"编辑层提交到 {target_path}: {len(extents)} 个区间, {written} 字节")
+            self.discard()
+        return written
+
+    def discard(self):
+        """丢弃全部修改"""
+        with self._lock:
+            self._index.clear()
+            self._unflushed.clear()
+            self._cache.clear()
+            self._file.truncate(OVERLAY_HEADER_SIZE)
+            self._end = OVERLAY_HEADER_SIZE
+            self._write_header(0, 0)
+            self._file.flush()
+            self._flushed = True
+
+    def close(self):
+        """保存索引并关闭编辑层文件；没有修改时删除编辑层文件"""
+        with self._lock:
+            if self._file.closed:
+                return
+            self.flush()
+            self._file.close()
+            self._cache.clear()
+            if not self._index:
+                try:
+                    os.remove(self.overlay_path)
+                except OSError as e:
+                    logging.debug(f"删除编辑层文件失败: {str(e)}")
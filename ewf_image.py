@@ -0,0 +1,237 @@
+import os
+import sys
+import zlib
+import struct
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from block_device import BlockDevice
+
+# EWF(EnCase E01)段文件签名
+EWF_SIGNATURE = b'EVF\x09\x0d\x0a\xff\x00'
+# EWF2(EnCase 7的Ex01)段文件签名
+EWF2_SIGNATURE = b'EVF2\x0d\x0a\x81\x00'
+# 逻辑证据文件(L01)签名
+LVF_SIGNATURE = b'LVF\x09\x0d\x0a\xff\x00'
+
+EWF_FILE_HEADER_SIZE = 13
+EWF_SECTION_DESCRIPTOR_SIZE = 76
+EWF_TABLE_HEADER_SIZE = 24
+
+# 表项最高位表示该chunk经过zlib压缩
+EWF_CHUNK_COMPRESSED = 0x80000000
+EWF_CHUNK_OFFSET_MASK = 0x7FFFFFFF
+
+
+def ewf_segment_path(first_path: str, number: int) -> str:
+    """根据第一个段文件路径推算第number个段文件的路径
+
+    扩展名依次为E01..E99，之后是EAA..EZZ、FAA..FZZ，依此类推。
+    """
+    base, ext = os.path.splitext(first_path)
+    letter = ext[1:2] or 'E'
+    if number <= 99:
+        new_ext = f"{letter}{number:02d}"
+    else:
+        index = number - 100
+        new_ext = (chr(ord(letter.upper()) + index // 676) +
+                   chr(ord('A') + index // 26 % 26) +
+                   chr(ord('A') + index % 26))
+    if letter.islower():
+        new_ext = new_ext.lower()
+    return f"{base}.{new_ext}"
+
+
+class EwfBlockDevice(BlockDevice):
+    """EnCase E01(EWF)分段镜像
+
+    打开时遍历全部段文件的节(section)链，把各table节的chunk偏移表合并成
+    按chunk编号索引的数组(所在段、文件偏移、存储长度、是否压缩)。
+    读取时按chunk解压，解压后的chunk保存在容量为cache_chunks的LRU中，
+    浏览和扫描反复访问同一个chunk时不会重复解压。
+    """
+
+    def __init__(self, base: BlockDevice, cache_chunks: int = 256):
+        super().__init__(base.path)
+        self.segments = [base]
+        self.cache_chunks = cache_chunks
+        self.chunk_size = 0
+        self.chunk_count = 0
+        self.sector_count = 0
+        self.md5 = None
+        # 每个chunk的位置信息，按chunk编号索引
+        self.chunk_segment = array('H')
+        self.chunk_offset = array('Q')
+        self.chunk_stored = array('I')
+        self.chunk_compressed = bytearray()
+        self._chunks = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            number = 1
+            segment = base
+            while True:
+                more = self._parse_segment(len(self.segments) - 1, segment, number)
+                if not more:
+                    break
+                number += 1
+                path = ewf_segment_path(base.path, number)
+                if not os.path.exists(path):
+                    raise Exception(f"缺少E01段文件: {path}")
+                # 后续段文件使用与第一个段相同的读取后端
+                segment = type(base)(path)
+                self.segments.append(segment)
+        except Exception:
+            for segment in self.segments[1:]:
+                segment.close()
+            raise
+
+        if self.chunk_size == 0:
+            raise Exception("E01镜像缺少volume节")
+        if len(self.chunk_offset) < self.chunk_count:
+            logging.error(f"E01镜像chunk表不完整: {len(self.chunk_offset)}/{self.chunk_count}")
+        logging.info(f"E01镜像: 段数={len(self.segments)}, 大小={self.size}, chunk大小={self.chunk_size}, "
+                     f"chunk数={len(self.chunk_offset)}")
+
+    def _parse_segment(self, segment_index: int, segment: BlockDevice, number: int) -> bool:
+        """解析一个段文件的节链，返回后面是否还有段文件"""
+        header = segment.read_at(0, EWF_FILE_HEADER_SIZE)
+        if header[0:8] != EWF_SIGNATURE:
+            raise Exception(f"{segment.path} 不是E01段文件")
+        segment_number = struct.unpack_from("<H", header, 9)[0]
+        if segment_number != number:
+            raise Exception(f"E01段号不连续: {segment.path} 是第{segment_number}段，应为第{number}段")
+
+        offset = EWF_FILE_HEADER_SIZE
+        sectors_end = None
+        while offset + EWF_SECTION_DESCRIPTOR_SIZE <= segment.size:
+            descriptor = segment.read_at(offset, EWF_SECTION_DESCRIPTOR_SIZE)
+            section_type = bytes(descriptor[0:16]).rstrip(b'\x00')
+            next_offset, section_size = struct.unpack_from("<QQ", descriptor, 16)
+            data_offset = offset + EWF_SECTION_DESCRIPTOR_SIZE
+
+            if section_type in (b'volume', b'disk'):
+                self._parse_volume(segment.read_at(data_offset, section_size - EWF_SECTION_DESCRIPTOR_SIZE))
+            elif section_type == b'sectors':
+                sectors_end = offset + section_size
+            elif section_type == b'table':
+                self._parse_table(segment_index, segment, offset, section_size, sectors_end)
+            elif section_type == b'hash':
+                self.md5 = bytes(segment.read_at(data_offset, 16))
+            elif section_type == b'next':
+                return True
+            elif section_type == b'done':
+                return False
+
+            if next_offset <= offset:
+                break
+            offset = next_offset
+        # 节链异常结束，按最后一个段处理
+        logging.error(f"E01段文件 {segment.path} 的节链没有以next/done结束")
+        return False
+
+    def _parse_volume(self, data: bytes):
+        """解析volume/disk节中的chunk与扇区参数"""
+        self.chunk_count, sectors_per_chunk, bytes_per_sector = struct.unpack_from("<III", data, 4)
+        if len(data) <= 94:
+            # EWF-S01的volume节只有32位扇区数
+            self.sector_count = struct.unpack_from("<I", data, 16)[0]
+        else:
+            self.sector_count = struct.unpack_from("<Q", data, 16)[0]
+        self.sector_size = bytes_per_sector
+        self.physical_sector_size = bytes_per_sector
+        self.chunk_size = sectors_per_chunk * bytes_per_sector
+
+    def _parse_table(self, segment_index: int, segment: BlockDevice, section_offset: int,
+                     section_size: int, sectors_end):
+        """解析table节，把其中的chunk位置追加到总表"""
+        data_offset = section_offset + EWF_SECTION_DESCRIPTOR_SIZE
+        header = segment.read_at(data_offset, EWF_TABLE_HEADER_SIZE)
+        entry_count = struct.unpack_from("<I", header, 0)[0]
+        base_offset = struct.unpack_from("<Q", header, 8)[0]
+        entries = array('I')
+        if entries.itemsize != 4:
+            entries = array('L')
+        entries.frombytes(bytes(segment.read_at(data_offset + EWF_TABLE_HEADER_SIZE, entry_count * 4)))
+        if sys.byteorder == 'big':
+            entries.byteswap()
+
+        # 最后一个chunk到sectors节末尾为止(老版本没有sectors节时到table节开头为止)
+        data_end = sectors_end if sectors_end is not None else section_offset
+        offsets = [base_offset + (entry & EWF_CHUNK_OFFSET_MASK) for entry in entries]
+        for i, entry in enumerate(entries):
+            start = offsets[i]
+            end = offsets[i + 1] if i + 1 < len(offsets) else data_end
+            if end <= start:
+                end = start + self.chunk_size + 4
+            self.chunk_segment.append(segment_index)
+            self.chunk_offset.append(start)
+            self.chunk_stored.append(end - start)
+            self.chunk_compressed.append(1 if entry & EWF_CHUNK_COMPRESSED else 0)
+
+    @property
+    def size(self) -> int:
+        return self.sector_count * self.sector_size
+
+    def _read_chunk(self, index: int) -> bytes:
+        """取出解压后的chunk，优先从LRU中获取"""
+        with self._lock:
+            chunk = self._chunks.get(index)
+            if chunk is not None:
+                self._chunks.move_to_end(index)
+                self.hits += 1
+                return chunk
+            self.misses += 1
+
+        if index >= len(self.chunk_offset):
+            chunk = bytes(self.chunk_size)
+        else:
+            segment = self.segments[self.chunk_segment[index]]
+            stored = segment.read_at(self.chunk_offset[index], self.chunk_stored[index])
+            if self.chunk_compressed[index]:
+                # 末尾可能带有填充，用decompressobj忽略多余的数据
+                chunk = zlib.decompressobj().decompress(stored, self.chunk_size)
+            else:
+                # 未压缩的chunk后面跟着4字节Adler-32校验和
+                chunk = bytes(stored[:self.chunk_size])
+
+        with self._lock:
+            self._chunks[index] = chunk
+            while len(self._chunks) > self.cache_chunks:
+                self._chunks.popitem(last=False)
+        return chunk
+
+    def readinto(self, offset: int, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        length = min(len(view), max(0, self.size - offset))
+        position = 0
+        while position < length:
+            index, within = divmod(offset + position, self.chunk_size)
+            chunk = self._read_chunk(index)
+            piece = min(len(chunk) - within, length - position)
+            if piece <= 0:
+                # chunk解压结果过短，剩余部分补0
+                piece = min(self.chunk_size - within, length - position)
+                view[position:position + piece] = bytes(piece)
+            else:
+                view[position:position + piece] = chunk[within:within + piece]
+            position += piece
+        return length
+
+    def stats(self) -> dict:
+        """返回chunk缓存命中统计"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'cached_chunks': len(self._chunks),
+            }
+
+    def close(self):
+        with self._lock:
+            self._chunks.clear()
+        for segment in self.segments:
+            segment.close()
@@ -1,8 +1,15 @@
 import os
+import bisect
 import struct
 import logging
+from collections import deque
 from typing import List, Dict, Tuple, Optional, BinaryIO
 from datetime import datetime
+from device_pool import device_pool
+from readahead import ReadAheadDevice
+from block_device import DEFAULT_QUEUE_DEPTH
+from metadata_snapshot import write_metadata_snapshot
+from io_scheduler import set_io_priority, PRIORITY_METADATA, PRIORITY_BULK
 
 class FAT32Recovery:
     """FAT32文件系统删除文件恢复类"""
@@ -10,6 +17,8 @@ class FAT32Recovery:
     # FAT32文件系统常量
     FAT_ENTRY_SIZE = 4  # FAT32表项大小为4字节
     DIR_ENTRY_SIZE = 32  # 目录项大小为32字节
+    MAX_RUN_BYTES = 4 * 1024 * 1024  # 一次分散读取的最大字节数
+    READ_QUEUE_DEPTH = DEFAULT_QUEUE_DEPTH  # 批量读取时同时在途的请求数
     DELETED_MARKER = 0xE5  # 删除文件标记
     LFN_ATTR = 0x0F  # 长文件名属性标记
     
@@ -52,7 +61,10 @@ class FAT32Recovery:
             disk_path: 磁盘路径，可以是分区(C:)或物理磁盘(\\\\.\\PhysicalDrive0)
         """
         self.disk_path = disk_path
-        self.disk_handle = None
+        self.device = None
+        self.raw_device = None
+        self.data_device = None
+        self._previous_priority = None
         self.bytes_per_sector = 0
         self.sectors_per_cluster = 0
         self.reserved_sectors = 0
@@ -67,6 +79,10 @@ class FAT32Recovery:
         self.data_sectors = 0
         self.count_of_clusters = 0
         
+        # 坏扇区图中读取失败过的簇段(起始簇号, 结束簇号)，按起始簇号排序
+        self.bad_cluster_ranges = []
+        self._bad_cluster_starts = []
+        
         # 已删除的文件列表
         self.deleted_files = []
         
@@ -95,24 +111,48 @@ class FAT32Recovery:
         return True
     
     def open_disk(self):
-        """打开磁盘设备"""
+        """打开磁盘设备(从全局句柄池借用块设备)
+
+        元数据(引导扇区、FAT表、目录)走带缓存的设备，
+        文件数据簇走顺序预读层，避免大量数据冲掉元数据缓存。
+        打开期间当前线程的读取按元数据优先级调度，数据簇按批量优先级调度，
+        不会阻塞交互式浏览。
+        """
+        if self.device:
+            return True
+        # 全部获取成功后才设置属性；中途失败时归还已获取的设备，下次可以重新打开
+        device = raw_device = None
         try:
-            if len(self.disk_path) == 2 and self.disk_path[1] == ':':
-                # 如果是分区，使用\\.\C: 格式
-                self.disk_handle = open(f"\\\\.\\{self.disk_path}", "rb")
+            device = device_pool.acquire(self.disk_path)
+            raw_device = device_pool.acquire(self.disk_path, cached=False, priority=PRIORITY_BULK)
+            if raw_device.zero_copy:
+                # 内存映射镜像由系统页缓存负责预读
+                data_device = raw_device
             else:
-                # 否则直接打开
-                self.disk_handle = open(self.disk_path, "rb")
-            return True
+                data_device = ReadAheadDevice(raw_device)
         except Exception as e:
             logging.error(f"打开磁盘失败: {str(e)}")
+            for acquired in (raw_device, device):
+                if acquired is not None:
+                    device_pool.release(acquired)
             return False
+        self.device, self.raw_device, self.data_device = device, raw_device, data_device
+        self._previous_priority = set_io_priority(PRIORITY_METADATA)
+        return True
     
     def close_disk(self):
-        """关闭磁盘设备"""
-        if self.disk_handle:
-            self.disk_handle.close()
-            self.disk_handle = None
+        """关闭磁盘设备(归还设备，由句柄池负责在空闲时真正关闭)"""
+        if self.device:
+            if self.data_device is not self.raw_device:
+                self.data_device.close()
+            device_pool.release(self.raw_device)
+            device_pool.release(self.device)
+            if self._previous_priority is not None:
+                set_io_priority(self._previous_priority)
+                self._previous_priority = None
+            self.device = None
+            self.raw_device = None
+            self.data_device = None
     
     def read_sector(self, sector_number: int) -> bytes:
         """读取指定扇区数据
@@ -123,18 +163,12 @@ class FAT32Recovery:
         Returns:
             扇区数据
         """
-        if not self.disk_handle:
+        if not self.device:
             raise Exception("磁盘未打开")
             
-        # 使用默认扇区大小512字节读取第一个扇区
-        if sector_number == 0 and self.bytes_per_sector == 0:
-            self.disk_handle.seek(0)
-            return self.disk_handle.read(512)
-            
-        # 对于其他扇区，使用已知的扇区大小
-        bytes_per_sector = self.bytes_per_sector if self.bytes_per_sector > 0 else 512
-        self.disk_handle.seek(sector_number * bytes_per_sector)
-        return self.disk_handle.read(bytes_per_sector)
+        # 引导扇区解析之前使用设备的逻辑扇区大小
+        bytes_per_sector = self.bytes_per_sector if self.bytes_per_sector > 0 else self.device.sector_size
+        return self.device.read_at(sector_number * bytes_per_sector, bytes_per_sector)
     
     def read_sectors(self, start_sector: int, count: int) -> bytes:
         """读取多个连续扇区
@@ -146,12 +180,11 @@ class FAT32Recovery:
         Returns:
             连续扇区数据
         """
-        if not self.disk_handle:
+        if not self.device:
             raise Exception("磁盘未打开")
             
-        bytes_per_sector = self.bytes_per_sector if self.bytes_per_sector > 0 else 512
-        self.disk_handle.seek(start_sector * bytes_per_sector)
-        return self.disk_handle.read(count * bytes_per_sector)
+        bytes_per_sector = self.bytes_per_sector if self.bytes_per_sector > 0 else self.device.sector_size
+        return self.device.read_at(start_sector * bytes_per_sector, count * bytes_per_sector)
     
     def read_cluster(self, cluster_number: int) -> bytes:
         """读取指定簇数据
@@ -165,11 +198,194 @@ class FAT32Recovery:
         if cluster_number < 2:
             raise ValueError(f"无效的簇号: {cluster_number}")
             
+        if not self.device:
+            raise Exception("磁盘未打开")
+            
+        # 含有坏扇区的簇不再读取，按全0处理
+        if self.is_bad_cluster(cluster_number):
+            return bytes(self.sectors_per_cluster * self.bytes_per_sector)
+            
         # 计算簇对应的起始扇区
         first_sector_of_cluster = self.cluster_begin_lba + (cluster_number - 2) * self.sectors_per_cluster
         
-        # 读取整个簇的所有扇区
-        return self.read_sectors(first_sector_of_cluster, self.sectors_per_cluster)
+        # 读取整个簇的所有扇区(经过顺序预读层，连续簇在后台提前读入)
+        return self.data_device.read_at(first_sector_of_cluster * self.bytes_per_sector,
+                                        self.sectors_per_cluster * self.bytes_per_sector)
+    
+    def read_cluster_view(self, cluster_number: int) -> memoryview:
+        """以memoryview形式读取指定簇，内存映射镜像上不产生复制
+        
+        Args:
+            cluster_number: 簇编号(从2开始)
+            
+        Returns:
+            簇数据的只读视图
+        """
+        if cluster_number < 2:
+            raise ValueError(f"无效的簇号: {cluster_number}")
+        if not self.device:
+            raise Exception("磁盘未打开")
+            
+        first_sector_of_cluster = self.cluster_begin_lba + (cluster_number - 2) * self.sectors_per_cluster
+        return self.device.read_view(first_sector_of_cluster * self.bytes_per_sector,
+                                     self.sectors_per_cluster * self.bytes_per_sector)
+    
+    def get_cluster_runs(self, clusters: List[int]) -> List[Tuple[int, int]]:
+        """把簇号列表合并成连续的簇段
+        
+        Args:
+            clusters: 按读取顺序排列的簇号列表
+            
+        Returns:
+            (起始簇号, 簇数量)列表，单个簇段不超过MAX_RUN_BYTES字节，
+            坏簇总是单独成段
+        """
+        bytes_per_cluster = self.bytes_per_sector * self.sectors_per_cluster
+        max_clusters = max(1, self.MAX_RUN_BYTES // bytes_per_cluster)
+        runs = []
+        previous_bad = True
+        for cluster in clusters:
+            bad = self.is_bad_cluster(cluster)
+            if (runs and not bad and not previous_bad and runs[-1][0] + runs[-1][1] == cluster
+                    and runs[-1][1] < max_clusters):
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((cluster, 1))
+            previous_bad = bad
+        return runs
+    
+    def read_cluster_runs(self, clusters: List[int], device=None) -> List:
+        """按连续簇段批量读取多个簇，每个簇段只发起一次分散读取(preadv)
+        
+        Args:
+            clusters: 簇号列表(从2开始)
+            device: 读取使用的设备，默认使用带缓存的元数据设备
+            
+        Returns:
+            与clusters一一对应的簇数据列表，读取不足的部分为0
+        """
+        if not self.device:
+            raise Exception("磁盘未打开")
+        device = device or self.device
+        bytes_per_cluster = self.bytes_per_sector * self.sectors_per_cluster
+        result = []
+        for first, count in self.get_cluster_runs(clusters):
+            if first < 2:
+                raise ValueError(f"无效的簇号: {first}")
+            if self.is_bad_cluster(first):
+                result.append(bytes(bytes_per_cluster))
+                continue
+            offset = (self.cluster_begin_lba + (first - 2) * self.sectors_per_cluster) * self.bytes_per_sector
+            if device.zero_copy:
+                # 内存映射镜像直接切片，不需要系统调用
+                result.extend(device.read_view(offset + i * bytes_per_cluster, bytes_per_cluster)
+                              for i in range(count))
+                continue
+            buffers = [bytearray(bytes_per_cluster) for _ in range(count)]
+            device.readv(offset, buffers)
+            result.extend(buffers)
+        return result
+    
+    def read_cluster_chains(self, chains: List[List[int]], device=None) -> List[List]:
+        """一次并发读取多条簇链(例如同一层的全部目录)
+        
+        每条簇链先合并成连续簇段，所有簇段作为一批请求交给read_batch并发读取，
+        按完成顺序拆分回各条簇链。坏簇不发起读取，数据为0。
+        
+        Args:
+            chains: 簇链列表，每条是簇号列表(从2开始)
+            device: 读取使用的设备，默认使用带缓存的元数据设备
+            
+        Returns:
+            与chains一一对应的列表，每项是该簇链各簇的数据，读取不足的部分为0
+        """
+        if not self.device:
+            raise Exception("磁盘未打开")
+        device = device or self.device
+        bytes_per_cluster = self.bytes_per_sector * self.sectors_per_cluster
+        requests = []
+        owners = []
+        bad_clusters = []
+        for chain_index, chain in enumerate(chains):
+            position = 0
+            for first, count in self.get_cluster_runs(chain):
+                if first < 2:
+                    raise ValueError(f"无效的簇号: {first}")
+                if self.is_bad_cluster(first):
+                    bad_clusters.append((chain_index, position))
+                    position += count
+                    continue
+                offset = (self.cluster_begin_lba + (first - 2) * self.sectors_per_cluster) * self.bytes_per_sector
+                requests.append((offset, count * bytes_per_cluster))
+                owners.append((chain_index, position, count))
+                position += count
+        
+        result = [[None] * len(chain) for chain in chains]
+        for chain_index, position in bad_clusters:
+            result[chain_index][position] = memoryview(bytes(bytes_per_cluster))
+        for index, data in device.read_batch(requests, self.READ_QUEUE_DEPTH):
+            chain_index, position, count = owners[index]
+            if len(data) < count * bytes_per_cluster:
+                data = bytes(data) + bytes(count * bytes_per_cluster - len(data))
+            data = memoryview(data)
+            for i in range(count):
+                result[chain_index][position + i] = data[i * bytes_per_cluster:(i + 1) * bytes_per_cluster]
+        return result
+    
+    def get_allocated_clusters(self, first_cluster: int, end_cluster: int) -> List[int]:
+        """返回[first_cluster, end_cluster)中含有数据的簇，稀疏镜像空洞中的簇和坏簇被排除
+        
+        Args:
+            first_cluster: 起始簇号(从2开始)
+            end_cluster: 结束簇号(不含)
+            
+        Returns:
+            簇号列表，不支持空洞查询的设备上返回全部簇
+        """
+        if end_cluster <= first_cluster:
+            return []
+        bytes_per_cluster = self.bytes_per_sector * self.sectors_per_cluster
+        heap_offset = self.cluster_begin_lba * self.bytes_per_sector
+        start = heap_offset + (first_cluster - 2) * bytes_per_cluster
+        extents = self.device.data_extents(start, (end_cluster - first_cluster) * bytes_per_cluster)
+        clusters = []
+        for offset, length in extents:
+            first = max(first_cluster, (offset - heap_offset) // bytes_per_cluster + 2)
+            last = (offset + length - 1 - heap_offset) // bytes_per_cluster + 2
+            if clusters and clusters[-1] >= first:
+                first = clusters[-1] + 1
+            clusters.extend(range(first, min(last, end_cluster - 1) + 1))
+        if self.bad_cluster_ranges:
+            clusters = [cluster for cluster in clusters if not self.is_bad_cluster(cluster)]
+        return clusters
+    
+    def load_bad_clusters(self):
+        """从设备句柄池的坏扇区图中取出数据区内读取失败过的簇段
+        
+        需要在簇大小和数据区位置确定之后调用。
+        """
+        self.bad_cluster_ranges = []
+        self._bad_cluster_starts = []
+        bytes_per_cluster = self.bytes_per_sector * self.sectors_per_cluster
+        if bytes_per_cluster <= 0:
+            return
+        heap_offset = self.cluster_begin_lba * self.bytes_per_sector
+        extents = device_pool.bad_extents(self.disk_path, heap_offset, self.count_of_clusters * bytes_per_cluster)
+        for offset, length in extents:
+            first = (offset - heap_offset) // bytes_per_cluster + 2
+            last = (offset + length - 1 - heap_offset) // bytes_per_cluster + 2
+            if self.bad_cluster_ranges and self.bad_cluster_ranges[-1][1] >= first - 1:
+                self.bad_cluster_ranges[-1] = (self.bad_cluster_ranges[-1][0], max(last, self.bad_cluster_ranges[-1][1]))
+            else:
+                self.bad_cluster_ranges.append((first, last))
+        self._bad_cluster_starts = [first for first, _ in self.bad_cluster_ranges]
+        if self.bad_cluster_ranges:
+            logging.info(f"数据区中有 {sum(last - first + 1 for first, last in self.bad_cluster_ranges)} 个坏簇，扫描时跳过")
+    
+    def is_bad_cluster(self, cluster: int) -> bool:
+        """簇中是否有已知读取失败的扇区"""
+        index = bisect.bisect_right(self._bad_cluster_starts, cluster) - 1
+        return index >= 0 and cluster <= self.bad_cluster_ranges[index][1]
     
     def parse_boot_sector(self) -> bool:
         """解析FAT32引导扇区，获取文件系统参数
@@ -185,7 +401,7 @@ class FAT32Recovery:
             # 设置bytes_per_sector的初始值，以便后续的seek操作正常工作
             self.bytes_per_sector = struct.unpack("<H", boot_sector[11:13])[0]
             if self.bytes_per_sector == 0 or self.bytes_per_sector > 4096:
-                self.bytes_per_sector = 512  # 使用默认值
+                self.bytes_per_sector = self.device.sector_size  # 使用设备的逻辑扇区大小
             
             # 更灵活的FAT32检测
             # 1. 检查FAT32字符串
@@ -242,6 +458,7 @@ class FAT32Recovery:
             logging.info(f"FAT32参数: FAT表数量={self.number_of_fats}, 每FAT扇区数={self.sectors_per_fat}")
             logging.info(f"FAT32参数: 根目录簇={self.root_cluster}, 总簇数={self.count_of_clusters}")
             
+            self.load_bad_clusters()
             return True
             
         except Exception as e:
@@ -260,20 +477,15 @@ class FAT32Recovery:
         if cluster < 2 or cluster >= self.count_of_clusters + 2:
             return 0x0FFFFFFF  # 链接结束标记
             
-        # 计算FAT表项在FAT表中的偏移
-        fat_offset = cluster * 4  # 每个FAT32表项4字节
-        
-        # 计算包含该表项的扇区
-        fat_sector = self.fat_begin_lba + (fat_offset // self.bytes_per_sector)
-        
-        # 计算表项在扇区内的偏移
-        entry_offset = fat_offset % self.bytes_per_sector
-        
-        # 读取扇区
-        fat_sector_data = self.read_sector(fat_sector)
+        if not self.device:
+            raise Exception("磁盘未打开")
+            
+        # 计算FAT表项在设备上的字节偏移(每个FAT32表项4字节)
+        entry_offset = self.fat_begin_lba * self.bytes_per_sector + cluster * self.FAT_ENTRY_SIZE
         
-        # 提取FAT表项的值
-        return struct.unpack("<I", fat_sector_data[entry_offset:entry_offset+4])[0] & 0x0FFFFFFF
+        # 只取出这4个字节，内存映射镜像上不产生复制，其他设备由块缓存命中
+        entry_view = self.device.read_view(entry_offset, self.FAT_ENTRY_SIZE)
+        return struct.unpack_from("<I", entry_view)[0] & 0x0FFFFFFF
     
     def get_cluster_chain(self, start_cluster: int) -> List[int]:
         """获取簇链
@@ -437,27 +649,67 @@ class FAT32Recovery:
         except ValueError:
             return "无效日期"
     
-    def scan_directory(self, cluster: int, path: str = "") -> List[Dict]:
-        """扫描目录，查找已删除的文件
+    def scan_directory(self, cluster: int, path: str = "", directory_clusters: Optional[set] = None) -> List[Dict]:
+        """扫描目录树，查找已删除的文件
+        
+        按层遍历：同一层全部目录的簇链通过read_cluster_chains一次并发读入，
+        解析出的子目录组成下一层。返回的列表仍是深度优先顺序，子目录中的文件
+        紧跟在该目录的目录项之后。
         
         Args:
             cluster: 目录起始簇号
             path: 当前目录路径
+            directory_clusters: 不为None时把扫描过的全部目录簇号加入该集合
             
         Returns:
             目录中的文件列表
         """
-        files = []
+        # (起始簇号, 路径) -> 该目录下的目录项
+        directories = {}
+        # 每个待扫描目录带着其上级目录的簇号，损坏的目录结构形成环时不会无限展开
+        level = [(cluster, path, frozenset())]
+        while level:
+            chains = [self.get_cluster_chain(start) for start, _, _ in level]
+            if directory_clusters is not None:
+                for chain in chains:
+                    directory_clusters.update(chain)
+            level_data = self.read_cluster_chains(chains)
+            next_level = []
+            for (start, dir_path, ancestors), cluster_datas in zip(level, level_data):
+                entries = self.parse_directory_clusters(cluster_datas, dir_path)
+                directories[(start, dir_path)] = entries
+                ancestors = ancestors | {start}
+                for entry in entries:
+                    if self.is_subdirectory(entry) and entry["start_cluster"] not in ancestors:
+                        next_level.append((entry["start_cluster"], entry["full_path"], ancestors))
+            level = next_level
         
-        # 获取目录的簇链
-        cluster_chain = self.get_cluster_chain(cluster)
-        if not cluster_chain:
+        def collect(key) -> List[Dict]:
+            files = []
+            for entry in directories.get(key, []):
+                files.append(entry)
+                if self.is_subdirectory(entry):
+                    files.extend(collect((entry["start_cluster"], entry["full_path"])))
             return files
+        
+        return collect((cluster, path))
+    
+    def is_subdirectory(self, entry: Dict) -> bool:
+        """目录项是否是需要继续扫描的子目录"""
+        return entry["is_directory"] and not entry["is_deleted"] and entry["start_cluster"] >= 2
+    
+    def parse_directory_clusters(self, cluster_datas: List, path: str) -> List[Dict]:
+        """解析一个目录的全部簇，返回其中的目录项(不含.和..)
+        
+        Args:
+            cluster_datas: 目录簇链各簇的数据
+            path: 目录路径
             
-        # 遍历簇链中的每个簇
-        for current_cluster in cluster_chain:
-            # 读取簇数据
-            cluster_data = self.read_cluster(current_cluster)
+        Returns:
+            目录项列表
+        """
+        files = []
+        for cluster_data in cluster_datas:
             
             # 用于保存长文件名条目
             lfn_entries = []
@@ -469,7 +721,12 @@ class FAT32Recovery:
                 if i + self.DIR_ENTRY_SIZE > len(cluster_data):
                     break
                     
-                entry_data = cluster_data[i:i+self.DIR_ENTRY_SIZE]
+                # 未使用的目录项直接跳过，不复制数据
+                if cluster_data[i] == 0x00:
+                    i += self.DIR_ENTRY_SIZE
+                    continue
+                    
+                entry_data = bytes(cluster_data[i:i+self.DIR_ENTRY_SIZE])
                 
                 # 解析目录项
                 entry = self.parse_directory_entry(entry_data)
@@ -518,11 +775,6 @@ class FAT32Recovery:
                 # 添加到文件列表
                 files.append(entry)
                 
-                # 如果是目录，递归扫描
-                if entry["is_directory"] and not entry["is_deleted"] and entry["start_cluster"] >= 2:
-                    subdir_files = self.scan_directory(entry["start_cluster"], full_path)
-                    files.extend(subdir_files)
-                
                 i += self.DIR_ENTRY_SIZE
         
         return files
@@ -542,7 +794,7 @@ class FAT32Recovery:
             if not self.parse_boot_sector():
                 logging.error("解析引导扇区失败，尝试使用默认参数")
                 # 使用一些常见默认参数
-                self.bytes_per_sector = 512
+                self.bytes_per_sector = self.device.sector_size
                 self.sectors_per_cluster = 8
                 self.reserved_sectors = 32
                 self.number_of_fats = 2
@@ -559,6 +811,7 @@ class FAT32Recovery:
                 self.count_of_clusters = self.data_sectors // self.sectors_per_cluster
                 
                 logging.info(f"使用默认FAT32参数: 每扇区字节={self.bytes_per_sector}, 每簇扇区数={self.sectors_per_cluster}")
+                self.load_bad_clusters()
                 
             # 从根目录开始扫描
             logging.info(f"开始从根目录簇 {self.root_cluster} 扫描文件")
@@ -574,7 +827,8 @@ class FAT32Recovery:
             # 如果从根目录扫描失败或没有找到文件，尝试扫描常见的起始簇
             if not all_files:
                 logging.info("从根目录未找到文件，尝试扫描其他可能的目录簇")
-                for cluster in range(2, min(100, self.count_of_clusters)):  # 尝试前100个簇
+                # 尝试前100个簇，稀疏镜像中落在空洞里的簇全为0，不可能是目录，直接跳过
+                for cluster in self.get_allocated_clusters(2, min(100, self.count_of_clusters)):
                     try:
                         cluster_files = self.scan_directory(cluster, f"/未知目录_{cluster}")
                         if cluster_files:
@@ -587,15 +841,22 @@ class FAT32Recovery:
             self.deleted_files = [f for f in all_files if f.get("is_deleted", False)]
             
             # 基于文件签名添加识别出的文件类型信息
-            for file in self.deleted_files:
+            # 各文件的首簇分散在整个分区，文件头作为一批请求并发读取(首簇是坏簇的不读取)
+            probe_files = [file for file in self.deleted_files
+                           if file["start_cluster"] >= 2 and not self.is_bad_cluster(file["start_cluster"])]
+            requests = [((self.cluster_begin_lba + (file["start_cluster"] - 2) * self.sectors_per_cluster)
+                         * self.bytes_per_sector, min(50, self.sectors_per_cluster * self.bytes_per_sector))
+                        for file in probe_files]
+            # 每个文件单独处理读取失败，一个文件头读不出不影响其余文件的识别
+            for index, data in self.device.read_batch(requests, self.READ_QUEUE_DEPTH, return_exceptions=True):
                 try:
-                    if file["start_cluster"] >= 2:
-                        cluster_data = self.read_cluster(file["start_cluster"])
-                        detected_type = self.detect_file_type_by_signature(cluster_data[:50])
-                        if detected_type:
-                            file["detected_type"] = detected_type
+                    if isinstance(data, Exception):
+                        raise data
+                    detected_type = self.detect_file_type_by_signature(bytes(data))
+                    if detected_type:
+                        probe_files[index]["detected_type"] = detected_type
                 except Exception as e:
-                    logging.debug(f"检测文件类型失败: {str(e)}")
+                    logging.debug(f"检测文件类型失败 {probe_files[index]['full_path']}: {str(e)}")
             
             # 按路径排序
             self.deleted_files.sort(key=lambda x: x["full_path"])
@@ -610,6 +871,63 @@ class FAT32Recovery:
         finally:
             self.close_disk()
     
+    def export_metadata_snapshot(self, output_path: str) -> Dict:
+        """导出只包含文件系统元数据的快照，供以后或在其他机器上离线扫描
+        
+        快照保存保留区(引导扇区、FSInfo及其备份)、全部FAT表、从根目录可达的目录簇、
+        已删除目录的首簇(孤立目录的候选)以及已删除文件首簇的第一个扇区(用于签名识别)；
+        根目录扫描不到文件时，与scan_for_deleted_files一样把前100个已分配簇也保存下来。
+        用快照路径创建FAT32Recovery即可调用scan_for_deleted_files，
+        但快照中没有文件数据，不能用来恢复文件内容。
+        
+        Args:
+            output_path: 快照文件路径
+            
+        Returns:
+            快照统计(区间数、保存字节数、卷大小)
+        """
+        if not self.open_disk():
+            raise Exception("无法打开磁盘")
+            
+        try:
+            if not self.parse_boot_sector():
+                raise Exception("解析引导扇区失败，无法导出元数据快照")
+            
+            bytes_per_cluster = self.bytes_per_sector * self.sectors_per_cluster
+            cluster_offset = lambda cluster: ((self.cluster_begin_lba + (cluster - 2) * self.sectors_per_cluster)
+                                              * self.bytes_per_sector)
+            # 保留区和各FAT表是数据区之前的连续区域
+            extents = [(0, self.cluster_begin_lba * self.bytes_per_sector)]
+            directory_clusters = set()
+            
+            files = []
+            try:
+                files = self.scan_directory(self.root_cluster, "", directory_clusters)
+            except Exception as e:
+                logging.error(f"从根目录扫描失败: {str(e)}")
+            if not files:
+                for cluster in self.get_allocated_clusters(2, min(100, self.count_of_clusters)):
+                    directory_clusters.add(cluster)
+                    try:
+                        files.extend(self.scan_directory(cluster, f"/未知目录_{cluster}", directory_clusters))
+                    except Exception as e:
+                        logging.debug(f"扫描簇 {cluster} 失败: {str(e)}")
+            
+            for entry in files:
+                if not entry["is_deleted"] or entry["start_cluster"] < 2:
+                    continue
+                if entry["is_directory"]:
+                    directory_clusters.add(entry["start_cluster"])
+                else:
+                    extents.append((cluster_offset(entry["start_cluster"]), self.bytes_per_sector))
+            extents.extend((cluster_offset(cluster), bytes_per_cluster) for cluster in directory_clusters)
+            
+            logging.info(f"导出元数据快照: {len(directory_clusters)} 个目录簇, {len(files)} 个目录项")
+            return write_metadata_snapshot(output_path, self.raw_device, extents, self.disk_path)
+            
+        finally:
+            self.close_disk()
+    
     def detect_file_type_by_signature(self, data: bytes) -> str:
         """根据文件签名检测文件类型
         
@@ -788,6 +1106,9 @@ class FAT32Recovery:
                 
                 # 计算需要的簇数量
                 required_clusters = (file_size + bytes_per_cluster - 1) // bytes_per_cluster if file_size > 0 else 1
+                
+                # 已经批量读入、尚未校验写出的后续簇数据
+                pending = deque()
 
                 # 主恢复循环 - 只尝试恢复连续的簇
                 while bytes_written < file_size and cluster_count < required_clusters:
@@ -803,8 +1124,20 @@ class FAT32Recovery:
                         logging.warning(f"下一个连续簇 {next_cluster} 已被占用。文件可能已碎片化。停止恢复。")
                         break
 
-                    # 读取并验证来自下一个连续簇的数据
-                    next_data = self.read_cluster(next_cluster)
+                    # 坏簇无法读取，按0填充后继续，不做内容校验
+                    if self.is_bad_cluster(next_cluster):
+                        logging.warning(f"簇 {next_cluster} 含有坏扇区，恢复的文件中该簇以0填充。")
+                        bytes_to_write = min(bytes_per_cluster, file_size - bytes_written)
+                        out_file.write(bytes(bytes_to_write))
+                        bytes_written += bytes_to_write
+                        current_cluster = next_cluster
+                        cluster_count += 1
+                        continue
+
+                    # 读取并验证来自下一个连续簇的数据(连续空闲簇一次分散读取)
+                    if not pending:
+                        pending.extend(self.read_free_cluster_run(next_cluster, required_clusters - cluster_count))
+                    next_data = pending.popleft()
                     
                     # 对于JPEG文件，执行严格的验证检查
                     if file_type in ['jpg', 'jpeg'] and not self.is_valid_jpeg_cluster(next_data):
@@ -848,6 +1181,28 @@ class FAT32Recovery:
         finally:
             self.close_disk()
     
+    def read_free_cluster_run(self, start_cluster: int, max_count: int) -> List:
+        """从start_cluster开始读取一段连续的空闲簇(FAT表项为0)，遇到坏簇时停止
+        
+        Args:
+            start_cluster: 起始簇号，调用方已确认它是空闲簇且不是坏簇
+            max_count: 最多读取的簇数量
+            
+        Returns:
+            簇数据列表，至少包含start_cluster本身
+        """
+        bytes_per_cluster = self.bytes_per_sector * self.sectors_per_cluster
+        limit = min(max_count, max(1, self.MAX_RUN_BYTES // bytes_per_cluster),
+                    self.count_of_clusters + 2 - start_cluster)
+        count = 1
+        while (count < limit and not self.is_bad_cluster(start_cluster + count)
+               and self.read_fat_entry(start_cluster + count) == 0):
+            count += 1
+        # 绕过预读层直接对原始设备做一次分散读取
+        clusters = self.read_cluster_runs(list(range(start_cluster, start_cluster + count)), self.raw_device)
+        # 内存映射镜像返回的是视图，签名查找需要bytes
+        return [bytes(data) if isinstance(data, memoryview) else data for data in clusters]
+    
     def truncate_file_at_eof(self, file_path: str, file_type: str):
         """根据文件类型的EOF签名截断文件"""
         if file_type not in self.FILE_EOF_SIGNATURES:
@@ -2,11 +2,13 @@ from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel,
                             QPushButton, QTableWidget, QTableWidgetItem, 
                             QHeaderView, QProgressBar, QFileDialog, QMessageBox,
                             QComboBox, QCheckBox)
-from PyQt6.QtCore import Qt, QSize
+from PyQt6.QtCore import Qt, QSize, QTimer
 from PyQt6.QtGui import QIcon
 import os
 import logging
+import threading
 from fat32_recovery import FAT32Recovery
+from metadata_snapshot import SNAPSHOT_EXTENSION
 
 class FAT32RecoveryDialog(QDialog):
     def __init__(self, parent=None):
@@ -101,6 +103,16 @@ class FAT32RecoveryDialog(QDialog):
         self.deleted_files = []
         self.selected_disk = ""
         
+        # 扫描在后台线程中进行(元数据按元数据优先级、数据簇按批量优先级调度)，
+        # 对话框用定时器查询扫描是否结束，扫描期间界面和十六进制浏览不会卡住；
+        # 扫描不能中途取消，关闭对话框只是隐藏，扫描继续进行
+        self.scan_thread = None
+        self.scan_result = None
+        self.scan_error = None
+        self.scan_timer = QTimer(self)
+        self.scan_timer.setInterval(200)
+        self.scan_timer.timeout.connect(self.check_scan)
+        
         # 创建布局
         self.init_ui()
     
@@ -113,12 +125,18 @@ class FAT32RecoveryDialog(QDialog):
         disk_layout = QHBoxLayout()
         self.disk_label = QLabel("选择FAT32分区:")
         self.disk_combo = QComboBox()
+        self.open_image_button = QPushButton("打开磁盘镜像...")
+        self.open_image_button.clicked.connect(self.open_disk_image)
         self.scan_button = QPushButton("扫描已删除文件")
         self.scan_button.clicked.connect(self.scan_deleted_files)
+        self.export_snapshot_button = QPushButton("导出元数据快照...")
+        self.export_snapshot_button.clicked.connect(self.export_metadata_snapshot)
         
         disk_layout.addWidget(self.disk_label)
         disk_layout.addWidget(self.disk_combo)
+        disk_layout.addWidget(self.open_image_button)
         disk_layout.addWidget(self.scan_button)
+        disk_layout.addWidget(self.export_snapshot_button)
         disk_layout.addStretch()
         
         # 过滤选项
@@ -194,7 +212,7 @@ class FAT32RecoveryDialog(QDialog):
         self.init_disk_list()
     
     def init_disk_list(self):
-        """初始化FAT32分区列表"""
+        """初始化FAT32分区列表(逻辑驱动器以及物理磁盘分区表中的FAT32分区)"""
         try:
             from disk_utils import DiskUtils
             drives = DiskUtils.get_disk_list()
@@ -202,6 +220,15 @@ class FAT32RecoveryDialog(QDialog):
             
             for drive, label in drives:
                 self.disk_combo.addItem(f"{label}", drive)
+            
+            # 物理磁盘上的分区(包括没有分配盘符的分区)
+            _, physicals = DiskUtils.get_disk_list_grouped()
+            for phy_path, phy_name in physicals:
+                try:
+                    for part_path, part_label in DiskUtils.get_fat32_partitions(phy_path):
+                        self.disk_combo.addItem(f"{phy_name} - {part_label}", part_path)
+                except Exception as e:
+                    logging.debug(f"读取 {phy_path} 分区表失败: {str(e)}")
                 
             if self.disk_combo.count() > 0:
                 self.scan_button.setEnabled(True)
@@ -212,6 +239,27 @@ class FAT32RecoveryDialog(QDialog):
             logging.error(f"初始化磁盘列表失败: {str(e)}")
             QMessageBox.critical(self, "错误", f"初始化磁盘列表失败: {str(e)}")
     
+    def open_disk_image(self):
+        """打开磁盘镜像，把其中的FAT32分区加入列表"""
+        file_name, _ = QFileDialog.getOpenFileName(self, "打开磁盘镜像", "",
+                                                   "磁盘镜像 (*.img *.dd *.raw *.bin *.vhd *.vmdk *.E01 *.001 *.ohxz *.ohxmeta);;所有文件 (*.*)")
+        if not file_name:
+            return
+        try:
+            from disk_utils import DiskUtils
+            volumes = DiskUtils.get_fat32_partitions(file_name)
+            if not volumes:
+                QMessageBox.warning(self, "警告", "镜像中没有找到FAT32分区")
+                return
+            image_name = os.path.basename(file_name)
+            for path, label in volumes:
+                self.disk_combo.addItem(f"{image_name} - {label}", path)
+            self.disk_combo.setCurrentIndex(self.disk_combo.count() - len(volumes))
+            self.scan_button.setEnabled(True)
+        except Exception as e:
+            logging.error(f"打开磁盘镜像失败: {str(e)}")
+            QMessageBox.critical(self, "错误", f"打开磁盘镜像失败: {str(e)}")
+    
     def scan_deleted_files(self):
         """扫描分区中的已删除文件"""
         if self.disk_combo.count() == 0:
@@ -236,33 +284,78 @@ class FAT32RecoveryDialog(QDialog):
         self.recover_selected_btn.setEnabled(False)
         self.recover_all_btn.setEnabled(False)
         
+        # 创建恢复工具实例，在后台线程中扫描已删除文件
+        self.recovery_tool = FAT32Recovery(self.selected_disk)
+        self.scan_result = None
+        self.scan_error = None
+        self.scan_thread = threading.Thread(target=self._scan_worker, args=(self.recovery_tool,),
+                                            name="fat32-scan", daemon=True)
+        self.scan_thread.start()
+        self.scan_timer.start()
+    
+    def _scan_worker(self, recovery_tool: FAT32Recovery):
+        """扫描线程：只保存结果，界面在check_scan中更新"""
         try:
-            # 创建恢复工具实例
-            self.recovery_tool = FAT32Recovery(self.selected_disk)
-            
-            # 扫描已删除文件
-            self.deleted_files = self.recovery_tool.scan_for_deleted_files()
-            
-            # 恢复按钮状态
-            self.scan_button.setEnabled(True)
-            if self.deleted_files:
-                self.recover_selected_btn.setEnabled(True)
-                self.recover_all_btn.setEnabled(True)
-            
-            # 应用过滤器并显示文件
-            self.apply_filters()
-            
-            # 隐藏进度条
-            self.progress_bar.setVisible(False)
-            
-            # 显示结果信息
+            self.scan_result = recovery_tool.scan_for_deleted_files()
+        except Exception as e:
+            self.scan_error = e
+    
+    def check_scan(self):
+        """扫描结束后显示结果"""
+        if self.scan_thread is None or self.scan_thread.is_alive():
+            return
+        self.scan_timer.stop()
+        self.scan_thread = None
+        
+        # 恢复按钮状态
+        self.scan_button.setEnabled(True)
+        # 隐藏进度条
+        self.progress_bar.setVisible(False)
+        
+        if self.scan_error is not None:
+            logging.error(f"扫描删除文件失败: {str(self.scan_error)}")
+            QMessageBox.critical(self, "错误", f"扫描删除文件失败: {str(self.scan_error)}")
+            return
+        
+        self.deleted_files = self.scan_result or []
+        # 元数据快照中没有文件数据，只能查看扫描结果
+        if self.deleted_files and not self.selected_disk.lower().endswith(SNAPSHOT_EXTENSION):
+            self.recover_selected_btn.setEnabled(True)
+            self.recover_all_btn.setEnabled(True)
+        
+        # 应用过滤器并显示文件
+        self.apply_filters()
+        
+        # 显示结果信息；对话框关闭(隐藏)期间扫描完成时只更新表格，再次打开时可以看到结果
+        if self.isVisible():
             QMessageBox.information(self, "扫描完成", f"扫描完成，共找到 {len(self.deleted_files)} 个已删除文件。")
-            
+    
+    def export_metadata_snapshot(self):
+        """把选中分区的文件系统元数据导出为快照文件，之后可以直接打开快照扫描"""
+        disk_path = self.disk_combo.currentData()
+        if not disk_path:
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "导出元数据快照", "",
+                                                   "元数据快照 (*.ohxmeta);;所有文件 (*.*)")
+        if not file_name:
+            return
+        if not file_name.lower().endswith(SNAPSHOT_EXTENSION):
+            file_name += SNAPSHOT_EXTENSION
+        
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setMaximum(0)
+        self.export_snapshot_button.setEnabled(False)
+        try:
+            stats = FAT32Recovery(disk_path).export_metadata_snapshot(file_name)
+            QMessageBox.information(self, "导出完成",
+                                    f"元数据快照已导出到 {file_name}\n"
+                                    f"保存 {stats['extents']} 个区间，共 {self.format_file_size(stats['stored_bytes'])}。")
         except Exception as e:
-            logging.error(f"扫描删除文件失败: {str(e)}")
-            self.scan_button.setEnabled(True)
+            logging.error(f"导出元数据快照失败: {str(e)}")
+            QMessageBox.critical(self, "错误", f"导出元数据快照失败: {str(e)}")
+        finally:
             self.progress_bar.setVisible(False)
-            QMessageBox.critical(self, "错误", f"扫描删除文件失败: {str(e)}")
+            self.export_snapshot_button.setEnabled(True)
     
     def apply_filters(self):
         """应用过滤条件并更新表格"""
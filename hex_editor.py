@@ -1,12 +1,30 @@
+import time
+import bisect
+import logging
+from collections import OrderedDict, deque
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, 
                              QScrollArea, QLabel, QLineEdit, QPushButton)
-from PyQt6.QtCore import Qt, QRect, QSize, pyqtSignal
-from PyQt6.QtGui import QPainter, QColor, QFont, QPen, QFontMetrics, QBrush
+from PyQt6.QtCore import Qt, QRect, QLine, QSize, pyqtSignal
+from PyQt6.QtGui import QPainter, QColor, QFont, QPen, QFontMetrics, QFontMetricsF, QBrush, QPixmap
+from paged_data import PagedData
+from io_scheduler import io_priority, PRIORITY_BULK
+from highlight_overlay import (HighlightOverlay, SOURCE_MFT, SOURCE_SEARCH, SOURCE_BOOKMARK,
+                               COLOR_SEARCH, COLOR_BOOKMARK, mft_record_spans)
+
+# 按字节值查表生成一行的显示文本
+HEX_CELLS = tuple(f"{value:02X} " for value in range(256))
+ASCII_TABLE = bytes(value if 32 <= value <= 126 else ord('.') for value in range(256))
+# 绘制好的行按每TILE_ROWS行一个图块缓存，滚动时直接复制
+TILE_ROWS = 16
+TILE_CACHE_SIZE = 16
+# 查找时每次读取的字节数，分页视图不会整个读入内存
+SEARCH_CHUNK = 1024 * 1024
 
 class HexEditor(QWidget):
     # 定义信号
     sector_changed = pyqtSignal(int)
     cluster_changed = pyqtSignal(int)
+    data_modified = pyqtSignal()
     
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -19,13 +37,18 @@ class HexEditor(QWidget):
         self.cell_height = 20
         self.offset_width = 100
         self.ascii_width = 200
+        self.ascii_cell_width = 10
         self.margin = 5
         self.current_sector = 0
         self.current_cluster = 0
         self.sector_size = 512
-        self.sectors_per_view = 9  # 一次显示9个扇区
-        self.sector_data = []      # 存储多个扇区数据
-        self.sector_base = 0       # 当前显示的第一个扇区号
+        self.sector_lines = False  # 是否在扇区边界画分隔线(浏览磁盘时)
+        self.bad_ranges = []       # 读取失败(以0填充)的(起始, 结束)字节区间
+        self.overlay = None        # 写时复制编辑层，修改只写入编辑层
+        self.data_offset = 0       # data[0]在设备上的偏移
+        self.low_nibble = False    # 输入十六进制数字时下一个是否是低4位
+        self.data_generation = 0   # 每次set_data加1，已缓存的图块随之作废
+        self.highlights = HighlightOverlay()  # MFT/FAT32结构、书签、搜索结果等着色区间
         
         # 设置固定字体
         self.font = QFont("Courier New", 10)
@@ -42,6 +65,16 @@ class HexEditor(QWidget):
         self.char_width = self.font_metrics.horizontalAdvance("0")
         self.char_height = self.font_metrics.height()
         
+        # 整行绘制用的字体：调整字间距，使十六进制的每个字节(含空格3个字符)正好占一个单元格，
+        # ASCII的每个字符占ascii_cell_width
+        advance = QFontMetricsF(self.font).horizontalAdvance("0")
+        self.hex_row_font = QFont(self.font)
+        self.hex_row_font.setKerning(False)
+        self.hex_row_font.setLetterSpacing(QFont.SpacingType.AbsoluteSpacing, self.cell_width / 3 - advance)
+        self.ascii_row_font = QFont(self.font)
+        self.ascii_row_font.setKerning(False)
+        self.ascii_row_font.setLetterSpacing(QFont.SpacingType.AbsoluteSpacing, self.ascii_cell_width - advance)
+        
         # 设置最小尺寸
         self.setMinimumSize(800, 400)
         
@@ -70,8 +103,11 @@ class HexEditor(QWidget):
         middle_status = QHBoxLayout()
         self.sector_label = QLabel("扇区: 0")
         self.cluster_label = QLabel("簇: 0")
+        # 上一帧的绘制耗时
+        self.frame_label = QLabel("绘制: - ms")
         middle_status.addWidget(self.sector_label)
         middle_status.addWidget(self.cluster_label)
+        middle_status.addWidget(self.frame_label)
         
         # 右侧跳转按钮
         right_status = QHBoxLayout()
@@ -91,21 +127,19 @@ class HexEditor(QWidget):
         
         layout.addLayout(status_layout)
     
-    def set_sector_data(self, sector_data: list, base_sector: int):
-        """设置多个扇区的数据和基准扇区号"""
-        self.sector_data = sector_data
-        self.data = b''.join(sector_data)
-        self.sector_base = base_sector
-        self.cursor_position = 0
-        self.selection_start = -1
-        self.selection_end = -1
-        self.hex_area.update()
-        self.update_status()
-    
     def update_status(self):
-        self.offset_label.setText(f"偏移: 0x{self.cursor_position:08X}")
+        # 光标处着色区间的说明(结构字段名、书签等)
+        label = self.highlights.label_at(self.cursor_position) if self.highlights else ""
+        self.offset_label.setText(f"偏移: 0x{self.data_offset + self.cursor_position:08X}" + (f"  {label}" if label else ""))
         self.size_label.setText(f"大小: {len(self.data)} 字节")
-        self.sector_label.setText(f"扇区: {self.current_sector} (显示: {self.sector_base}-{self.sector_base+len(self.sector_data)-1})")
+        if self.sector_lines and self.sector_size:
+            # 磁盘视图按光标和可见范围计算扇区号
+            first, last = self.hex_area.visible_range()
+            self.current_sector = (self.data_offset + self.cursor_position) // self.sector_size
+            self.sector_label.setText(f"扇区: {self.current_sector} (显示: {(self.data_offset + first) // self.sector_size}"
+                                      f"-{(self.data_offset + max(first, last - 1)) // self.sector_size})")
+        else:
+            self.sector_label.setText(f"扇区: {self.current_sector}")
         self.cluster_label.setText(f"簇: {self.current_cluster}")
     
     def set_current_sector(self, sector):
@@ -116,17 +150,178 @@ class HexEditor(QWidget):
         self.current_cluster = cluster
         self.update_status()
 
+    def load_device(self, device, offset: int = 0, length: int = None, sector_lines: bool = False):
+        """在块设备上打开分页视图，只读取可见部分所在的页
+
+        Args:
+            device: BlockDevice实例(调用方在视图使用期间保持设备打开)
+            offset: 起始偏移
+            length: 视图长度，默认到设备末尾
+            sector_lines: 是否按扇区画分隔线并显示扇区号(浏览磁盘时)
+        """
+        self.set_data(PagedData(device, offset, length))
+        self.data_offset = offset
+        self.sector_lines = sector_lines
+        if sector_lines:
+            self.sector_size = device.sector_size
+        self.update_status()
+
+    def goto_offset(self, position: int):
+        """把光标移到position(相对当前数据)并滚动到可见"""
+        if not 0 <= position < len(self.data):
+            raise ValueError(f"偏移超出范围: {position}")
+        self.cursor_position = position
+        self.selection_start = self.selection_end = -1
+        self.hex_area.selection_start = self.hex_area.selection_end = -1
+        self.low_nibble = False
+        self.hex_area.scroll_to(position, top=True)
+        self.update_status()
+
+    def set_overlay(self, overlay):
+        """设置写时复制编辑层(EditOverlay)，之后的修改写入编辑层，显示时合并编辑层中的内容"""
+        self.overlay = overlay
+        self.hex_area.update()
+
+    def byte_at(self, position: int) -> int:
+        """返回position处的字节(分页视图建在编辑层上时已合并修改)"""
+        return self.data[position]
+
+    def is_editable(self) -> bool:
+        return self.overlay is not None or isinstance(self.data, bytearray)
+
+    def modify(self, position: int, data: bytes):
+        """把data写到position处；有编辑层时写入编辑层，底层数据不变"""
+        if not self.is_editable():
+            return
+        data = bytes(data[:max(0, len(self.data) - position)])
+        if not data:
+            return
+        if self.overlay is not None:
+            self.overlay.write(self.data_offset + position, data)
+            if isinstance(self.data, PagedData):
+                self.data.invalidate(position, len(data))
+        if isinstance(self.data, bytearray):
+            self.data[position:position + len(data)] = data
+        # 只重绘包含修改字节的图块
+        self.hex_area.invalidate_tiles(position, position + len(data))
+        self.data_modified.emit()
+
     def set_data(self, data: bytes):
-        """直接设置编辑器数据（用于文件/扇区/簇跳转）"""
-        self.data = bytearray(data)
+        """直接设置编辑器数据（用于文件/扇区/簇跳转）
+
+        memoryview(例如内存映射镜像的切片)和分页视图直接引用，不做复制。
+        """
+        self.data = data if isinstance(data, (memoryview, PagedData)) else bytearray(data)
+        self.data_generation += 1
         self.cursor_position = 0
         self.selection_start = -1
         self.selection_end = -1
-        self.sector_data = []
-        self.sector_base = 0
+        self.hex_area.selection_start = -1
+        self.hex_area.selection_end = -1
+        self.hex_area.scroll_offset = 0
+        self.sector_lines = False
+        self.highlights.clear()
+        self.bad_ranges = []
+        self.overlay = None
+        self.data_offset = 0
+        self.low_nibble = False
         self.hex_area.update()
         self.update_status()
 
+    def set_bad_ranges(self, ranges: list):
+        """标记读取失败的字节区间，这些字节显示为??而不是填充的0
+
+        Args:
+            ranges: (起始偏移, 长度)列表，偏移相对当前数据
+        """
+        self.bad_ranges = sorted((start, start + length) for start, length in ranges if length > 0)
+        self.hex_area.update()
+
+    def set_highlights(self, source: str, spans):
+        """替换一个来源(highlight_overlay中的SOURCE_*)的着色区间，只重绘新旧区间所在的图块
+
+        Args:
+            spans: (起始, 结束, 颜色[, 说明])列表，偏移相对当前数据
+        """
+        spans = list(spans)
+        old = self.highlights.spans(source)
+        self.highlights.set_source(source, spans)
+        self.hex_area.invalidate_spans(old + spans)
+        self.update_status()
+
+    def highlight_mft_record(self):
+        """按MFT记录的结构给当前数据着色"""
+        try:
+            self.set_highlights(SOURCE_MFT, mft_record_spans(bytes(self.data[:])))
+        except Exception as e:
+            logging.debug(f"解析MFT记录失败: {str(e)}")
+
+    def set_search_hits(self, positions, length: int):
+        """标记搜索结果：positions处各length字节"""
+        self.set_highlights(SOURCE_SEARCH, [(position, position + length, COLOR_SEARCH, "搜索结果")
+                                            for position in positions])
+
+    def find(self, pattern: bytes, start: int = 0, progress=None) -> int:
+        """从start开始查找pattern，返回相对当前数据的位置，找不到或被取消时返回-1
+
+        按SEARCH_CHUNK分块读取，相邻块重叠len(pattern)-1字节；每查完一块调用
+        progress(已查到的位置)，返回False时停止查找。分页视图的数据按批量优先级
+        直接从设备(和编辑层)读取，不挤掉浏览用的页和缓存，也不抢在交互式和元数据读取前面。
+        """
+        if not pattern:
+            return -1
+        data = self.data
+        length = len(data)
+        position = max(0, start)
+        while position + len(pattern) <= length:
+            size = SEARCH_CHUNK + len(pattern) - 1
+            if isinstance(data, PagedData):
+                # progress中处理界面事件时的重绘仍按交互式优先级读取，只把查找的读取归入批量
+                with io_priority(PRIORITY_BULK):
+                    chunk = data.read_uncached(position, size)
+            else:
+                chunk = bytes(data[position:position + size])
+            index = chunk.find(pattern)
+            if index >= 0:
+                return position + index
+            position += SEARCH_CHUNK
+            if progress is not None and not progress(position):
+                break
+        return -1
+
+    def show_search_hit(self, position: int, pattern: bytes):
+        """跳转到position处的匹配，并把跳转后可见范围内的全部匹配标为搜索结果"""
+        self.goto_offset(position)
+        first, last = self.hex_area.visible_range()
+        window = bytes(self.data[first:last + len(pattern) - 1])
+        hits = []
+        index = window.find(pattern)
+        while index >= 0:
+            hits.append(first + index)
+            index = window.find(pattern, index + 1)
+        self.set_search_hits(hits, len(pattern))
+
+    def toggle_bookmark(self, position: int = None):
+        """在position(默认为光标处)添加或删除书签"""
+        position = self.cursor_position if position is None else position
+        bookmarks = self.highlights.spans(SOURCE_BOOKMARK)
+        remaining = [span for span in bookmarks if not span[0] <= position < span[1]]
+        if len(remaining) == len(bookmarks):
+            remaining.append((position, position + 1, COLOR_BOOKMARK, "书签"))
+        self.set_highlights(SOURCE_BOOKMARK, remaining)
+
+    def current_bad_ranges(self) -> list:
+        """显式标记的和分页读取中发现的读取失败区间，(起始, 结束)列表"""
+        if isinstance(self.data, PagedData):
+            return sorted(self.bad_ranges + self.data.bad_ranges())
+        return self.bad_ranges
+
+    def is_bad_offset(self, offset: int, ranges: list = None) -> bool:
+        """offset处的字节是否读取失败"""
+        ranges = self.bad_ranges if ranges is None else ranges
+        index = bisect.bisect_right(ranges, (offset, float('inf'))) - 1
+        return index >= 0 and offset < ranges[index][1]
+
 class HexArea(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -146,140 +341,275 @@ class HexArea(QWidget):
         self.is_selecting = False
         self.selection_start = -1
         self.selection_end = -1
+        # 最近若干帧的绘制耗时(毫秒)
+        self.frame_times = deque(maxlen=120)
+        # 已绘制好的图块：图块序号 -> (生成时的选中区域和坏扇区, 图像)，按最近使用排序
+        self.tiles = OrderedDict()
+        self.tiles_key = None
+        self.tiles_rendered = 0
+    
+    def max_scroll(self) -> int:
+        rows = (len(self.hex_editor.data) + self.hex_editor.bytes_per_line - 1) // self.hex_editor.bytes_per_line
+        return max(0, rows * self.hex_editor.cell_height - self.height())
+    
+    def visible_range(self):
+        """当前可见的[起始, 结束)字节范围"""
+        bytes_per_line = self.hex_editor.bytes_per_line
+        first_row = int(self.scroll_offset // self.hex_editor.cell_height)
+        last_row = int((self.scroll_offset + self.height()) // self.hex_editor.cell_height) + 1
+        return (min(len(self.hex_editor.data), first_row * bytes_per_line),
+                min(len(self.hex_editor.data), last_row * bytes_per_line))
+    
+    def scroll_to(self, position: int, top: bool = False):
+        """滚动使position所在的行可见；top为True时把该行放到最上面"""
+        row_y = position // self.hex_editor.bytes_per_line * self.hex_editor.cell_height
+        if top or row_y < self.scroll_offset:
+            self.scroll_offset = row_y
+        elif row_y + self.hex_editor.cell_height > self.scroll_offset + self.height():
+            self.scroll_offset = row_y + self.hex_editor.cell_height - self.height()
+        self.scroll_offset = max(0, min(self.scroll_offset, self.max_scroll()))
+        self.update()
     
     def paintEvent(self, event):
         if not self.hex_editor.data or len(self.hex_editor.data) == 0:
             return
+        frame_start = time.perf_counter()
+        editor = self.hex_editor
+        bytes_per_line = editor.bytes_per_line
+        tile_height = TILE_ROWS * editor.cell_height
+        # 最后一行之下还有一条横线，与数据长度是否整行无关
+        total_rows = len(editor.data) // bytes_per_line + 1
+        visible_rect = event.rect()
+        first_tile = max(0, int((visible_rect.y() + self.scroll_offset) // tile_height))
+        last_tile = min((total_rows - 1) // TILE_ROWS,
+                        int((visible_rect.y() + visible_rect.height() + self.scroll_offset) // tile_height))
         
-        # 检查是否是NTFS的$MFT文件
-        is_mft = hasattr(self.hex_editor, 'is_mft') and self.hex_editor.is_mft
-        mft_record = None
-        if is_mft:
-            try:
-                from disk_utils import DiskUtils
-                mft_record = DiskUtils.parse_mft_record(bytes(self.hex_editor.data))
-            except:
-                is_mft = False
+        # 显示的数据或显示设置变化后，缓存的图块全部作废
+        key = self.tile_key()
+        if key != self.tiles_key:
+            self.tiles.clear()
+            self.tiles_key = key
+        
+        # 分页视图先读入可见范围及前后的页，读取中发现的坏扇区在比较图块状态之前就已知
+        if isinstance(editor.data, PagedData):
+            editor.data.prefetch(first_tile * TILE_ROWS * bytes_per_line,
+                                 (last_tile + 1) * TILE_ROWS * bytes_per_line)
+        bad_ranges = editor.current_bad_ranges()
         
         painter = QPainter(self)
-        painter.setFont(self.hex_editor.font)
-        painter.fillRect(event.rect(), QColor("#2c2c2c")) # 修改为暗色背景
-        painter.setPen(QPen(QColor("#555555"))) # 修改为更深的网格线颜色
-        visible_rect = event.rect()
-        start_y = max(0, int((visible_rect.y() + self.scroll_offset) // self.hex_editor.cell_height))
-        end_y = min(len(self.hex_editor.data) // self.hex_editor.bytes_per_line + 1,
-                   int((visible_rect.y() + visible_rect.height() + self.scroll_offset) // self.hex_editor.cell_height + 1))
+        painter.fillRect(visible_rect, QColor("#2c2c2c")) # 修改为暗色背景
+        # 数据之后的空白部分只有垂直网格线
+        painter.setPen(QPen(QColor("#555555")))
+        self.draw_column_lines(painter, self.height())
+        
+        # 滚动时大部分图块直接取自缓存，只生成新露出的图块
+        rendered = 0
+        for tile in range(first_tile, last_tile + 1):
+            pixmap, fresh = self.tile_pixmap(tile, bad_ranges)
+            rendered += fresh
+            painter.drawPixmap(0, int(tile * tile_height - self.scroll_offset), pixmap)
+        painter.end()
+        
+        self.frame_times.append((time.perf_counter() - frame_start) * 1000)
+        self.tiles_rendered += rendered
+        editor.frame_label.setText(f"绘制: {self.frame_times[-1]:.1f} ms")
+    
+    def tile_key(self) -> tuple:
+        """决定图块内容的数据和显示设置(字体、网格大小等)，任何一项变化时所有图块作废"""
+        editor = self.hex_editor
+        return (editor.data_generation, editor.data_offset, editor.sector_lines, editor.sector_size,
+                self.width(), self.devicePixelRatioF(),
+                editor.font.toString(), editor.cell_width, editor.cell_height, editor.bytes_per_line)
+    
+    def invalidate_tiles(self, start: int = 0, end: int = None):
+        """丢弃包含[start, end)字节的图块(数据被修改后调用)，end为None时丢弃全部"""
+        if end is None:
+            self.tiles.clear()
+            self.update()
+        else:
+            self.invalidate_spans([(start, end)])
+    
+    def invalidate_spans(self, spans):
+        """丢弃与各(起始, 结束, ...)区间重叠的图块(着色区间变化后调用)"""
+        tile_bytes = TILE_ROWS * self.hex_editor.bytes_per_line
+        cached = set(self.tiles)
+        stale = set()
+        for span in spans:
+            first, last = span[0] // tile_bytes, (max(span[0] + 1, span[1]) - 1) // tile_bytes
+            # 很长的区间只检查已缓存的图块
+            if last - first < len(cached):
+                stale.update(tile for tile in range(first, last + 1) if tile in cached)
+            else:
+                stale.update(tile for tile in cached if first <= tile <= last)
+        for tile in stale:
+            self.tiles.pop(tile, None)
+        self.update()
+    
+    def tile_pixmap(self, tile: int, bad_ranges: list):
+        """返回图块的图像和是否是新生成的
+        
+        图块缓存时记录其中的选中区域和坏扇区，只有与当前状态不同的图块才重新生成。
+        """
+        bytes_per_line = self.hex_editor.bytes_per_line
+        start = tile * TILE_ROWS * bytes_per_line
+        end = min(len(self.hex_editor.data), start + TILE_ROWS * bytes_per_line)
+        selection = None
+        if self.selection_start != -1 and self.selection_end != -1:
+            selection = (max(start, min(self.selection_start, self.selection_end)),
+                         min(end, max(self.selection_start, self.selection_end) + 1))
+            if selection[0] >= selection[1]:
+                selection = None
+        state = (selection, tuple(self.clip_ranges(bad_ranges, start, end)))
+        cached = self.tiles.get(tile)
+        if cached is not None and cached[0] == state:
+            self.tiles.move_to_end(tile)
+            return cached[1], False
+        pixmap = self.render_tile(tile, bad_ranges)
+        self.tiles[tile] = (state, pixmap)
+        self.tiles.move_to_end(tile)
+        while len(self.tiles) > TILE_CACHE_SIZE:
+            self.tiles.popitem(last=False)
+        return pixmap, True
+    
+    def render_tile(self, tile: int, bad_ranges: list):
+        """生成一个图块：TILE_ROWS行的背景、网格线、偏移地址、十六进制和ASCII文本"""
+        editor = self.hex_editor
+        bytes_per_line = editor.bytes_per_line
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(int(self.width() * ratio), int(TILE_ROWS * editor.cell_height * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(QColor("#2c2c2c")) # 修改为暗色背景
+        
+        painter = QPainter(pixmap)
+        painter.setFont(editor.font)
+        # 图块内的坐标以图块第一行的顶部为原点
+        origin = tile * TILE_ROWS * editor.cell_height
+        start_y = tile * TILE_ROWS
+        end_y = min(len(editor.data) // bytes_per_line + 1, start_y + TILE_ROWS)
+        first = start_y * bytes_per_line
+        last = min(len(editor.data), end_y * bytes_per_line)
+        visible = bytes(editor.data[first:last])
+        ascii_start_x = editor.offset_width + bytes_per_line * editor.cell_width + 20
+        
+        # 背景：着色区间(一次查询整个图块)、坏扇区、选中区域，每行合并为一个矩形，后画的覆盖先画的
+        for start, end, color, _ in editor.highlights.query(first, last):
+            self.fill_span(painter, max(start, first), min(end, last), QColor(color), ascii_start_x, False, origin)
+        for start, end in self.clip_ranges(bad_ranges, first, last):
+            self.fill_span(painter, start, end, QColor("#5C0000"), ascii_start_x, True, origin)
+        if self.selection_start != -1 and self.selection_end != -1:
+            selection_first = min(self.selection_start, self.selection_end)
+            selection_last = max(self.selection_start, self.selection_end) + 1
+            self.fill_span(painter, max(selection_first, first), min(selection_last, last), QColor("#0078D7"),
+                           ascii_start_x, True, origin)
         
         # 绘制水平网格线
-        for y in range(start_y, end_y):
-            line_y = int(y * self.hex_editor.cell_height - self.scroll_offset)
-            painter.drawLine(0, line_y, self.width(), line_y)
+        painter.setPen(QPen(QColor("#555555"))) # 修改为更深的网格线颜色
+        painter.drawLines([QLine(0, y * editor.cell_height - origin, self.width(), y * editor.cell_height - origin)
+                           for y in range(start_y, end_y)])
         
-        # 绘制扇区分隔虚线
-        lines_per_sector = self.hex_editor.sector_size // self.hex_editor.bytes_per_line if self.hex_editor.bytes_per_line else 1
-        for s in range(1, len(self.hex_editor.sector_data)):
-            y = int(s * lines_per_sector * self.hex_editor.cell_height - self.scroll_offset)
+        # 绘制扇区分隔虚线(按设备上的扇区边界)
+        if editor.sector_lines and editor.sector_size:
             pen = QPen(QColor("#777777"), 1, Qt.PenStyle.DashLine) # 更亮的分隔线
             painter.setPen(pen)
-            painter.drawLine(0, y, self.width(), y)
+            for row in range(max(1, start_y), end_y):
+                if (editor.data_offset + row * bytes_per_line) % editor.sector_size == 0:
+                    y = row * editor.cell_height - origin
+                    painter.drawLine(0, y, self.width(), y)
             painter.setPen(QPen(QColor("#555555"))) # 恢复网格线颜色
         
-        # 绘制垂直网格线
-        for x in range(0, self.hex_editor.bytes_per_line + 1):
-            line_x = self.hex_editor.offset_width + x * self.hex_editor.cell_width
-            painter.drawLine(line_x, 0, line_x, self.height())
+        # 绘制垂直网格线和ASCII区域分隔线
+        self.draw_column_lines(painter, TILE_ROWS * editor.cell_height)
         
-        # 绘制ASCII区域分隔线
-        ascii_start_x = self.hex_editor.offset_width + self.hex_editor.bytes_per_line * self.hex_editor.cell_width + 20
-        painter.drawLine(ascii_start_x, 0, ascii_start_x, self.height())
+        # 文字在单元格内垂直居中
+        baseline = (editor.cell_height - editor.font_metrics.height()) // 2 + editor.font_metrics.ascent()
         
         # 绘制偏移地址
         painter.setPen(QPen(QColor("#999999"))) # 灰白色偏移地址
-        for i in range(start_y, end_y):
-            offset = i * self.hex_editor.bytes_per_line
-            y = int(i * self.hex_editor.cell_height - self.scroll_offset)
-            rect = QRect(self.hex_editor.margin, y, 100, self.hex_editor.cell_height)
-            painter.drawText(rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
-                           f"{offset:08X}")
+        for row in range(start_y, end_y):
+            if row * bytes_per_line >= len(editor.data):
+                break
+            y = row * editor.cell_height - origin
+            painter.drawText(editor.margin, y + baseline, f"{editor.data_offset + row * bytes_per_line:08X}")
         
-        # 绘制十六进制值
-        for i in range(start_y * self.hex_editor.bytes_per_line,
-                      min(len(self.hex_editor.data), end_y * self.hex_editor.bytes_per_line)):
-            x = self.hex_editor.offset_width + (i % self.hex_editor.bytes_per_line) * self.hex_editor.cell_width
-            y = int((i // self.hex_editor.bytes_per_line) * self.hex_editor.cell_height - self.scroll_offset)
-            
-            # 设置默认背景色
-            bg_color = None
-            
-            # 如果是MFT记录，设置不同区域的背景色
-            if is_mft and mft_record:
-                # 文件头区域 - 着色56字节
-                file_header_end = mft_record['header']['offset'] + 56
-                if i >= mft_record['header']['offset'] and i < file_header_end:
-                    bg_color = QColor("#663D00")  # 暗橙色
-                
-                # 属性处理
-                for attr in mft_record['attributes']:
-                    # 10H和30H属性头 - 着色24字节
-                    if attr['type'] in [0x10, 0x30]:
-                        attr_header_end = attr['offset'] + 24
-                        if i >= attr['offset'] and i < attr_header_end:
-                            bg_color = QColor("#003366")  # 深蓝色
-                        
-                        # 10H属性体 - 着色72字节
-                        if attr['type'] == 0x10 and 'content_offset' in attr:
-                            attr_body_end = attr['offset'] + attr['content_offset'] + 72
-                            if i >= attr['offset'] + attr['content_offset'] and i < attr_body_end:
-                                bg_color = QColor("#005500")  # 深绿色
-                        
-                        # 30H属性体 - 着色80字节（原90字节减少10字节）
-                        elif attr['type'] == 0x30 and 'content_offset' in attr:
-                            attr_body_end = attr['offset'] + attr['content_offset'] + 80
-                            if i >= attr['offset'] + attr['content_offset'] and i < attr_body_end:
-                                bg_color = QColor("#005500")  # 深绿色
-                    
-                    # 其他属性值
-                    elif 'content_offset' in attr and i >= attr['offset'] + attr['content_offset'] and i < attr['offset'] + attr['content_offset'] + attr['content_size']:
-                        bg_color = QColor("#005500")  # 深绿色
-            
-            # 绘制选中背景
-            if self.selection_start != -1 and self.selection_end != -1:
-                if min(self.selection_start, self.selection_end) <= i <= max(self.selection_start, self.selection_end):
-                    bg_color = QColor("#0078D7")  # 选中区域 - 蓝色
-            
-            # 绘制背景
-            if bg_color:
-                rect = QRect(x, y, self.hex_editor.cell_width, self.hex_editor.cell_height)
-                painter.fillRect(rect, bg_color)
-            
-            rect = QRect(x + self.hex_editor.margin, y, self.hex_editor.cell_width - 2 * self.hex_editor.margin,
-                        self.hex_editor.cell_height)
-            painter.setPen(QPen(QColor("#FFFFFF")))  # 使用白色文本显示十六进制值
-            painter.drawText(rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
-                           f"{self.hex_editor.data[i]:02X}")
+        # 按行查表生成十六进制和ASCII文本，读取失败的字节显示为??和?
+        hex_rows = []
+        ascii_rows = []
+        for row in range(start_y, end_y):
+            row_start = row * bytes_per_line
+            chunk = visible[row_start - first:row_start - first + bytes_per_line]
+            if not chunk:
+                break
+            hex_text = ''.join(map(HEX_CELLS.__getitem__, chunk))
+            ascii_text = chunk.translate(ASCII_TABLE).decode('ascii')
+            for start, end in self.clip_ranges(bad_ranges, row_start, row_start + len(chunk)):
+                begin, finish = start - row_start, end - row_start
+                hex_text = hex_text[:begin * 3] + "?? " * (finish - begin) + hex_text[finish * 3:]
+                ascii_text = ascii_text[:begin] + "?" * (finish - begin) + ascii_text[finish:]
+            y = row * editor.cell_height - origin + baseline
+            hex_rows.append((y, hex_text))
+            ascii_rows.append((y, ascii_text))
         
-        # 绘制ASCII值
-        ascii_start_x = self.hex_editor.offset_width + self.hex_editor.bytes_per_line * self.hex_editor.cell_width + 20
-        for i in range(start_y * self.hex_editor.bytes_per_line,
-                      min(len(self.hex_editor.data), end_y * self.hex_editor.bytes_per_line)):
-            x = ascii_start_x + (i % self.hex_editor.bytes_per_line) * 10
-            y = int((i // self.hex_editor.bytes_per_line) * self.hex_editor.cell_height - self.scroll_offset)
-            
-            # 设置颜色和背景
-            if self.selection_start != -1 and self.selection_end != -1:
-                if min(self.selection_start, self.selection_end) <= i <= max(self.selection_start, self.selection_end):
-                    rect = QRect(x, y, 10, self.hex_editor.cell_height)
-                    painter.fillRect(rect, QColor("#0078D7"))
-                    painter.setPen(QPen(QColor("#FFFFFF")))
-                else:
-                    painter.setPen(QPen(QColor("#FFFFFF")))  # 使用白色文本显示ASCII
-            else:
-                painter.setPen(QPen(QColor("#FFFFFF")))  # 使用白色文本显示ASCII
-            
-            # 只显示可打印字符
-            char = chr(self.hex_editor.data[i]) if 32 <= self.hex_editor.data[i] <= 126 else '.'
-            rect = QRect(x, y, 10, self.hex_editor.cell_height)
-            painter.drawText(rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter, char)
+        # 每行一次绘制，字体的字间距已调整为与网格对齐
+        painter.setPen(QPen(QColor("#FFFFFF")))  # 使用白色文本显示十六进制值和ASCII
+        painter.setFont(editor.hex_row_font)
+        for y, text in hex_rows:
+            painter.drawText(editor.offset_width + editor.margin, y, text)
+        painter.setFont(editor.ascii_row_font)
+        for y, text in ascii_rows:
+            painter.drawText(ascii_start_x, y, text)
+        painter.end()
+        return pixmap
+    
+    def draw_column_lines(self, painter, height: int):
+        """绘制垂直网格线和ASCII区域分隔线"""
+        editor = self.hex_editor
+        painter.drawLines([QLine(editor.offset_width + x * editor.cell_width, 0,
+                                 editor.offset_width + x * editor.cell_width, height)
+                           for x in range(editor.bytes_per_line + 1)])
+        ascii_start_x = editor.offset_width + editor.bytes_per_line * editor.cell_width + 20
+        painter.drawLine(ascii_start_x, 0, ascii_start_x, height)
+    
+    @staticmethod
+    def clip_ranges(ranges: list, start: int, end: int) -> list:
+        """有序的(起始, 结束)区间列表中与[start, end)重叠的部分"""
+        if not ranges:
+            return []
+        result = []
+        index = max(0, bisect.bisect_right(ranges, (start, float('inf'))) - 1)
+        for range_start, range_end in ranges[index:]:
+            if range_start >= end:
+                break
+            if range_end > start:
+                result.append((max(range_start, start), min(range_end, end)))
+        return result
+    
+    def fill_span(self, painter, start: int, end: int, color, ascii_start_x: int, ascii: bool, origin: int):
+        """用背景色填充[start, end)字节，每行一个矩形；ascii为True时同时填充ASCII区域
+
+        origin是绘制目标顶部对应的内容y坐标
+        """
+        editor = self.hex_editor
+        bytes_per_line = editor.bytes_per_line
+        position = start
+        while position < end:
+            row, column = divmod(position, bytes_per_line)
+            count = min(bytes_per_line - column, end - position)
+            y = row * editor.cell_height - origin
+            painter.fillRect(QRect(editor.offset_width + column * editor.cell_width, y,
+                                   count * editor.cell_width, editor.cell_height), color)
+            if ascii:
+                painter.fillRect(QRect(ascii_start_x + column * editor.ascii_cell_width, y,
+                                       count * editor.ascii_cell_width, editor.cell_height), color)
+            position += count
+    
+    def frame_stats(self) -> dict:
+        """最近若干帧的绘制耗时(毫秒)"""
+        times = list(self.frame_times)
+        if not times:
+            return {'frames': 0, 'last_ms': None, 'avg_ms': None, 'max_ms': None,
+                    'tiles_cached': len(self.tiles), 'tiles_rendered': self.tiles_rendered}
+        return {'frames': len(times), 'last_ms': times[-1], 'avg_ms': sum(times) / len(times), 'max_ms': max(times),
+                'tiles_cached': len(self.tiles), 'tiles_rendered': self.tiles_rendered}
     
     def mousePressEvent(self, event):
         if not self.hex_editor.data or len(self.hex_editor.data) == 0:
@@ -299,6 +629,7 @@ class HexArea(QWidget):
                     self.selection_start = pos
                     self.selection_end = pos
                     self.hex_editor.cursor_position = pos
+                    self.hex_editor.low_nibble = False
                     self.hex_editor.update_status()
                     self.update()
                 except Exception:
@@ -310,8 +641,7 @@ class HexArea(QWidget):
         if self.is_selecting:
             try:
                 delta = self.last_y - event.position().y()
-                max_scroll = max(0, len(self.hex_editor.data) * self.hex_editor.cell_height // self.hex_editor.bytes_per_line - self.height())
-                self.scroll_offset = max(0, min(self.scroll_offset + delta, max_scroll))
+                self.scroll_offset = max(0, min(self.scroll_offset + delta, self.max_scroll()))
                 self.last_y = event.position().y()
                 x = event.position().x()
                 y = event.position().y() + self.scroll_offset
@@ -338,14 +668,35 @@ class HexArea(QWidget):
         if not self.hex_editor.data or len(self.hex_editor.data) == 0:
             return
         delta = event.angleDelta().y()
-        max_scroll = max(0, len(self.hex_editor.data) * self.hex_editor.cell_height // self.hex_editor.bytes_per_line - self.height())
-        self.scroll_offset = max(0, min(self.scroll_offset - delta, max_scroll))
+        self.scroll_offset = max(0, min(self.scroll_offset - delta, self.max_scroll()))
+        self.hex_editor.update_status()
         self.update()
     
     def keyPressEvent(self, event):
         if not self.hex_editor.data or len(self.hex_editor.data) == 0:
             return
         max_pos = len(self.hex_editor.data) - 1
+        text = event.text().upper()
+        if len(text) == 1 and text in "0123456789ABCDEF" and self.hex_editor.is_editable():
+            # 输入十六进制数字：先改高4位，再改低4位并移到下一个字节
+            position = self.hex_editor.cursor_position
+            value = self.hex_editor.byte_at(position)
+            digit = int(text, 16)
+            if self.hex_editor.low_nibble:
+                value = (value & 0xF0) | digit
+            else:
+                value = (value & 0x0F) | (digit << 4)
+            self.hex_editor.modify(position, bytes([value]))
+            if self.hex_editor.low_nibble and position < max_pos:
+                self.hex_editor.cursor_position += 1
+            self.hex_editor.low_nibble = not self.hex_editor.low_nibble
+            self.selection_start = self.hex_editor.cursor_position
+            self.selection_end = self.hex_editor.cursor_position
+            self.scroll_to(self.hex_editor.cursor_position)
+            self.hex_editor.update_status()
+            self.update()
+            return
+        self.hex_editor.low_nibble = False
         if event.key() == Qt.Key.Key_Left:
             if 0 < self.hex_editor.cursor_position <= max_pos:
                 self.hex_editor.cursor_position -= 1
@@ -376,6 +727,22 @@ class HexArea(QWidget):
                 self.selection_end = self.hex_editor.cursor_position
                 self.hex_editor.update_status()
                 self.update()
+        elif event.key() == Qt.Key.Key_B and event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            # Ctrl+B在光标处添加/删除书签
+            self.hex_editor.toggle_bookmark()
+        elif event.key() in (Qt.Key.Key_PageUp, Qt.Key.Key_PageDown):
+            # 按整屏翻页，可以连续翻过整个设备
+            page = max(1, self.height() // self.hex_editor.cell_height) * self.hex_editor.bytes_per_line
+            if event.key() == Qt.Key.Key_PageUp:
+                new_pos = max(0, self.hex_editor.cursor_position - page)
+            else:
+                new_pos = min(max_pos, self.hex_editor.cursor_position + page)
+            self.hex_editor.cursor_position = new_pos
+            self.selection_start = self.hex_editor.cursor_position
+            self.selection_end = self.hex_editor.cursor_position
+        # 光标移出可见范围时跟随滚动
+        self.scroll_to(self.hex_editor.cursor_position)
+        self.hex_editor.update_status()
     
     def mouseDoubleClickEvent(self, event):
         if not self.hex_editor.data or len(self.hex_editor.data) == 0:
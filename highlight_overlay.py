@@ -0,0 +1,255 @@
+import struct
+import logging
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+# 着色来源，后面的画在前面的上面
+SOURCE_MFT = 'mft'
+SOURCE_FAT32 = 'fat32'
+SOURCE_BOOKMARK = 'bookmark'
+SOURCE_SEARCH = 'search'
+SOURCE_ORDER = (SOURCE_MFT, SOURCE_FAT32, SOURCE_BOOKMARK, SOURCE_SEARCH)
+
+# 结构着色的颜色，与原来的MFT着色相同
+COLOR_HEADER = "#663D00"     # 暗橙色：文件头、文件名
+COLOR_FIELD = "#003366"      # 深蓝色：属性头、参数字段
+COLOR_CONTENT = "#005500"    # 深绿色：属性内容、簇号和大小
+COLOR_LFN = "#3D2B56"        # 暗紫色：长文件名目录项
+COLOR_DELETED = "#444444"    # 深灰色：已删除的目录项
+COLOR_BOOKMARK = "#7A6A00"   # 暗黄色：书签
+COLOR_SEARCH = "#8A4B00"     # 橙色：搜索结果
+
+# (起始, 结束, 颜色, 说明)
+Span = Tuple[int, int, str, str]
+
+
+class HighlightOverlay:
+    """十六进制视图上的着色区间层
+
+    各来源(MFT结构、FAT32结构、书签、搜索结果等)的着色区间放在同一个区间树中，
+    数据变化时计算一次，绘制时一次查询得到一段字节范围内的全部着色区间。
+    区间树是按起始偏移排序的数组上隐式的平衡二叉树，每个节点记录子树中最大的结束偏移；
+    修改后在下一次查询时重建。所有方法都是线程安全的。
+    """
+
+    def __init__(self):
+        # 来源 -> [(起始, 结束, 颜色, 说明), ...]
+        self._sources = {}
+        self._entries = []
+        self._max_end = []
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return any(self._sources.values())
+
+    def spans(self, source: str) -> List[Span]:
+        with self._lock:
+            return list(self._sources.get(source, ()))
+
+    def set_source(self, source: str, spans: Iterable):
+        """替换一个来源的全部着色区间
+
+        Args:
+            spans: (起始, 结束, 颜色[, 说明])，偏移相对当前数据，空区间被忽略
+        """
+        normalized = []
+        for span in spans:
+            start, end, color = span[:3]
+            if end > start:
+                normalized.append((start, end, color, span[3] if len(span) > 3 else ""))
+        with self._lock:
+            if normalized:
+                self._sources[source] = normalized
+            else:
+                self._sources.pop(source, None)
+            self._dirty = True
+
+    def clear(self, source: Optional[str] = None):
+        """清除一个来源的着色区间，source为None时清除全部"""
+        with self._lock:
+            if source is None:
+                self._sources.clear()
+            else:
+                self._sources.pop(source, None)
+            self._dirty = True
+
+    def _rebuild_locked(self):
+        entries = []
+        for source, spans in self._sources.items():
+            priority = SOURCE_ORDER.index(source) if source in SOURCE_ORDER else len(SOURCE_ORDER)
+            # 同一来源中后加入的画在上面
+            entries.extend((start, end, color, label, (priority, sequence))
+                           for sequence, (start, end, color, label) in enumerate(spans))
+        entries.sort()
+        self._entries = entries
+        self._max_end = [0] * len(entries)
+        # 自底向上计算各子树的最大结束偏移，避免递归
+        stack = [(0, len(entries), False)]
+        while stack:
+            lo, hi, ready = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if not ready:
+                stack.append((lo, hi, True))
+                stack.append((lo, mid, False))
+                stack.append((mid + 1, hi, False))
+                continue
+            maximum = entries[mid][1]
+            if lo < mid:
+                maximum = max(maximum, self._max_end[(lo + mid) // 2])
+            if mid + 1 < hi:
+                maximum = max(maximum, self._max_end[(mid + 1 + hi) // 2])
+            self._max_end[mid] = maximum
+        self._dirty = False
+
+    def query(self, start: int, end: int) -> List[Span]:
+        """与[start, end)重叠的着色区间(不裁剪)，按绘制顺序排列"""
+        with self._lock:
+            if self._dirty:
+                self._rebuild_locked()
+            entries, max_end = self._entries, self._max_end
+        result = []
+        stack = [(0, len(entries))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            # 子树中所有区间都在start之前结束
+            if max_end[mid] <= start:
+                continue
+            stack.append((lo, mid))
+            entry = entries[mid]
+            if entry[0] < end:
+                if entry[1] > start:
+                    result.append(entry)
+                stack.append((mid + 1, hi))
+        result.sort(key=lambda entry: entry[4])
+        return [entry[:4] for entry in result]
+
+    def label_at(self, position: int) -> str:
+        """position处最上面一层有说明的着色区间的说明"""
+        for _, _, _, label in reversed(self.query(position, position + 1)):
+            if label:
+                return label
+        return ""
+
+
+def mft_record_spans(data: bytes) -> List[Span]:
+    """MFT记录中文件头、10H/30H属性头和各常驻属性内容的着色区间"""
+    from disk_utils import DiskUtils
+    record = DiskUtils.parse_mft_record(data)
+    header = record['header']['offset']
+    # 文件头区域 - 着色56字节
+    spans = [(header, header + 56, COLOR_HEADER, "MFT文件头")]
+    for attr in record['attributes']:
+        # 10H和30H属性头 - 着色24字节
+        if attr['type'] in [0x10, 0x30]:
+            spans.append((attr['offset'], attr['offset'] + 24, COLOR_FIELD, f"{attr['type']:02X}H属性头"))
+            # 10H属性体着色72字节，30H属性体着色80字节（原90字节减少10字节）
+            if 'content_offset' in attr:
+                body_start = attr['offset'] + attr['content_offset']
+                spans.append((body_start, body_start + (72 if attr['type'] == 0x10 else 80), COLOR_CONTENT,
+                              f"{attr['type']:02X}H属性内容"))
+        # 其他属性值
+        elif 'content_offset' in attr:
+            body_start = attr['offset'] + attr['content_offset']
+            spans.append((body_start, body_start + attr['content_size'], COLOR_CONTENT,
+                          f"{attr['type']:02X}H属性内容"))
+    return spans
+
+
+# FAT32引导扇区的字段：(偏移, 长度, 颜色, 说明)
+FAT32_BOOT_FIELDS = (
+    (0, 3, COLOR_HEADER, "跳转指令"),
+    (3, 8, COLOR_HEADER, "OEM名称"),
+    (11, 2, COLOR_FIELD, "每扇区字节数"),
+    (13, 1, COLOR_FIELD, "每簇扇区数"),
+    (14, 2, COLOR_FIELD, "保留扇区数"),
+    (16, 1, COLOR_FIELD, "FAT个数"),
+    (21, 1, COLOR_FIELD, "介质描述符"),
+    (24, 2, COLOR_FIELD, "每磁道扇区数"),
+    (26, 2, COLOR_FIELD, "磁头数"),
+    (28, 4, COLOR_FIELD, "隐藏扇区数"),
+    (32, 4, COLOR_FIELD, "总扇区数"),
+    (36, 4, COLOR_CONTENT, "每FAT扇区数"),
+    (40, 2, COLOR_CONTENT, "扩展标志"),
+    (42, 2, COLOR_CONTENT, "文件系统版本"),
+    (44, 4, COLOR_CONTENT, "根目录起始簇号"),
+    (48, 2, COLOR_CONTENT, "FSInfo扇区号"),
+    (50, 2, COLOR_CONTENT, "备份引导扇区号"),
+    (64, 1, COLOR_FIELD, "驱动器号"),
+    (66, 1, COLOR_FIELD, "扩展引导标志"),
+    (67, 4, COLOR_FIELD, "卷序列号"),
+    (71, 11, COLOR_HEADER, "卷标"),
+    (82, 8, COLOR_HEADER, "文件系统类型"),
+    (510, 2, COLOR_HEADER, "引导扇区签名"),
+)
+
+
+def is_fat32_boot_sector(sector: bytes) -> bool:
+    return len(sector) >= 512 and sector[510:512] == b'\x55\xAA' and sector[82:90] == b'FAT32   '
+
+
+def fat32_boot_sector_spans(base: int = 0, label: str = "") -> List[Span]:
+    """base处FAT32引导扇区各字段的着色区间"""
+    return [(base + offset, base + offset + length, color, f"{label}{name}")
+            for offset, length, color, name in FAT32_BOOT_FIELDS]
+
+
+def fat32_dir_entry_spans(data: bytes, base: int = 0) -> List[Span]:
+    """目录簇中各32字节目录项的着色区间，遇到结束标记(首字节为0)停止
+
+    短文件名目录项按文件名、属性、起始簇号、文件大小着色，长文件名目录项和
+    已删除的目录项整项着色。
+    """
+    spans = []
+    for offset in range(0, len(data) - 31, 32):
+        first = data[offset]
+        if first == 0x00:
+            break
+        start = base + offset
+        if first == 0xE5:
+            spans.append((start, start + 32, COLOR_DELETED, "已删除的目录项"))
+        elif data[offset + 11] & 0x3F == 0x0F:
+            spans.append((start, start + 32, COLOR_LFN, "长文件名目录项"))
+        else:
+            spans.extend(((start, start + 11, COLOR_HEADER, "文件名"),
+                          (start + 11, start + 12, COLOR_FIELD, "属性"),
+                          (start + 20, start + 22, COLOR_CONTENT, "起始簇号(高16位)"),
+                          (start + 26, start + 28, COLOR_CONTENT, "起始簇号(低16位)"),
+                          (start + 28, start + 32, COLOR_CONTENT, "文件大小")))
+    return spans
+
+
+def fat32_volume_spans(device, base: int = 0) -> List[Span]:
+    """设备上base处FAT32卷的引导扇区、备份引导扇区和根目录第一个簇的着色区间
+
+    Args:
+        device: BlockDevice实例
+        base: 卷在设备上的起始偏移
+
+    Returns:
+        偏移相对设备的着色区间，base处不是FAT32卷时返回空列表
+    """
+    boot_sector = bytes(device.read_at(base, 512))
+    if not is_fat32_boot_sector(boot_sector):
+        return []
+    bytes_per_sector, sectors_per_cluster, reserved_sectors, number_of_fats = struct.unpack("<HBHB", boot_sector[11:17])
+    sectors_per_fat, _, _, root_cluster, _, backup_sector = struct.unpack("<IHHIHH", boot_sector[36:52])
+    if bytes_per_sector == 0 or sectors_per_cluster == 0 or root_cluster < 2:
+        return []
+    spans = fat32_boot_sector_spans(base)
+    if 0 < backup_sector < reserved_sectors:
+        spans.extend(fat32_boot_sector_spans(base + backup_sector * bytes_per_sector, "备份引导扇区: "))
+    cluster_size = bytes_per_sector * sectors_per_cluster
+    root_offset = base + (reserved_sectors + number_of_fats * sectors_per_fat
+                          + (root_cluster - 2) * sectors_per_cluster) * bytes_per_sector
+    if root_offset + cluster_size <= device.size:
+        try:
+            spans.extend(fat32_dir_entry_spans(bytes(device.read_at(root_offset, cluster_size)), root_offset))
+        except Exception as e:
+            logging.debug(f"读取根目录簇失败: {str(e)}")
+    return spans
@@ -0,0 +1,299 @@
+import time
+import heapq
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Optional
+from block_device import BlockDevice
+
+# I/O优先级，数值越小越先调度
+PRIORITY_INTERACTIVE = 0   # 十六进制浏览、跳转扇区等用户正在等待的读取
+PRIORITY_METADATA = 1      # 引导扇区、FAT表、目录等文件系统元数据
+PRIORITY_BULK = 2          # 扫描、雕刻、镜像等后台批量读取
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_METADATA: "metadata",
+    PRIORITY_BULK: "bulk",
+}
+
+# 每个线程各自的优先级；用contextvars保存，read_batch等把读取交给线程池时可以随上下文一起带过去
+_priority = contextvars.ContextVar('io_priority', default=PRIORITY_INTERACTIVE)
+
+
+def current_io_priority() -> int:
+    """当前线程的I/O优先级，未设置时视为交互式"""
+    return _priority.get()
+
+
+def set_io_priority(priority: int) -> int:
+    """设置当前线程的I/O优先级，返回原来的优先级"""
+    previous = current_io_priority()
+    _priority.set(priority)
+    return previous
+
+
+@contextmanager
+def io_priority(priority: int):
+    """在with块内把当前线程发起的读取归入指定优先级"""
+    previous = set_io_priority(priority)
+    try:
+        yield
+    finally:
+        set_io_priority(previous)
+
+
+class IORequest:
+    """调度队列中的一个读取请求"""
+
+    def __init__(self, priority: int, sequence: int, length: int, action, offset: Optional[int] = None):
+        self.priority = priority
+        self.sequence = sequence
+        self.length = length
+        self.action = action
+        self.offset = offset
+        self.future = Future()
+        self.queued_at = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class ClassStats:
+    """一个优先级的队列统计"""
+
+    def __init__(self):
+        self.queued = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.bytes = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'queue_depth': self.queued,
+            'max_queue_depth': self.max_queued,
+            'completed': self.completed,
+            'bytes': self.bytes,
+            'avg_wait_ms': self.total_wait / self.completed * 1000 if self.completed else 0.0,
+            'max_wait_ms': self.max_wait * 1000,
+        }
+
+
+class IOScheduler:
+    """单设备的优先级I/O调度器
+
+    所有读取排进同一个优先级队列，由workers个工作线程按(优先级, 提交顺序)取出执行。
+    批量读取在ScheduledDevice中切成slice_size大小的请求，每片之间都可以被
+    交互式和元数据读取插队；bulk_bandwidth(字节/秒)限制批量读取的带宽，
+    为None时不限速。给出latency_map时，带偏移的请求的执行耗时(不含排队)按偏移记入其中。
+    """
+
+    def __init__(self, name: str, bulk_bandwidth: Optional[float] = None,
+                 slice_size: int = 1024 * 1024, workers: int = 1, latency_map=None):
+        self.name = name
+        self.bulk_bandwidth = bulk_bandwidth
+        self.slice_size = slice_size
+        self.latency_map = latency_map
+        self._queue = []
+        self._sequence = 0
+        self._cond = threading.Condition()
+        self._stats = {priority: ClassStats() for priority in PRIORITY_NAMES}
+        self._tokens = 0.0
+        self._last_refill = time.monotonic()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._run, name=f"io-{name}-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, priority: int, length: int, action, offset: Optional[int] = None) -> Future:
+        """提交一个读取动作，action在工作线程中执行，返回值作为Future的结果
+
+        Args:
+            offset: 读取在设备上的偏移，用于按区域统计延迟
+        """
+        with self._cond:
+            if self._closed:
+                raise Exception(f"设备 {self.name} 的I/O调度器已关闭")
+            self._sequence += 1
+            request = IORequest(priority, self._sequence, length, action, offset)
+            heapq.heappush(self._queue, request)
+            stats = self._stats[priority]
+            stats.queued += 1
+            stats.max_queued = max(stats.max_queued, stats.queued)
+            self._cond.notify()
+        return request.future
+
+    def set_bulk_bandwidth(self, bytes_per_second: Optional[float]):
+        """调整批量读取的带宽上限，None表示不限速"""
+        with self._cond:
+            self.bulk_bandwidth = bytes_per_second
+            self._tokens = 0.0
+            self._last_refill = time.monotonic()
+            self._cond.notify_all()
+
+    def _throttle_delay(self, request: IORequest) -> float:
+        """批量请求需要等待的秒数，令牌足够时扣除令牌并返回0"""
+        if request.priority != PRIORITY_BULK or not self.bulk_bandwidth:
+            return 0.0
+        now = time.monotonic()
+        # 令牌最多积累1秒的额度，避免空闲后突发
+        self._tokens = min(self.bulk_bandwidth, self._tokens + (now - self._last_refill) * self.bulk_bandwidth)
+        self._last_refill = now
+        if self._tokens < 0:
+            return -self._tokens / self.bulk_bandwidth
+        self._tokens -= request.length
+        return 0.0
+
+    def _next_request(self) -> Optional[IORequest]:
+        with self._cond:
+            while True:
+                if self._closed and not self._queue:
+                    return None
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                delay = self._throttle_delay(self._queue[0])
+                if delay > 0:
+                    # 等待令牌期间有更高优先级的请求进来会被唤醒并先执行
+                    self._cond.wait(delay)
+                    continue
+                request = heapq.heappop(self._queue)
+                stats = self._stats[request.priority]
+                stats.queued -= 1
+                wait = time.monotonic() - request.queued_at
+                stats.total_wait += wait
+                stats.max_wait = max(stats.max_wait, wait)
+                return request
+
+    def _run(self):
+        while True:
+            request = self._next_request()
+            if request is None:
+                return
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            try:
+                result = request.action()
+            except BaseException as e:
+                request.action = None
+                self._record_latency(request, started, True)
+                request.future.set_exception(e)
+                continue
+            # 释放动作引用的缓冲区，调用方拿到结果后可能要缩短缓冲区(read_at读到设备末尾时)
+            request.action = None
+            self._record_latency(request, started, False)
+            with self._cond:
+                stats = self._stats[request.priority]
+                stats.completed += 1
+                stats.bytes += request.length
+            request.future.set_result(result)
+
+    def _record_latency(self, request: IORequest, started: float, error: bool):
+        if self.latency_map is not None and request.offset is not None:
+            self.latency_map.record(request.offset, request.length, time.perf_counter() - started, error)
+
+    def stats(self) -> dict:
+        """返回各优先级的队列深度、等待时间等统计"""
+        with self._cond:
+            return {PRIORITY_NAMES[priority]: stats.as_dict() for priority, stats in self._stats.items()}
+
+    def close(self):
+        """处理完已排队的请求后停止工作线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=5)
+        logging.info(f"设备 {self.name} I/O调度统计: {self.stats()}")
+
+
+class ScheduledDevice(BlockDevice):
+    """经过I/O调度器读取的设备视图
+
+    priority为None时使用发起读取的线程当前的优先级(见io_priority)。
+    超过调度器slice_size的读取按分片分别排队，分片之间可被更高优先级插队。
+    不拥有底层设备和调度器，close不做任何事。
+    """
+
+    def __init__(self, scheduler: IOScheduler, device: BlockDevice, priority: Optional[int] = None):
+        super().__init__(device.path)
+        self.scheduler = scheduler
+        self.device = device
+        self.priority = priority
+        self.sector_size = device.sector_size
+        self.physical_sector_size = device.physical_sector_size
+
+    @property
+    def size(self) -> int:
+        return self.device.size
+
+    def _priority(self) -> int:
+        return current_io_priority() if self.priority is None else self.priority
+
+    def _slice_size(self) -> int:
+        # 分片按物理扇区对齐，不破坏无缓冲读取的对齐
+        alignment = max(1, self.physical_sector_size)
+        return max(alignment, self.scheduler.slice_size // alignment * alignment)
+
+    def readinto(self, offset: int, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        priority = self._priority()
+        slice_size = self._slice_size()
+        if len(view) <= slice_size:
+            return self.scheduler.submit(priority, len(view),
+                                         lambda: self.device.readinto(offset, view), offset).result()
+        # 各分片一次性排队，同一优先级内按提交顺序执行
+        futures = []
+        for start in range(0, len(view), slice_size):
+            piece = view[start:start + slice_size]
+            futures.append((len(piece), self.scheduler.submit(
+                priority, len(piece), lambda o=offset + start, p=piece: self.device.readinto(o, p),
+                offset + start)))
+        total = 0
+        short = False
+        for length, future in futures:
+            got = future.result()
+            if not short:
+                total += got
+                short = got < length
+        return total
+
+    def readv(self, offset: int, buffers) -> int:
+        views = [memoryview(buffer).cast('B') for buffer in buffers]
+        priority = self._priority()
+        slice_size = self._slice_size()
+        # 连续的缓冲区按分片大小分组，每组一次分散读取
+        groups = []
+        group_offset = offset
+        for view in views:
+            if not groups or groups[-1][2] + len(view) > slice_size:
+                groups.append((group_offset, [], 0))
+            start, group, length = groups[-1]
+            group.append(view)
+            groups[-1] = (start, group, length + len(view))
+            group_offset += len(view)
+        futures = [(length, self.scheduler.submit(priority, length,
+                                                  lambda o=start, g=group: self.device.readv(o, g), start))
+                   for start, group, length in groups]
+        total = 0
+        short = False
+        for length, future in futures:
+            got = future.result()
+            if not short:
+                total += got
+                short = got < length
+        return total
+
+    def _submit_read(self, offset: int, length: int) -> Future:
+        # 批量并发读取的每个请求都按本设备的优先级排队，由调度器的工作线程并发执行
+        return self.scheduler.submit(self._priority(), length, lambda: self.device.read_at(offset, length), offset)
+
+    def data_extents(self, offset: int, length: int):
+        return self.device.data_extents(offset, length)
@@ -0,0 +1,376 @@
+from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QWidget,
+                            QPushButton, QProgressBar, QFileDialog, QMessageBox,
+                            QComboBox, QFormLayout, QToolTip, QSpinBox)
+from PyQt6.QtCore import Qt, QTimer, QRectF
+from PyQt6.QtGui import QPainter, QColor, QPen
+import os
+import logging
+from device_pool import device_pool
+from latency_map import LatencyMap, LATENCY_BINS_MS
+from latency_survey import LatencySurvey
+from io_scheduler import PRIORITY_NAMES
+
+
+def _format_size(value: int) -> str:
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if value < 1024 or unit == "TB":
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+
+
+class LatencyHeatmap(QWidget):
+    """读取延迟热力图：横轴是设备区域，纵轴是延迟档(下快上慢)，
+    颜色深浅表示该区域落在这一档的请求比例，底部一行标出慢区域和有读取错误的区域"""
+
+    STRIP_HEIGHT = 12
+    LABEL_WIDTH = 60
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.regions = []
+        self.slow = set()
+        self.setMinimumHeight(260)
+        self.setMouseTracking(True)
+
+    def set_regions(self, regions: list):
+        self.regions = regions
+        self.slow = set(LatencyMap.slow_regions(regions))
+        self.update()
+
+    def _cell_geometry(self):
+        bins = len(LATENCY_BINS_MS) + 1
+        width = max(1.0, (self.width() - self.LABEL_WIDTH) / max(1, len(self.regions)))
+        height = (self.height() - self.STRIP_HEIGHT - 4) / bins
+        return bins, width, height
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor("#1e1e1e"))
+        bins, cell_width, cell_height = self._cell_geometry()
+        # 纵轴标签
+        painter.setPen(QPen(QColor("#999999")))
+        labels = [f"<{edge:g}ms" for edge in LATENCY_BINS_MS] + [f">{LATENCY_BINS_MS[-1]:g}ms"]
+        for index, label in enumerate(labels):
+            y = (bins - 1 - index) * cell_height
+            painter.drawText(QRectF(0, y, self.LABEL_WIDTH - 4, cell_height),
+                             Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter, label)
+        if not self.regions:
+            return
+        strip_y = bins * cell_height + 4
+        for region in self.regions:
+            x = self.LABEL_WIDTH + region['index'] * cell_width
+            requests = region['requests']
+            if requests:
+                for index, count in enumerate(region['histogram']):
+                    if not count:
+                        continue
+                    # 比例越高越亮；慢档用暖色，快档用冷色
+                    share = count / requests
+                    hue = int(200 - 200 * index / (bins - 1))
+                    color = QColor.fromHsv(hue, 220, int(60 + 195 * share))
+                    painter.fillRect(QRectF(x, (bins - 1 - index) * cell_height, cell_width, cell_height), color)
+            if region['errors']:
+                strip_color = QColor("#C00000")
+            elif region['index'] in self.slow:
+                strip_color = QColor("#E0A000")
+            elif requests:
+                strip_color = QColor("#2E7D32")
+            else:
+                strip_color = QColor("#333333")
+            painter.fillRect(QRectF(x, strip_y, cell_width, self.STRIP_HEIGHT), strip_color)
+
+    def mouseMoveEvent(self, event):
+        if not self.regions:
+            return
+        _, cell_width, _ = self._cell_geometry()
+        index = int((event.position().x() - self.LABEL_WIDTH) // cell_width)
+        if not 0 <= index < len(self.regions):
+            QToolTip.hideText()
+            return
+        region = self.regions[index]
+        text = f"区域 {index}: {_format_size(region['offset'])} - {_format_size(region['offset'] + region['length'])}"
+        if region['requests']:
+            text += (f"\n请求 {region['requests']}  平均 {region['avg_ms']:.2f} ms  最大 {region['max_ms']:.2f} ms"
+                     f"\nP50 ≤{region['p50_ms']:g} ms  P90 ≤{region['p90_ms']:g} ms")
+        if region['errors']:
+            text += f"\n读取错误 {region['errors']}"
+        QToolTip.showText(event.globalPosition().toPoint(), text, self)
+
+
+class LatencyDialog(QDialog):
+    """读取延迟热力图对话框
+
+    可以对设备做一次抽样测绘(每个区域读取几个小条带)，也可以查看设备打开以来
+    全部实际读取的累计延迟；结果可以导出为JSON，用于安排镜像顺序。
+    对话框还显示所选设备I/O调度器各优先级的队列深度、等待时间和缓存命中率，
+    并可以设置全部设备批量读取(扫描、镜像等)的带宽上限。
+    """
+
+    def __init__(self, parent=None, disk_path: str = None):
+        super().__init__(parent)
+        self.setWindowTitle("读取延迟热力图")
+        self.setMinimumSize(900, 480)
+        self.setStyleSheet("""
+            QDialog {
+                background-color: #2c2c2c;
+            }
+            QLabel {
+                color: #ffffff;
+                font-size: 12pt;
+                font-weight: normal;
+            }
+            QPushButton {
+                padding: 5px 15px;
+                background-color: #0078d7;
+                color: white;
+                border: none;
+                border-radius: 3px;
+                font-size: 12pt;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #106ebe;
+            }
+            QPushButton:disabled {
+                background-color: #444444;
+                color: #999999;
+            }
+            QComboBox, QSpinBox {
+                padding: 5px;
+                border: 1px solid #555555;
+                border-radius: 3px;
+                background-color: #1e1e1e;
+                color: white;
+                font-size: 11pt;
+            }
+            QComboBox QAbstractItemView {
+                background-color: #1e1e1e;
+                color: white;
+                selection-background-color: #0078d7;
+            }
+            QProgressBar {
+                border: 1px solid #555555;
+                border-radius: 3px;
+                text-align: center;
+                font-size: 10pt;
+                color: white;
+                background-color: #1e1e1e;
+            }
+            QProgressBar::chunk {
+                background-color: #0078d7;
+                width: 10px;
+            }
+        """)
+
+        # 正在进行的测绘和当前显示的统计
+        self.survey = None
+        self.latency_map = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(500)
+        self.timer.timeout.connect(self.update_progress)
+        # 调度统计一直刷新，后台扫描或镜像时可以看到批量读取有没有挤占交互式读取
+        self.stats_timer = QTimer(self)
+        self.stats_timer.setInterval(1000)
+        self.stats_timer.timeout.connect(self.update_io_stats)
+
+        self.init_ui()
+        if disk_path:
+            index = self.source_combo.findData(disk_path)
+            if index < 0:
+                self.source_combo.addItem(os.path.basename(disk_path) or disk_path, disk_path)
+                index = self.source_combo.count() - 1
+            self.source_combo.setCurrentIndex(index)
+        self.source_combo.currentIndexChanged.connect(self.update_io_stats)
+        self.update_io_stats()
+        self.stats_timer.start()
+
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+        layout.setSpacing(10)
+        form = QFormLayout()
+
+        source_layout = QHBoxLayout()
+        self.source_combo = QComboBox()
+        self.browse_source_button = QPushButton("镜像文件...")
+        self.browse_source_button.clicked.connect(self.browse_source)
+        source_layout.addWidget(self.source_combo, 1)
+        source_layout.addWidget(self.browse_source_button)
+        form.addRow("设备:", source_layout)
+
+        self.stripe_combo = QComboBox()
+        for size in (4096, 64 * 1024, 1024 * 1024):
+            self.stripe_combo.addItem(_format_size(size), size)
+        self.stripe_combo.setCurrentIndex(1)
+        form.addRow("测绘条带大小:", self.stripe_combo)
+
+        self.bandwidth_spin = QSpinBox()
+        self.bandwidth_spin.setRange(0, 10000)
+        self.bandwidth_spin.setSuffix(" MB/s")
+        self.bandwidth_spin.setSpecialValueText("不限速")
+        if device_pool.bulk_bandwidth:
+            self.bandwidth_spin.setValue(max(1, round(device_pool.bulk_bandwidth / (1024 * 1024))))
+        self.bandwidth_spin.valueChanged.connect(self.set_bulk_bandwidth)
+        form.addRow("批量读取限速:", self.bandwidth_spin)
+        layout.addLayout(form)
+
+        self.heatmap = LatencyHeatmap()
+        layout.addWidget(self.heatmap, 1)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1000)
+        self.status_label = QLabel("")
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.status_label)
+        self.io_stats_label = QLabel("")
+        layout.addWidget(self.io_stats_label)
+
+        buttons_layout = QHBoxLayout()
+        self.survey_button = QPushButton("开始测绘")
+        self.survey_button.clicked.connect(self.start_survey)
+        self.cancel_button = QPushButton("停止")
+        self.cancel_button.clicked.connect(self.cancel_survey)
+        self.cancel_button.setEnabled(False)
+        self.recorded_button = QPushButton("累计统计")
+        self.recorded_button.clicked.connect(self.show_recorded)
+        self.export_button = QPushButton("导出JSON...")
+        self.export_button.clicked.connect(self.export_json)
+        self.export_button.setEnabled(False)
+        self.close_button = QPushButton("关闭")
+        self.close_button.clicked.connect(self.close)
+        buttons_layout.addWidget(self.survey_button)
+        buttons_layout.addWidget(self.cancel_button)
+        buttons_layout.addWidget(self.recorded_button)
+        buttons_layout.addWidget(self.export_button)
+        buttons_layout.addStretch()
+        buttons_layout.addWidget(self.close_button)
+        layout.addLayout(buttons_layout)
+
+        self.init_source_list()
+
+    def init_source_list(self):
+        """列出物理磁盘和逻辑驱动器"""
+        try:
+            from disk_utils import DiskUtils
+            drives, physicals = DiskUtils.get_disk_list_grouped()
+            for path, name in physicals:
+                self.source_combo.addItem(name, path)
+            for path, label in drives:
+                self.source_combo.addItem(label, path)
+        except Exception as e:
+            logging.error(f"获取磁盘列表失败: {str(e)}")
+
+    def browse_source(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "选择镜像", "",
+                                                   "磁盘镜像 (*.img *.dd *.raw *.bin *.vhd *.vmdk *.E01 *.001 *.ohxz);;所有文件 (*.*)")
+        if file_name:
+            self.source_combo.addItem(os.path.basename(file_name), file_name)
+            self.source_combo.setCurrentIndex(self.source_combo.count() - 1)
+
+    def start_survey(self):
+        source = self.source_combo.currentData()
+        if not source:
+            QMessageBox.warning(self, "警告", "请选择设备")
+            return
+        try:
+            self.survey = LatencySurvey(source, stripe_size=self.stripe_combo.currentData())
+            self.survey.start()
+        except Exception as e:
+            self.survey = None
+            logging.error(f"读取延迟测绘失败: {str(e)}")
+            QMessageBox.critical(self, "错误", f"读取延迟测绘失败: {str(e)}")
+            return
+        self.latency_map = self.survey.latency_map
+        self.set_running(True)
+        self.progress_bar.setValue(0)
+        self.timer.start()
+
+    def cancel_survey(self):
+        if self.survey is not None:
+            self.survey.cancel()
+
+    def show_recorded(self):
+        """显示设备打开以来全部实际读取的累计延迟"""
+        source = self.source_combo.currentData()
+        latency_map = device_pool.latency_map(source) if source else None
+        if latency_map is None:
+            QMessageBox.information(self, "提示", "该设备当前没有打开，没有累计的读取统计")
+            return
+        self.latency_map = latency_map
+        self.show_map()
+
+    def set_bulk_bandwidth(self, value: int):
+        """设置批量读取的带宽上限，0表示不限速"""
+        device_pool.set_bulk_bandwidth(value * 1024 * 1024 if value else None)
+
+    def update_io_stats(self):
+        """刷新所选设备的I/O调度和缓存统计"""
+        source = self.source_combo.currentData()
+        io_stats = device_pool.io_stats(source) if source else {}
+        if not io_stats:
+            self.io_stats_label.setText("I/O调度: 设备当前没有打开")
+            return
+        parts = []
+        for name in PRIORITY_NAMES.values():
+            stats = io_stats[name]
+            parts.append(f"{name}: 排队 {stats['queue_depth']} (最多 {stats['max_queue_depth']})  "
+                         f"完成 {stats['completed']}  {_format_size(stats['bytes'])}  "
+                         f"等待 平均 {stats['avg_wait_ms']:.1f} / 最大 {stats['max_wait_ms']:.1f} ms")
+        text = "I/O调度:\n" + "\n".join(parts)
+        cache_stats = device_pool.cache_stats(source)
+        if cache_stats:
+            text += (f"\n缓存命中率 {cache_stats['hit_rate'] * 100:.1f}%  "
+                     f"已用 {_format_size(cache_stats['used_bytes'])} / {_format_size(cache_stats['budget'])}")
+        self.io_stats_label.setText(text)
+
+    def set_running(self, running: bool):
+        for widget in (self.source_combo, self.browse_source_button, self.stripe_combo,
+                       self.survey_button, self.recorded_button, self.export_button):
+            widget.setEnabled(not running)
+        self.cancel_button.setEnabled(running)
+
+    def show_map(self):
+        regions = self.latency_map.regions()
+        self.heatmap.set_regions(regions)
+        requests = sum(region['requests'] for region in regions)
+        errors = sum(region['errors'] for region in regions)
+        status = (f"{len(regions)} 个区域, 每个 {_format_size(self.latency_map.region_size)}    "
+                  f"{requests} 次读取    慢区域 {len(self.heatmap.slow)}")
+        if errors:
+            status += f"    读取错误 {errors}"
+        self.status_label.setText(status)
+        self.export_button.setEnabled(self.survey is None or self.survey.finished)
+
+    def update_progress(self):
+        if self.survey is None:
+            return
+        progress = self.survey.progress()
+        if progress['sample_count']:
+            self.progress_bar.setValue(int(progress['samples_done'] * 1000 / progress['sample_count']))
+        self.show_map()
+        if not self.survey.finished:
+            return
+        self.timer.stop()
+        self.set_running(False)
+        survey, self.survey = self.survey, None
+        self.show_map()
+        if survey.error is not None:
+            QMessageBox.critical(self, "错误", f"读取延迟测绘失败: {str(survey.error)}")
+
+    def export_json(self):
+        if self.latency_map is None:
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "导出读取延迟统计", "", "JSON (*.json);;所有文件 (*.*)")
+        if not file_name:
+            return
+        try:
+            self.latency_map.export_json(file_name)
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"导出失败: {str(e)}")
+
+    def closeEvent(self, event):
+        self.stats_timer.stop()
+        # 关闭对话框时停止未完成的测绘
+        if self.survey is not None:
+            self.survey.cancel()
+            self.survey.wait()
+            self.timer.stop()
+        super().closeEvent(event)
@@ -0,0 +1,152 @@
+import json
+import bisect
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# 延迟分档的上限(毫秒)，最后一档是超过最大上限的读取
+LATENCY_BINS_MS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+DEFAULT_REGION_SIZE = 1024 * 1024 * 1024
+MIN_REGION_SIZE = 1024 * 1024
+# 设备较小时缩小区域，使热力图至少有这么多列
+MIN_REGION_COUNT = 64
+# 平均延迟超过全部区域中位数的倍数时视为慢区域
+SLOW_REGION_FACTOR = 4.0
+
+
+def choose_region_size(size: int, region_size: Optional[int] = None) -> int:
+    """按设备大小选择区域大小：默认1 GiB，小设备缩小到2的幂使区域数不少于MIN_REGION_COUNT"""
+    if region_size:
+        return region_size
+    region_size = DEFAULT_REGION_SIZE
+    while region_size > MIN_REGION_SIZE and size // region_size < MIN_REGION_COUNT:
+        region_size //= 2
+    return region_size
+
+
+class LatencyMap:
+    """按区域统计读取延迟的直方图：设备按region_size划分为区域，每个区域记录各延迟档的请求数
+
+    读取按起始偏移归入区域。所有方法都是线程安全的。
+    """
+
+    def __init__(self, size: int, region_size: Optional[int] = None, path: str = ""):
+        self.size = size
+        self.path = path
+        self.region_size = choose_region_size(size, region_size)
+        self.region_count = max(1, (size + self.region_size - 1) // self.region_size)
+        bins = len(LATENCY_BINS_MS) + 1
+        self._histogram = [[0] * bins for _ in range(self.region_count)]
+        self._requests = [0] * self.region_count
+        self._bytes = [0] * self.region_count
+        self._errors = [0] * self.region_count
+        self._total_seconds = [0.0] * self.region_count
+        self._max_seconds = [0.0] * self.region_count
+        self._lock = threading.Lock()
+
+    def record(self, offset: int, length: int, seconds: float, error: bool = False):
+        """记录一次读取的耗时
+
+        Args:
+            offset: 读取起始偏移
+            length: 读取长度
+            seconds: 耗时(秒)
+            error: 读取是否失败
+        """
+        region = min(max(0, offset // self.region_size), self.region_count - 1)
+        latency_bin = bisect.bisect_left(LATENCY_BINS_MS, seconds * 1000)
+        with self._lock:
+            self._histogram[region][latency_bin] += 1
+            self._requests[region] += 1
+            self._bytes[region] += length
+            self._total_seconds[region] += seconds
+            self._max_seconds[region] = max(self._max_seconds[region], seconds)
+            if error:
+                self._errors[region] += 1
+
+    def reset(self):
+        with self._lock:
+            for histogram in self._histogram:
+                histogram[:] = [0] * len(histogram)
+            self._requests = [0] * self.region_count
+            self._bytes = [0] * self.region_count
+            self._errors = [0] * self.region_count
+            self._total_seconds = [0.0] * self.region_count
+            self._max_seconds = [0.0] * self.region_count
+
+    @staticmethod
+    def _percentile_ms(histogram: List[int], fraction: float) -> Optional[float]:
+        """按分档估计百分位延迟(取所在档的上限，最后一档取最大上限)"""
+        total = sum(histogram)
+        if total == 0:
+            return None
+        target = total * fraction
+        running = 0
+        for index, count in enumerate(histogram):
+            running += count
+            if running >= target:
+                return LATENCY_BINS_MS[min(index, len(LATENCY_BINS_MS) - 1)]
+        return LATENCY_BINS_MS[-1]
+
+    def regions(self) -> List[Dict]:
+        """返回各区域的统计：请求数、字节数、错误数、平均/最大/P50/P90延迟(毫秒)和分档计数"""
+        with self._lock:
+            snapshot = [(list(self._histogram[i]), self._requests[i], self._bytes[i], self._errors[i],
+                         self._total_seconds[i], self._max_seconds[i]) for i in range(self.region_count)]
+        result = []
+        for index, (histogram, requests, length, errors, total, maximum) in enumerate(snapshot):
+            offset = index * self.region_size
+            result.append({
+                'index': index,
+                'offset': offset,
+                'length': min(self.region_size, self.size - offset),
+                'requests': requests,
+                'bytes': length,
+                'errors': errors,
+                'avg_ms': total / requests * 1000 if requests else None,
+                'max_ms': maximum * 1000 if requests else None,
+                'p50_ms': self._percentile_ms(histogram, 0.5),
+                'p90_ms': self._percentile_ms(histogram, 0.9),
+                'histogram': histogram,
+            })
+        return result
+
+    @staticmethod
+    def slow_regions(regions: List[Dict]) -> List[int]:
+        """平均延迟超过各区域中位数SLOW_REGION_FACTOR倍或有读取错误的区域序号"""
+        averages = sorted(region['avg_ms'] for region in regions if region['avg_ms'] is not None)
+        if not averages:
+            return []
+        median = averages[len(averages) // 2]
+        return [region['index'] for region in regions
+                if region['errors'] or (region['avg_ms'] is not None and median > 0
+                                        and region['avg_ms'] > median * SLOW_REGION_FACTOR)]
+
+    @staticmethod
+    def imaging_order(regions: List[Dict]) -> List[int]:
+        """建议的镜像顺序：先读正常区域，慢区域和有错误的区域放到最后，越慢越靠后"""
+        slow = set(LatencyMap.slow_regions(regions))
+        return [region['index'] for region in sorted(
+            regions, key=lambda region: (region['index'] in slow,
+                                         region['avg_ms'] if region['index'] in slow else 0,
+                                         region['index']))]
+
+    def to_dict(self) -> Dict:
+        regions = self.regions()
+        return {
+            'device': self.path,
+            'size': self.size,
+            'region_size': self.region_size,
+            'bins_ms': list(LATENCY_BINS_MS),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'slow_regions': self.slow_regions(regions),
+            'imaging_order': self.imaging_order(regions),
+            'regions': regions,
+        }
+
+    def export_json(self, output_path: str):
+        """把区域统计写成JSON文件"""
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=1)
+        logging.info(f"导出读取延迟统计: {output_path}")
@@ -0,0 +1,112 @@
+import time
+import logging
+import threading
+from typing import Dict, Optional
+from device_pool import device_pool
+from latency_map import LatencyMap
+from io_scheduler import ScheduledDevice
+
+
+class LatencySurvey:
+    """读取延迟测绘：在每个区域内均匀取samples_per_region处，各读取一个stripe_size的条带
+
+    读取绕过缓存(无缓冲设备)并逐个顺序发出，测得的是设备本身的响应时间，
+    结果记录在自己的latency_map中。读取失败的条带记为错误，不中断测绘。
+    条带作为批量请求经过I/O调度器，只在工作线程中对实际的读取计时，
+    不包括排在交互式/元数据读取后面的等待和批量限速的等待。
+    """
+
+    def __init__(self, source_path: str, stripe_size: int = 64 * 1024, samples_per_region: int = 4,
+                 region_size: Optional[int] = None):
+        self.source_path = source_path
+        self.stripe_size = stripe_size
+        self.samples_per_region = max(1, samples_per_region)
+        self.region_size = region_size
+        self.latency_map = None
+        self.error = None
+        self.samples_done = 0
+        self.sample_count = 0
+        self._device = None
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+
+    def start(self):
+        """打开源设备，在后台线程中开始测绘"""
+        self._device = device_pool.acquire(self.source_path, direct=True)
+        self.latency_map = LatencyMap(self._device.size, self.region_size, self.source_path)
+        self.sample_count = self.latency_map.region_count * self.samples_per_region
+        threading.Thread(target=self._run, name="latency-survey", daemon=True).start()
+
+    def run(self) -> LatencyMap:
+        """测绘并等待完成，出错时抛出异常"""
+        self.start()
+        self.wait()
+        if self.error is not None:
+            raise self.error
+        return self.latency_map
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def progress(self) -> Dict:
+        return {'samples_done': self.samples_done, 'sample_count': self.sample_count}
+
+    def _sample_offsets(self):
+        """各区域内均匀分布的条带偏移，按物理扇区对齐"""
+        alignment = max(1, self._device.physical_sector_size)
+        size = self._device.size
+        region_size = self.latency_map.region_size
+        for region in range(self.latency_map.region_count):
+            start = region * region_size
+            length = min(region_size, size - start)
+            step = max(alignment, length // self.samples_per_region)
+            for sample in range(self.samples_per_region):
+                offset = start + sample * step + step // 2
+                offset = min(offset, max(start, start + length - self.stripe_size))
+                yield offset // alignment * alignment
+
+    @staticmethod
+    def _timed_read(device, offset: int, view):
+        """从device读取一个条带，返回(耗时秒数, 是否失败)"""
+        started = time.perf_counter()
+        try:
+            device.readinto(offset, view)
+            failed = False
+        except Exception as e:
+            # Windows上读取错误是pywintypes.error，不是OSError
+            logging.debug(f"测绘读取偏移 {offset} 失败: {str(e)}")
+            failed = True
+        return time.perf_counter() - started, failed
+
+    def _run(self):
+        try:
+            buffer = bytearray(self.stripe_size)
+            for offset in self._sample_offsets():
+                if self._cancel.is_set():
+                    break
+                length = min(self.stripe_size, self._device.size - offset)
+                view = memoryview(buffer)[:length]
+                if isinstance(self._device, ScheduledDevice):
+                    # 计时在调度器的工作线程中出队之后才开始
+                    elapsed, failed = self._device.scheduler.submit(
+                        self._device.priority, length,
+                        lambda o=offset, v=view: self._timed_read(self._device.device, o, v), offset).result()
+                else:
+                    # 内存映射设备不经过调度器
+                    elapsed, failed = self._timed_read(self._device, offset, view)
+                self.latency_map.record(offset, length, elapsed, failed)
+                self.samples_done += 1
+        except Exception as e:
+            self.error = e
+            logging.error(f"读取延迟测绘失败: {str(e)}")
+        finally:
+            device_pool.release(self._device)
+            logging.info(f"读取延迟测绘结束: {self.samples_done}/{self.sample_count} 个条带")
+            self._finished.set()
@@ -1,15 +1,25 @@
 import sys
 import os
 import ctypes
+import logging
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QMenuBar, QStatusBar, QToolBar, 
                             QFileDialog, QMessageBox, QComboBox, QDialog,
-                            QLabel, QLineEdit, QPushButton, QFormLayout)
+                            QLabel, QLineEdit, QPushButton, QFormLayout,
+                            QProgressDialog)
 from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QAction, QIcon
 from hex_editor import HexEditor
 from disk_utils import DiskUtils
+from device_pool import device_pool
 from fat32_recovery_dialog import FAT32RecoveryDialog
+from disk_imaging_dialog import DiskImagingDialog
+from disk_rescue_dialog import DiskRescueDialog
+from latency_dialog import LatencyDialog
+from edit_overlay import EditOverlay, overlay_path_for
+from paged_data import PagedData
+from partition_table import get_partitions
+from highlight_overlay import SOURCE_FAT32, is_fat32_boot_sector, fat32_volume_spans
 
 class SectorDialog(QDialog):
     def __init__(self, parent=None):
@@ -107,6 +117,69 @@ class ClusterDialog(QDialog):
         self.ok_button.clicked.connect(self.accept)
         self.cancel_button.clicked.connect(self.reject)
 
+class SearchDialog(QDialog):
+    def __init__(self, parent=None, text: str = "", encoding: str = "hex"):
+        super().__init__(parent)
+        self.setWindowTitle("查找")
+        self.setModal(True)
+        self.setStyleSheet("""
+            QDialog {
+                background-color: #2c2c2c;
+            }
+            QLabel {
+                color: #ffffff;
+            }
+            QLineEdit, QComboBox {
+                padding: 5px;
+                border: 1px solid #555555;
+                border-radius: 3px;
+                background-color: #1e1e1e;
+                color: white;
+            }
+            QPushButton {
+                padding: 5px 15px;
+                background-color: #0078d7;
+                color: white;
+                border: none;
+                border-radius: 3px;
+            }
+            QPushButton:hover {
+                background-color: #106ebe;
+            }
+        """)
+        
+        layout = QFormLayout(self)
+        layout.setSpacing(10)
+        
+        self.type_combo = QComboBox()
+        self.type_combo.addItem("十六进制", "hex")
+        self.type_combo.addItem("ASCII文本", "ascii")
+        self.type_combo.addItem("UTF-16LE文本", "utf-16-le")
+        self.type_combo.setCurrentIndex(max(0, self.type_combo.findData(encoding)))
+        layout.addRow("类型:", self.type_combo)
+        
+        self.pattern_input = QLineEdit(text)
+        self.pattern_input.setPlaceholderText("例如 55 AA 或 FAT32")
+        layout.addRow("查找内容:", self.pattern_input)
+        
+        buttons_layout = QHBoxLayout()
+        self.ok_button = QPushButton("查找")
+        self.cancel_button = QPushButton("取消")
+        buttons_layout.addWidget(self.ok_button)
+        buttons_layout.addWidget(self.cancel_button)
+        layout.addRow(buttons_layout)
+        
+        self.ok_button.clicked.connect(self.accept)
+        self.cancel_button.clicked.connect(self.reject)
+    
+    def pattern(self) -> bytes:
+        """要查找的字节串，输入无效时抛出ValueError"""
+        text = self.pattern_input.text()
+        encoding = self.type_combo.currentData()
+        if encoding == "hex":
+            return bytes.fromhex(text)
+        return text.encode(encoding)
+
 class WinHexClone(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -253,6 +326,7 @@ class WinHexClone(QMainWindow):
         # 连接信号
         self.hex_editor.goto_sector_btn.clicked.connect(self.goto_sector)
         self.hex_editor.goto_cluster_btn.clicked.connect(self.goto_cluster)
+        self.hex_editor.data_modified.connect(self.on_data_modified)
         
         # 创建菜单栏
         self.create_menu_bar()
@@ -267,6 +341,15 @@ class WinHexClone(QMainWindow):
         # 当前文件路径
         self.current_file = None
         self.current_disk = None
+        # 当前视图使用的设备(文件或磁盘)，以及打开文件时的写时复制编辑层，修改在保存前只写入编辑层
+        self.view_device = None
+        self.edit_overlay = None
+        # FAT32恢复对话框是非模态的，后台扫描时仍然可以浏览十六进制视图
+        self.recovery_dialog = None
+        # 上一次查找的输入，查找下一个时继续使用
+        self.search_text = ""
+        self.search_encoding = "hex"
+        self.search_pattern = b""
         
         # 初始化磁盘列表
         self.init_disk_list()
@@ -280,8 +363,8 @@ class WinHexClone(QMainWindow):
             mft_sector = DiskUtils.find_mft_location(self.current_disk)
             data = DiskUtils.read_sector(self.current_disk, mft_sector)
             self.hex_editor.set_data(data)
-            self.hex_editor.is_mft = True  # 设置MFT标志
-            self.hex_editor.update()
+            # 按MFT记录结构着色
+            self.hex_editor.highlight_mft_record()
             QMessageBox.information(self, "结果", f"NTFS 的 $MFT 起始扇区号为: {mft_sector}")
         except Exception as e:
             QMessageBox.critical(self, "错误", str(e))
@@ -314,22 +397,21 @@ class WinHexClone(QMainWindow):
     def on_disk_changed(self, index):
         disk_id = self.disk_combo.itemData(index)
         if disk_id:
+            # 重新选择磁盘时丢弃旧的缓存内容，保证看到的是最新数据
+            device_pool.invalidate(disk_id)
             try:
                 if disk_id.startswith('\\\\.\\PhysicalDrive'):
-                    # 读取物理磁盘的前几个扇区数据
-                    start_sector = 0
-                    end_sector = self.hex_editor.sectors_per_view - 1
-                    data = DiskUtils.read_sector_range(disk_id, start_sector, end_sector)
-                    sector_data = [data[i*512:(i+1)*512] for i in range(self.hex_editor.sectors_per_view)]
-                    self.hex_editor.set_sector_data(sector_data, start_sector)
+                    # 在整个物理磁盘上打开分页视图(按磁盘的逻辑扇区大小分隔)
+                    self.show_disk(disk_id)
+                    # 保存物理磁盘路径，$MFT/根目录查找会在其分区表中定位卷
+                    self.current_disk = disk_id
+                    self.setWindowTitle(f"OpenHex - 磁盘 {disk_id}")
+                    return
                 elif disk_id == "__open_vdisk__":
-                    file_name, _ = QFileDialog.getOpenFileName(self, "打开虚拟磁盘", "", "磁盘镜像 (*.vhd *.vmdk *.img *.bin);;所有文件 (*.*)")
+                    file_name, _ = QFileDialog.getOpenFileName(self, "打开虚拟磁盘", "", "磁盘镜像 (*.vhd *.vmdk *.E01 *.001 *.ohxz *.ohxmeta *.img *.bin);;所有文件 (*.*)")
                     if file_name:
                         try:
-                            with open(file_name, 'rb') as f:
-                                data = f.read(512 * self.hex_editor.sectors_per_view)
-                            sector_data = [data[i*512:(i+1)*512] for i in range(self.hex_editor.sectors_per_view)]
-                            self.hex_editor.set_sector_data(sector_data, 0)
+                            self.show_disk(file_name)
                             self.current_disk = file_name  # 只保存文件路径
                             self.setWindowTitle(f"OpenHex - 虚拟磁盘 {file_name}")
                         except Exception as e:
@@ -337,30 +419,47 @@ class WinHexClone(QMainWindow):
                     return
                 if disk_id and (disk_id.startswith("\\.\\") or (len(disk_id) == 2 and disk_id[1] == ':')):
                     try:
-                        # 读取多个扇区
-                        sector_size = 512
-                        sectors_per_view = self.hex_editor.sectors_per_view
-                        base_sector = 0
-                        sector_data = []
-                        for i in range(sectors_per_view):
-                            try:
-                                data = DiskUtils.read_sector(disk_id, base_sector + i, sector_size)
-                            except Exception as e:
-                                if disk_id.startswith('\\.\\PhysicalDrive'):
-                                    QMessageBox.critical(self, "错误", "物理磁盘读取失败，请以管理员身份运行！")
-                                    return
-                                data = b'\x00' * sector_size
-                            sector_data.append(data)
-                        self.hex_editor.set_sector_data(sector_data, base_sector)
+                        self.show_disk(disk_id)
                         self.current_disk = disk_id  # 只保存盘符或物理磁盘路径
                         self.setWindowTitle(f"OpenHex - 磁盘 {disk_id}")
                     except Exception as e:
-                        QMessageBox.critical(self, "错误", f"无法打开磁盘: {str(e)}")
+                        if disk_id.startswith('\\.\\PhysicalDrive'):
+                            QMessageBox.critical(self, "错误", "物理磁盘读取失败，请以管理员身份运行！")
+                        else:
+                            QMessageBox.critical(self, "错误", f"无法打开磁盘: {str(e)}")
                 else:
                     self.current_disk = None
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"无法读取磁盘数据：{str(e)}")
     
+    def show_disk(self, disk_path: str):
+        """在整个磁盘或镜像上打开分页视图，滚动时只读取可见部分所在的页"""
+        self.close_view()
+        device = device_pool.acquire(disk_path)
+        try:
+            # 先读第一个扇区，权限不足等错误在这里报告
+            device.read_at(0, device.sector_size)
+        except Exception:
+            device_pool.release(device)
+            raise
+        self.view_device = device
+        self.current_file = None
+        self.hex_editor.load_device(device, sector_lines=True)
+        self.highlight_fat32_volumes(device, disk_path)
+    
+    def highlight_fat32_volumes(self, device, disk_path: str):
+        """给磁盘视图中FAT32卷的引导扇区、备份引导扇区和根目录项着色"""
+        try:
+            bases = [0]
+            if not is_fat32_boot_sector(bytes(device.read_at(0, 512))):
+                bases = [partition.start for partition in get_partitions(disk_path, device)]
+            spans = []
+            for base in bases:
+                spans.extend(fat32_volume_spans(device, base))
+            self.hex_editor.set_highlights(SOURCE_FAT32, spans)
+        except Exception as e:
+            logging.debug(f"FAT32结构着色失败: {str(e)}")
+    
     def create_menu_bar(self):
         """创建菜单栏"""
         menubar = self.menuBar()
@@ -386,6 +485,19 @@ class WinHexClone(QMainWindow):
         exit_action.triggered.connect(self.close)
         file_menu.addAction(exit_action)
         
+        # 编辑菜单
+        edit_menu = menubar.addMenu("编辑")
+        
+        find_action = QAction("查找...", self)
+        find_action.setShortcut("Ctrl+F")
+        find_action.triggered.connect(self.find_data)
+        edit_menu.addAction(find_action)
+        
+        find_next_action = QAction("查找下一个", self)
+        find_next_action.setShortcut("F3")
+        find_next_action.triggered.connect(self.find_next)
+        edit_menu.addAction(find_next_action)
+        
         # 磁盘菜单
         disk_menu = menubar.addMenu("磁盘")
         
@@ -401,6 +513,20 @@ class WinHexClone(QMainWindow):
         find_root_dir_action.triggered.connect(self.find_root_directory)
         disk_menu.addAction(find_root_dir_action)
         
+        disk_menu.addSeparator()
+        
+        create_image_action = QAction("创建磁盘镜像...", self)
+        create_image_action.triggered.connect(self.open_disk_imaging)
+        disk_menu.addAction(create_image_action)
+        
+        rescue_action = QAction("坏扇区抢救...", self)
+        rescue_action.triggered.connect(self.open_disk_rescue)
+        disk_menu.addAction(rescue_action)
+        
+        latency_action = QAction("读取延迟热力图...", self)
+        latency_action.triggered.connect(self.open_latency_heatmap)
+        disk_menu.addAction(latency_action)
+        
         # 工具菜单
         tools_menu = menubar.addMenu("工具")
         
@@ -415,6 +541,62 @@ class WinHexClone(QMainWindow):
         about_action.triggered.connect(self.show_about)
         help_menu.addAction(about_action)
     
+    def find_data(self):
+        """输入十六进制或文本，从光标处开始查找"""
+        if not self.hex_editor.data:
+            return
+        dialog = SearchDialog(self, self.search_text, self.search_encoding)
+        if not dialog.exec():
+            return
+        try:
+            pattern = dialog.pattern()
+        except ValueError:
+            QMessageBox.warning(self, "警告", "请输入有效的十六进制字节，例如 55 AA")
+            return
+        if not pattern:
+            return
+        self.search_text = dialog.pattern_input.text()
+        self.search_encoding = dialog.type_combo.currentData()
+        self.search_pattern = pattern
+        self.search_from(self.hex_editor.cursor_position)
+    
+    def find_next(self):
+        """从当前匹配之后继续查找上一次的内容"""
+        if not self.search_pattern:
+            self.find_data()
+            return
+        self.search_from(self.hex_editor.cursor_position + 1)
+    
+    def search_from(self, start: int):
+        """从start开始查找self.search_pattern；数据较大时显示可以取消的进度"""
+        data_length = len(self.hex_editor.data)
+        progress = QProgressDialog("正在查找...", "取消", 0, 1000, self)
+        progress.setWindowTitle("查找")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(500)
+        
+        def report(position: int) -> bool:
+            progress.setValue(min(1000, int(position * 1000 / max(1, data_length))))
+            QApplication.processEvents()
+            return not progress.wasCanceled()
+        
+        try:
+            position = self.hex_editor.find(self.search_pattern, start, report)
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"查找失败: {str(e)}")
+            return
+        finally:
+            canceled = progress.wasCanceled()
+            progress.close()
+        if position >= 0:
+            self.hex_editor.show_search_hit(position, self.search_pattern)
+            self.statusBar.showMessage(f"找到匹配: 偏移 0x{self.hex_editor.data_offset + position:X}")
+        elif canceled:
+            self.statusBar.showMessage("查找已取消")
+        else:
+            self.hex_editor.set_search_hits([], 0)
+            self.statusBar.showMessage("没有找到匹配的内容")
+    
     def goto_sector(self):
         """跳转到指定扇区"""
         if not self.current_disk:
@@ -425,8 +607,20 @@ class WinHexClone(QMainWindow):
         if dialog.exec():
             try:
                 sector_number = int(dialog.sector_input.text())
-                data = DiskUtils.read_sector(self.current_disk, sector_number)
+                data = self.hex_editor.data
+                if (self.hex_editor.sector_lines and isinstance(data, PagedData)
+                        and self.view_device is not None and self.view_device.path == self.current_disk):
+                    # 整个磁盘已在分页视图中，直接滚动到该扇区
+                    self.hex_editor.goto_offset(sector_number * self.hex_editor.sector_size - self.hex_editor.data_offset)
+                    self.hex_editor.set_current_sector(sector_number)
+                    self.statusBar.showMessage(f"当前扇区: {sector_number}")
+                    return
+                sector_size = DiskUtils.get_sector_size(self.current_disk)[0]
+                # 坏扇区不报错，以??显示
+                data, failed = DiskUtils.read_sector_range_ex(self.current_disk, sector_number, sector_number,
+                                                              sector_size)
                 self.hex_editor.set_data(data)
+                self.show_bad_sectors(failed, sector_number, sector_size)
                 self.hex_editor.set_current_sector(sector_number)
                 self.statusBar.showMessage(f"当前扇区: {sector_number}")
             except ValueError:
@@ -466,6 +660,7 @@ class WinHexClone(QMainWindow):
             pass
     
     def new_file(self):
+        self.close_view()
         self.hex_editor.set_data(bytearray())
         self.current_file = None
         self.current_disk = None
@@ -474,17 +669,67 @@ class WinHexClone(QMainWindow):
     def open_file(self):
         file_name, _ = QFileDialog.getOpenFileName(self, "打开文件", "", "所有文件 (*.*)")
         if file_name:
+            self.close_view()
+            device = None
             try:
-                with open(file_name, 'rb') as f:
-                    data = f.read()
-                self.hex_editor.set_data(data)
+                device = device_pool.acquire(file_name)
+                # 上次未保存的编辑层会被继续使用
+                overlay = EditOverlay(device, overlay_path_for(file_name))
+                # 分页视图建在编辑层上，显示时已合并修改
+                self.hex_editor.load_device(overlay)
+                self.hex_editor.set_overlay(overlay)
+                self.view_device, self.edit_overlay = device, overlay
                 self.current_file = file_name
                 self.current_disk = None
-                self.setWindowTitle(f"OpenHex - {file_name}")
+                self.update_title()
+                if overlay.dirty:
+                    self.statusBar.showMessage(f"已恢复上次未保存的修改: {overlay.dirty_bytes} 字节")
+                elif not device_pool.is_plain_file(file_name):
+                    self.statusBar.showMessage("容器镜像的修改只保存在编辑层中，不能写回原文件")
             except Exception as e:
+                if device is not None and self.view_device is not device:
+                    device_pool.release(device)
                 QMessageBox.critical(self, "错误", f"无法打开文件：{str(e)}")
     
+    def close_view(self):
+        """关闭当前文件的编辑层(未保存的修改留在编辑层文件中，下次打开时继续)并归还视图使用的设备"""
+        if self.edit_overlay is not None:
+            try:
+                self.edit_overlay.close()
+            except Exception as e:
+                QMessageBox.critical(self, "错误", f"保存编辑层失败：{str(e)}")
+            self.edit_overlay = None
+        if self.view_device is not None:
+            device_pool.release(self.view_device)
+            self.view_device = None
+    
+    def on_data_modified(self):
+        self.update_title()
+    
+    def update_title(self):
+        if not self.current_file:
+            return
+        modified = self.edit_overlay is not None and self.edit_overlay.dirty
+        self.setWindowTitle(f"OpenHex - {self.current_file}{' *' if modified else ''}")
+    
     def save_file(self):
+        if self.edit_overlay is not None and self.hex_editor.overlay is self.edit_overlay:
+            if not device_pool.is_plain_file(self.current_file):
+                # 分段/VHD/VMDK/E01/压缩镜像的设备偏移不是文件偏移，按偏移写回会损坏镜像
+                QMessageBox.warning(self, "警告", "该文件是容器镜像，修改不能写回原文件，已保留在编辑层中")
+                return
+            # 只把修改过的块写回原文件
+            try:
+                written = self.edit_overlay.commit()
+                device_pool.invalidate(self.current_file)
+                # 已缓存的页与提交后的文件内容相同，仍然丢弃，之后按新文件重新读取
+                self.hex_editor.data.invalidate()
+                self.update_title()
+                self.statusBar.showMessage(f"已保存 {written} 字节的修改")
+            except Exception as e:
+                QMessageBox.critical(self, "错误", f"无法保存文件：{str(e)}")
+            return
+        
         if not self.current_file:
             file_name, _ = QFileDialog.getSaveFileName(self, "保存文件", "", "所有文件 (*.*)")
             if not file_name:
@@ -492,9 +737,26 @@ class WinHexClone(QMainWindow):
             self.current_file = file_name
         
         try:
+            data = self.hex_editor.data
+            if isinstance(data, PagedData):
+                # 磁盘视图只保存选中的范围(没有多字节选区时保存当前显示的部分)；
+                # 整个磁盘在界面线程中写出会长时间卡住，应使用"创建磁盘镜像"
+                area = self.hex_editor.hex_area
+                if area.selection_start != -1 and area.selection_end != -1 and area.selection_start != area.selection_end:
+                    first = min(area.selection_start, area.selection_end)
+                    last = max(area.selection_start, area.selection_end) + 1
+                else:
+                    first, last = area.visible_range()
+                data = data.read(first, last - first)
+                message = (f"已保存偏移 0x{self.hex_editor.data_offset + first:X} 起的 {len(data)} 字节，"
+                           f"整个磁盘请使用\"创建磁盘镜像\"")
+            else:
+                message = None
             with open(self.current_file, 'wb') as f:
-                f.write(self.hex_editor.data)
+                f.write(data)
             self.setWindowTitle(f"OpenHex - {self.current_file}")
+            if message:
+                self.statusBar.showMessage(message)
         except Exception as e:
             QMessageBox.critical(self, "错误", f"无法保存文件：{str(e)}")
 
@@ -521,22 +783,70 @@ class WinHexClone(QMainWindow):
             try:
                 start_sector = int(dialog.start_sector_input.text())
                 end_sector = int(dialog.end_sector_input.text())
-                data = DiskUtils.read_sector_range(self.current_disk, start_sector, end_sector)
+                sector_size = DiskUtils.get_sector_size(self.current_disk)[0]
+                data, failed = DiskUtils.read_sector_range_ex(self.current_disk, start_sector, end_sector,
+                                                              sector_size)
                 self.hex_editor.set_data(data)
+                self.show_bad_sectors(failed, start_sector, sector_size)
                 self.statusBar.showMessage(f"已读取扇区 {start_sector} 到 {end_sector} 的数据")
             except ValueError:
                 QMessageBox.warning(self, "警告", "请输入有效的扇区号")
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"读取扇区范围失败: {str(e)}")
 
+    def show_bad_sectors(self, failed, base_sector: int, sector_size: int):
+        """把读取失败的扇区区间转换为字节区间交给十六进制视图显示
+
+        Args:
+            failed: read_sector_range_ex返回的(起始扇区, 扇区数)列表
+            base_sector: 视图中第一个扇区的扇区号
+            sector_size: 扇区大小
+        """
+        self.hex_editor.set_bad_ranges([((first - base_sector) * sector_size, count * sector_size)
+                                        for first, count in failed])
+        if failed:
+            self.statusBar.showMessage(f"{sum(count for _, count in failed)} 个扇区读取失败，以??显示")
+
     def open_fat32_recovery(self):
         """打开FAT32文件恢复对话框"""
         try:
-            recovery_dialog = FAT32RecoveryDialog(self)
-            recovery_dialog.exec()
+            if self.recovery_dialog is None:
+                self.recovery_dialog = FAT32RecoveryDialog(self)
+            self.recovery_dialog.show()
+            self.recovery_dialog.raise_()
+            self.recovery_dialog.activateWindow()
         except Exception as e:
             QMessageBox.critical(self, "错误", f"打开FAT32文件恢复对话框失败: {str(e)}")
     
+    def open_disk_imaging(self):
+        """打开创建磁盘镜像对话框"""
+        try:
+            imaging_dialog = DiskImagingDialog(self)
+            imaging_dialog.exec()
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"打开创建磁盘镜像对话框失败: {str(e)}")
+    
+    def open_disk_rescue(self):
+        """打开坏扇区抢救对话框"""
+        try:
+            rescue_dialog = DiskRescueDialog(self)
+            rescue_dialog.exec()
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"打开坏扇区抢救对话框失败: {str(e)}")
+    
+    def open_latency_heatmap(self):
+        """打开读取延迟热力图对话框，默认选中当前磁盘"""
+        try:
+            latency_dialog = LatencyDialog(self, self.current_disk)
+            latency_dialog.exec()
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"打开读取延迟热力图失败: {str(e)}")
+    
+    def closeEvent(self, event):
+        # 退出时保存编辑层的索引，未保存的修改下次打开该文件时继续
+        self.close_view()
+        super().closeEvent(event)
+    
     def show_about(self):
         """显示关于对话框"""
         QMessageBox.about(self, "关于OpenHex", 
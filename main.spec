@@ -10,7 +10,30 @@ a = Analysis(['main.py'],
                  ('fat32_recovery.py', '.'),
                  ('fat32_recovery_dialog.py', '.'),
                  ('disk_utils.py', '.'),
-                 ('hex_editor.py', '.')
+                 ('hex_editor.py', '.'),
+                 ('io_scheduler.py', '.'),
+                 ('latency_map.py', '.'),
+                 ('latency_survey.py', '.'),
+                 ('latency_dialog.py', '.'),
+                 ('block_device.py', '.'),
+                 ('compressed_image.py', '.'),
+                 ('block_cache.py', '.'),
+                 ('device_pool.py', '.'),
+                 ('direct_io.py', '.'),
+                 ('edit_overlay.py', '.'),
+                 ('paged_data.py', '.'),
+                 ('highlight_overlay.py', '.'),
+                 ('disk_imaging.py', '.'),
+                 ('disk_imaging_dialog.py', '.'),
+                 ('disk_rescue.py', '.'),
+                 ('disk_rescue_dialog.py', '.'),
+                 ('ewf_image.py', '.'),
+                 ('partition_table.py', '.'),
+                 ('readahead.py', '.'),
+                 ('rescue_map.py', '.'),
+                 ('metadata_snapshot.py', '.'),
+                 ('split_image.py', '.'),
+                 ('virtual_disk.py', '.')
              ],
              hiddenimports=[
                  # 添加可能的隐藏导入
@@ -0,0 +1,131 @@
+import time
+import bisect
+import struct
+import logging
+from typing import List, Tuple
+from block_device import BlockDevice, merge_extents
+
+# 元数据快照文件签名
+SNAPSHOT_SIGNATURE = b'OHXMETA\x00'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXTENSION = '.ohxmeta'
+
+# 文件头: 签名、版本、逻辑/物理扇区大小、卷大小、偏移表位置、偏移表项数、创建时间、源路径
+SNAPSHOT_HEADER = struct.Struct("<8sIIIQQIQ256s")
+SNAPSHOT_HEADER_SIZE = 4096
+# 偏移表项: 卷内偏移、长度、在快照文件中的偏移
+SNAPSHOT_EXTENT = struct.Struct("<QQQ")
+
+# 导出时一次读取的最大字节数
+SNAPSHOT_COPY_CHUNK = 4 * 1024 * 1024
+
+
+def write_metadata_snapshot(output_path: str, device: BlockDevice, extents: List[Tuple[int, int]],
+                            source: str = "") -> dict:
+    """把设备上指定的区间写成元数据快照文件
+
+    快照只保存这些区间的数据，文件末尾的偏移表记录每段数据在原卷中的位置；
+    打开快照时其余部分读出为0。
+
+    Args:
+        output_path: 快照文件路径
+        device: 源设备(卷)
+        extents: 需要保存的(偏移, 长度)区间，可以重叠和乱序
+        source: 源卷路径，记录在文件头中
+
+    Returns:
+        包含区间数、保存字节数、卷大小的统计
+    """
+    extents = merge_extents([(offset, min(length, device.size - offset)) for offset, length in extents
+                             if length > 0 and offset < device.size])
+    table = []
+    stored = 0
+    with open(output_path, 'wb') as f:
+        f.write(bytes(SNAPSHOT_HEADER_SIZE))
+        position = SNAPSHOT_HEADER_SIZE
+        for offset, length in extents:
+            table.append((offset, length, position))
+            done = 0
+            while done < length:
+                data = device.read_at(offset + done, min(SNAPSHOT_COPY_CHUNK, length - done))
+                if not data:
+                    break
+                f.write(data)
+                done += len(data)
+            if done < length:
+                # 源设备读取不足，补0保持偏移表一致
+                f.write(bytes(length - done))
+            position += length
+            stored += length
+
+        f.write(b''.join(SNAPSHOT_EXTENT.pack(*entry) for entry in table))
+        f.seek(0)
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_SIGNATURE, SNAPSHOT_VERSION, device.sector_size,
+                                     device.physical_sector_size, device.size, position, len(table),
+                                     int(time.time()), source.encode('utf-8')[:256]))
+    logging.info(f"元数据快照 {output_path}: {len(table)} 个区间, {stored} 字节, 卷大小 {device.size}")
+    return {
+        'extents': len(table),
+        'stored_bytes': stored,
+        'volume_size': device.size,
+    }
+
+
+class MetadataSnapshotDevice(BlockDevice):
+    """元数据快照文件呈现成的卷设备
+
+    大小与原卷相同，偏移表中的区间读出保存的数据，其余部分读出为0，
+    data_extents只报告保存了数据的区间。
+    """
+
+    def __init__(self, base: BlockDevice, header: bytes):
+        super().__init__(base.path)
+        self.base = base
+        (_, version, sector_size, physical_sector_size, self.volume_size, map_offset, map_count,
+         self.created, source) = SNAPSHOT_HEADER.unpack_from(header, 0)
+        if version != SNAPSHOT_VERSION:
+            raise Exception(f"不支持的元数据快照版本: {version}")
+        self.source = source.rstrip(b'\x00').decode('utf-8', errors='replace')
+        self.set_sector_sizes((sector_size, physical_sector_size))
+        table = base.read_at(map_offset, map_count * SNAPSHOT_EXTENT.size)
+        if len(table) < map_count * SNAPSHOT_EXTENT.size:
+            raise Exception("元数据快照偏移表不完整")
+        self.extents = [SNAPSHOT_EXTENT.unpack_from(table, i * SNAPSHOT_EXTENT.size) for i in range(map_count)]
+        self.starts = [start for start, _, _ in self.extents]
+        logging.info(f"元数据快照: 源 {self.source}, 卷大小 {self.volume_size}, {map_count} 个区间")
+
+    @property
+    def size(self) -> int:
+        return self.volume_size
+
+    def _overlapping(self, offset: int, length: int):
+        """与[offset, offset+length)重叠的区间序号"""
+        index = max(0, bisect.bisect_right(self.starts, offset) - 1)
+        while index < len(self.extents) and self.extents[index][0] < offset + length:
+            start, size, _ = self.extents[index]
+            if start + size > offset:
+                yield index
+            index += 1
+
+    def readinto(self, offset: int, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        length = min(len(view), max(0, self.volume_size - offset))
+        view[:length] = bytes(length)
+        for index in self._overlapping(offset, length):
+            start, size, file_offset = self.extents[index]
+            begin = max(start, offset)
+            end = min(start + size, offset + length)
+            self.base.readinto(file_offset + begin - start, view[begin - offset:end - offset])
+        return length
+
+    def data_extents(self, offset: int, length: int):
+        length = min(length, max(0, self.volume_size - offset))
+        extents = []
+        for index in self._overlapping(offset, length):
+            start, size, _ = self.extents[index]
+            begin = max(start, offset)
+            extents.append((begin, min(start + size, offset + length) - begin))
+        return extents
+
+    def close(self):
+        self.base.close()
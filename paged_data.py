@@ -0,0 +1,194 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from block_device import BlockDevice
+from device_pool import device_pool
+from edit_overlay import EditOverlay
+
+
+class PagedData:
+    """块设备上按页读取的只读字节序列，供十六进制视图使用
+
+    支持len()、按下标取字节和切片，表现得像一段[offset, offset+length)的bytes，
+    但只在访问时按page_size读取所在的页，最近用过的max_pages页保存在LRU中。
+    读取失败的扇区以0填充并记为坏区间；坏扇区图中已知的坏扇区不再读取。
+    """
+
+    def __init__(self, device: BlockDevice, offset: int = 0, length: Optional[int] = None,
+                 page_size: int = 64 * 1024, max_pages: int = 64):
+        self.device = device
+        self.offset = offset
+        self.length = max(0, device.size - offset) if length is None else length
+        # 页按物理扇区对齐，读取失败时可以逐扇区重试
+        alignment = max(1, device.physical_sector_size)
+        self.page_size = max(alignment, page_size // alignment * alignment)
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+        # 读取失败的(起始, 结束)字节区间，相对本序列
+        self._bad_ranges: List[Tuple[int, int]] = []
+        self._lock = threading.Lock()
+        self.reads = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __bool__(self) -> bool:
+        return self.length > 0
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return bytes(self.read(start, max(0, stop - start)))[::step]
+            return self.read(start, max(0, stop - start))
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError("PagedData index out of range")
+        page, within = divmod(key, self.page_size)
+        return self._page(page)[within]
+
+    def read(self, position: int, length: int) -> bytes:
+        """读取[position, position+length)，跨页时拼接"""
+        length = min(length, max(0, self.length - position))
+        parts = []
+        while length > 0:
+            page, within = divmod(position, self.page_size)
+            data = self._page(page)[within:within + length]
+            parts.append(data)
+            position += len(data)
+            length -= len(data)
+        return b''.join(parts)
+
+    def read_uncached(self, position: int, length: int) -> bytes:
+        """读取[position, position+length)，不经过页LRU和句柄池的缓存(整段查找等批量读取用)
+
+        读取按调用线程当前的I/O优先级调度；编辑层中修改过的块从编辑层读取，
+        读取失败时逐扇区重试，读不出的扇区填0并记为坏区间。
+        """
+        length = min(length, max(0, self.length - position))
+        if length <= 0:
+            return b''
+        device_offset = self.offset + position
+        known_bad = device_pool.bad_extents(self.device.path, device_offset, length)
+        if not known_bad:
+            overlay = self.device if isinstance(self.device, EditOverlay) else None
+            base = overlay.base if overlay is not None else self.device
+            raw = device_pool.acquire(base.path, cached=False)
+            try:
+                data = bytearray(raw.read_at(device_offset, length))
+            except Exception as e:
+                # Windows上读取错误是pywintypes.error，不是OSError
+                logging.debug(f"读取偏移 {device_offset} 失败，逐扇区重试: {str(e)}")
+                data = None
+            finally:
+                device_pool.release(raw)
+            if data is not None:
+                if len(data) < length:
+                    data += bytes(length - len(data))
+                if overlay is not None:
+                    for extent_offset, extent_length in overlay.dirty_extents():
+                        begin = max(extent_offset, device_offset)
+                        end = min(extent_offset + extent_length, device_offset + length)
+                        if begin < end:
+                            data[begin - device_offset:end - device_offset] = overlay.read_at(begin, end - begin)
+                return bytes(data)
+        return self._load_page_by_sector(position, length, known_bad)
+
+    def prefetch(self, start: int, end: int, margin_pages: int = 1):
+        """读入[start, end)所在的页以及前后各margin_pages页(视图滚动前调用)"""
+        if self.length == 0:
+            return
+        first = max(0, start // self.page_size - margin_pages)
+        last = min((self.length - 1) // self.page_size, max(start, end - 1) // self.page_size + margin_pages)
+        for page in range(first, last + 1):
+            self._page(page)
+
+    def invalidate(self, position: int = 0, length: Optional[int] = None):
+        """丢弃与[position, position+length)重叠的页(数据被修改后调用)，length为None时丢弃全部"""
+        with self._lock:
+            if length is None:
+                self._pages.clear()
+                return
+            first = position // self.page_size
+            last = (position + max(1, length) - 1) // self.page_size
+            for page in range(first, last + 1):
+                self._pages.pop(page, None)
+
+    def bad_ranges(self) -> List[Tuple[int, int]]:
+        """已读取的页中读取失败的(起始, 结束)字节区间"""
+        with self._lock:
+            return list(self._bad_ranges)
+
+    def _page(self, page: int) -> bytes:
+        with self._lock:
+            data = self._pages.get(page)
+            if data is not None:
+                self._pages.move_to_end(page)
+                return data
+        data = self._load_page(page)
+        with self._lock:
+            self._pages[page] = data
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return data
+
+    def _load_page(self, page: int) -> bytes:
+        start = page * self.page_size
+        length = min(self.page_size, self.length - start)
+        device_offset = self.offset + start
+        self.reads += 1
+        known_bad = device_pool.bad_extents(self.device.path, device_offset, length)
+        if not known_bad:
+            try:
+                data = self.device.read_at(device_offset, length)
+                if len(data) < length:
+                    data = bytes(data) + bytes(length - len(data))
+                return bytes(data)
+            except Exception as e:
+                # Windows上读取错误是pywintypes.error，不是OSError
+                logging.debug(f"读取页 {page} 失败，逐扇区重试: {str(e)}")
+        return self._load_page_by_sector(start, length, known_bad)
+
+    def _load_page_by_sector(self, start: int, length: int, known_bad) -> bytes:
+        """逐扇区读取一页，读不出的扇区填0并记为坏区间，新发现的坏扇区登记到坏扇区图
+
+        重试绕过句柄池的缓存：缓存按64 KiB的缓存行读取，经过缓存时一个坏扇区会让整行的扇区都读取失败。
+        编辑层中修改过的块仍然从编辑层读取。
+        """
+        sector_size = max(1, self.device.sector_size)
+        overlay = self.device if isinstance(self.device, EditOverlay) else None
+        base = overlay.base if overlay is not None else self.device
+        raw = device_pool.acquire(base.path, cached=False)
+        buffer = bytearray(length)
+        bad = []
+        try:
+            for position in range(0, length, sector_size):
+                device_offset = self.offset + start + position
+                size = min(sector_size, length - position)
+                if any(offset < device_offset + size and device_offset < offset + extent
+                       for offset, extent in known_bad):
+                    bad.append((start + position, start + position + size))
+                    continue
+                try:
+                    if overlay is not None and overlay.is_dirty(device_offset):
+                        data = overlay.read_at(device_offset, size)
+                    else:
+                        data = raw.read_at(device_offset, size)
+                    buffer[position:position + len(data)] = data
+                except Exception:
+                    device_pool.mark_bad(self.device.path, device_offset, size)
+                    bad.append((start + position, start + position + size))
+        finally:
+            device_pool.release(raw)
+        if bad:
+            with self._lock:
+                merged = sorted(self._bad_ranges + bad)
+                self._bad_ranges = []
+                for begin, end in merged:
+                    if self._bad_ranges and begin <= self._bad_ranges[-1][1]:
+                        self._bad_ranges[-1] = (self._bad_ranges[-1][0], max(end, self._bad_ranges[-1][1]))
+                    else:
+                        self._bad_ranges.append((begin, end))
+        return bytes(buffer)
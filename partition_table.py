@@ -0,0 +1,316 @@
+import re
+import uuid
+import zlib
+import struct
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from block_device import BlockDevice, open_block_device
+
+# 分区路径的写法: <磁盘路径>::p<分区号>，分区号从1开始
+PARTITION_PATH_PATTERN = re.compile(r'^(.*)::p(\d+)$')
+
+# MBR中的扩展分区类型
+MBR_EXTENDED_TYPES = (0x05, 0x0F, 0x85)
+MBR_GPT_PROTECTIVE = 0xEE
+
+MBR_TYPE_NAMES = {
+    0x01: "FAT12",
+    0x04: "FAT16",
+    0x06: "FAT16",
+    0x07: "NTFS/exFAT",
+    0x0B: "FAT32",
+    0x0C: "FAT32",
+    0x0E: "FAT16",
+    0x27: "恢复分区",
+    0x82: "Linux交换分区",
+    0x83: "Linux",
+    0xEF: "EFI",
+}
+
+GPT_TYPE_NAMES = {
+    "ebd0a0a2-b9e5-4433-87c0-68b6b72699c7": "基本数据",
+    "c12a7328-f81f-11d2-ba4b-00a0c93ec93b": "EFI系统",
+    "e3c9e316-0b5c-4db8-817d-f92df00215ae": "Microsoft保留",
+    "de94bba4-06d1-4d40-a16a-bfd50179d6ac": "Windows恢复环境",
+    "0fc63daf-8483-4772-8e79-3d69d8477de4": "Linux",
+}
+
+# FAT32分区类型(MBR)和可能是FAT32的GPT类型
+FAT32_MBR_TYPES = (0x0B, 0x0C)
+GPT_BASIC_DATA = "ebd0a0a2-b9e5-4433-87c0-68b6b72699c7"
+
+
+class Partition:
+    """分区表中的一个分区"""
+
+    def __init__(self, disk_path: str, index: int, start: int, size: int, scheme: str,
+                 type_id=None, name: str = "", is_logical: bool = False):
+        self.disk_path = disk_path
+        self.index = index
+        self.start = start          # 分区起始字节偏移
+        self.size = size            # 分区字节数
+        self.scheme = scheme        # "MBR" 或 "GPT"
+        self.type_id = type_id      # MBR为类型字节，GPT为类型GUID字符串
+        self.name = name
+        self.is_logical = is_logical
+
+    @property
+    def path(self) -> str:
+        """可直接传给DiskUtils/FAT32Recovery的分区路径"""
+        return make_partition_path(self.disk_path, self.index)
+
+    @property
+    def type_name(self) -> str:
+        if self.scheme == "GPT":
+            return GPT_TYPE_NAMES.get(self.type_id, self.type_id)
+        return MBR_TYPE_NAMES.get(self.type_id, f"0x{self.type_id:02X}")
+
+    @property
+    def maybe_fat32(self) -> bool:
+        """是否可能是FAT32分区(GPT基本数据分区需要读取引导扇区才能确定)"""
+        if self.scheme == "GPT":
+            return self.type_id == GPT_BASIC_DATA
+        return self.type_id in FAT32_MBR_TYPES
+
+    def __repr__(self):
+        return f"Partition({self.path}, {self.type_name}, start={self.start}, size={self.size})"
+
+
+class PartitionDevice(BlockDevice):
+    """分区子设备：把分区内的偏移换算成所在磁盘上的偏移"""
+
+    def __init__(self, base: BlockDevice, partition: Partition, owns_base: bool = True):
+        super().__init__(partition.path)
+        self.base = base
+        self.partition = partition
+        self.offset = partition.start
+        self.length = partition.size
+        self.sector_size = base.sector_size
+        self.physical_sector_size = base.physical_sector_size
+        self.owns_base = owns_base
+
+    @property
+    def size(self) -> int:
+        return self.length
+
+    def readinto(self, offset: int, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        length = min(len(view), max(0, self.length - offset))
+        if length == 0:
+            return 0
+        return self.base.readinto(self.offset + offset, view[:length])
+
+    def read_view(self, offset: int, length: int) -> memoryview:
+        length = min(length, max(0, self.length - offset))
+        return self.base.read_view(self.offset + offset, length)
+
+    def readv(self, offset: int, buffers) -> int:
+        # 超出分区末尾的部分截掉，其余整体交给底层设备一次分散读取
+        remaining = max(0, self.length - offset)
+        clipped = []
+        for buffer in buffers:
+            if remaining <= 0:
+                break
+            view = memoryview(buffer).cast('B')
+            clipped.append(view[:remaining])
+            remaining -= len(view)
+        if not clipped:
+            return 0
+        return self.base.readv(self.offset + offset, clipped)
+
+    def data_extents(self, offset: int, length: int):
+        length = min(length, max(0, self.length - offset))
+        if length <= 0:
+            return []
+        return [(start - self.offset, size) for start, size in self.base.data_extents(self.offset + offset, length)]
+
+    def close(self):
+        if self.owns_base:
+            self.base.close()
+
+
+def make_partition_path(disk_path: str, index: int) -> str:
+    return f"{disk_path}::p{index}"
+
+
+def split_partition_path(path: str) -> Tuple[str, Optional[int]]:
+    """拆分分区路径，返回(磁盘路径, 分区号)，不是分区路径时分区号为None"""
+    match = PARTITION_PATH_PATTERN.match(path)
+    if not match:
+        return path, None
+    return match.group(1), int(match.group(2))
+
+
+def _looks_like_volume_boot_sector(sector: bytes) -> bool:
+    """扇区0本身就是卷引导扇区(分区镜像/逻辑卷)时没有分区表"""
+    return (sector[3:11] in (b'NTFS    ', b'EXFAT   ') or
+            sector[82:90] == b'FAT32   ' or
+            sector[54:62] in (b'FAT16   ', b'FAT12   '))
+
+
+def parse_partition_table(device: BlockDevice, disk_path: str) -> List[Partition]:
+    """解析设备上的MBR(含扩展分区EBR链)或GPT分区表
+
+    Returns:
+        分区列表；设备没有分区表(例如本身就是一个卷)时返回空列表
+    """
+    sector_size = device.sector_size
+    mbr = device.read_at(0, sector_size)
+    if len(mbr) < 512 or mbr[510:512] != b'\x55\xAA' or _looks_like_volume_boot_sector(mbr):
+        return []
+
+    entries = [struct.unpack_from("<B3xB3xII", mbr, 446 + i * 16) for i in range(4)]
+    if any(entry[1] == MBR_GPT_PROTECTIVE for entry in entries):
+        partitions = _parse_gpt(device, disk_path)
+        if partitions is not None:
+            return partitions
+        logging.error("GPT分区表无效，按MBR解析")
+
+    partitions = []
+    for _, type_id, start_lba, sector_count in entries:
+        if type_id == 0 or sector_count == 0 or type_id == MBR_GPT_PROTECTIVE:
+            continue
+        if type_id in MBR_EXTENDED_TYPES:
+            partitions.extend(_parse_ebr_chain(device, disk_path, start_lba))
+            continue
+        partitions.append(Partition(disk_path, 0, start_lba * sector_size, sector_count * sector_size,
+                                    "MBR", type_id))
+    # 主分区在前、逻辑分区在后依次编号
+    partitions.sort(key=lambda p: (p.is_logical, p.start))
+    for index, partition in enumerate(partitions, 1):
+        partition.index = index
+    return partitions
+
+
+def _parse_ebr_chain(device: BlockDevice, disk_path: str, extended_lba: int) -> List[Partition]:
+    """沿扩展引导记录(EBR)链解析逻辑分区"""
+    sector_size = device.sector_size
+    partitions = []
+    visited = set()
+    ebr_lba = extended_lba
+    while ebr_lba not in visited and len(visited) < 128:
+        visited.add(ebr_lba)
+        ebr = device.read_at(ebr_lba * sector_size, sector_size)
+        if len(ebr) < 512 or ebr[510:512] != b'\x55\xAA':
+            break
+        _, type_id, rel_start, sector_count = struct.unpack_from("<B3xB3xII", ebr, 446)
+        if type_id != 0 and sector_count != 0:
+            partitions.append(Partition(disk_path, 0,
+                                        (ebr_lba + rel_start) * sector_size, sector_count * sector_size,
+                                        "MBR", type_id, is_logical=True))
+        _, next_type, next_rel, next_count = struct.unpack_from("<B3xB3xII", ebr, 462)
+        if next_type not in MBR_EXTENDED_TYPES or next_count == 0:
+            break
+        # 下一个EBR的位置相对于扩展分区起点
+        ebr_lba = extended_lba + next_rel
+    return partitions
+
+
+def _read_gpt_header(device: BlockDevice, lba: int) -> Optional[bytes]:
+    """读取并校验GPT头，CRC不正确时返回None"""
+    sector_size = device.sector_size
+    header = device.read_at(lba * sector_size, sector_size)
+    if len(header) < 92 or header[0:8] != b'EFI PART':
+        return None
+    header_size = struct.unpack_from("<I", header, 12)[0]
+    if header_size < 92 or header_size > len(header):
+        return None
+    stored_crc = struct.unpack_from("<I", header, 16)[0]
+    check = bytearray(header[:header_size])
+    check[16:20] = b'\x00\x00\x00\x00'
+    if zlib.crc32(check) & 0xFFFFFFFF != stored_crc:
+        logging.error(f"GPT头(LBA {lba})CRC校验失败")
+        return None
+    return header
+
+
+def _parse_gpt(device: BlockDevice, disk_path: str) -> Optional[List[Partition]]:
+    """解析GPT分区表，主GPT头损坏时使用备份GPT头"""
+    sector_size = device.sector_size
+    header = _read_gpt_header(device, 1)
+    if header is None:
+        last_lba = device.size // sector_size - 1
+        header = _read_gpt_header(device, last_lba)
+        if header is None:
+            return None
+        logging.info("使用备份GPT头")
+
+    entries_lba, entry_count, entry_size, entries_crc = struct.unpack_from("<QIII", header, 72)
+    if entry_size < 128 or entry_count > 4096:
+        return None
+    table = device.read_at(entries_lba * sector_size, entry_count * entry_size)
+    if zlib.crc32(table) & 0xFFFFFFFF != entries_crc:
+        logging.error("GPT分区项数组CRC校验失败")
+        return None
+
+    partitions = []
+    for i in range(entry_count):
+        entry = table[i * entry_size:(i + 1) * entry_size]
+        if entry[0:16] == bytes(16):
+            continue
+        type_guid = str(uuid.UUID(bytes_le=bytes(entry[0:16])))
+        first_lba, last_lba = struct.unpack_from("<QQ", entry, 32)
+        name = bytes(entry[56:128]).decode('utf-16-le', errors='replace').rstrip('\x00')
+        partitions.append(Partition(disk_path, len(partitions) + 1, first_lba * sector_size,
+                                    (last_lba - first_lba + 1) * sector_size, "GPT", type_guid, name))
+    return partitions
+
+
+# 每个磁盘路径的分区表只解析一次
+_partition_cache: Dict[str, List[Partition]] = {}
+_partition_lock = threading.Lock()
+
+
+def get_partitions(disk_path: str, device: BlockDevice = None) -> List[Partition]:
+    """获取磁盘的分区列表(带缓存)
+
+    Args:
+        disk_path: 磁盘路径
+        device: 已打开的设备，为None时临时打开
+    """
+    with _partition_lock:
+        cached = _partition_cache.get(disk_path)
+    if cached is not None:
+        return cached
+    owns_device = device is None
+    if owns_device:
+        device = open_block_device(disk_path)
+    try:
+        partitions = parse_partition_table(device, disk_path)
+    finally:
+        if owns_device:
+            device.close()
+    with _partition_lock:
+        _partition_cache[disk_path] = partitions
+    return partitions
+
+
+def clear_partition_cache(disk_path: str = None):
+    """清除分区表缓存(磁盘重新分区后调用)"""
+    with _partition_lock:
+        if disk_path is None:
+            _partition_cache.clear()
+        else:
+            _partition_cache.pop(disk_path, None)
+
+
+def open_partition(path: str, direct: bool = False) -> PartitionDevice:
+    """打开形如<磁盘路径>::p<分区号>的分区子设备
+
+    Args:
+        path: 分区路径
+        direct: 是否以无缓冲方式打开所在磁盘
+    """
+    disk_path, index = split_partition_path(path)
+    if index is None:
+        raise ValueError(f"不是分区路径: {path}")
+    base = open_block_device(disk_path, direct=direct)
+    try:
+        for partition in get_partitions(disk_path, base):
+            if partition.index == index:
+                return PartitionDevice(base, partition)
+        raise Exception(f"{disk_path} 上不存在分区 {index}")
+    except Exception:
+        base.close()
+        raise
@@ -0,0 +1,147 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from block_device import BlockDevice
+
+
+class ReadAheadStream:
+    """一个顺序读取流的状态"""
+
+    def __init__(self, next_offset: int, window: int):
+        self.next_offset = next_offset
+        self.window = window
+        # 已发起的预读: (起始偏移, 长度, Future)
+        self.buffers = []
+
+    def covers(self, offset: int) -> bool:
+        """offset是否紧接上次读取或落在已预读的范围内"""
+        if offset == self.next_offset:
+            return True
+        return any(start <= offset < start + length for start, length, _ in self.buffers)
+
+    def prefetch_end(self) -> int:
+        """已预读范围的末尾"""
+        return max((start + length for start, length, _ in self.buffers), default=self.next_offset)
+
+
+class ReadAheadDevice(BlockDevice):
+    """自适应顺序预读层
+
+    按读取偏移识别各个顺序流：同一流连续读取时，在后台线程预读下一个窗口，
+    窗口从initial_window开始每次翻倍，最大到max_window；随机读取不触发预读。
+    不拥有底层设备，close只停止后台线程。
+    """
+
+    def __init__(self, device: BlockDevice, initial_window: int = 128 * 1024,
+                 max_window: int = 8 * 1024 * 1024, max_streams: int = 8):
+        super().__init__(device.path)
+        self.device = device
+        self.sector_size = device.sector_size
+        self.physical_sector_size = device.physical_sector_size
+        self.initial_window = initial_window
+        self.max_window = max_window
+        self.max_streams = max_streams
+        self._streams: List[ReadAheadStream] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="readahead")
+        self.prefetch_hits = 0
+        self.prefetch_misses = 0
+
+    @property
+    def size(self) -> int:
+        return self.device.size
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        if length <= 0:
+            return b''
+        with self._lock:
+            stream = self._find_stream(offset)
+            buffers = list(stream.buffers) if stream else []
+
+        data = self._collect(buffers, offset, length) if buffers else None
+        if data is None:
+            data = self.device.read_at(offset, length)
+            if stream:
+                self.prefetch_misses += 1
+        else:
+            self.prefetch_hits += 1
+
+        with self._lock:
+            if stream is None:
+                self._new_stream(offset + length)
+            else:
+                self._advance(stream, offset + length)
+        return data
+
+    def _find_stream(self, offset: int) -> Optional[ReadAheadStream]:
+        for stream in self._streams:
+            if stream.covers(offset):
+                # 最近使用的流移到末尾
+                self._streams.remove(stream)
+                self._streams.append(stream)
+                return stream
+        return None
+
+    def _new_stream(self, next_offset: int):
+        if len(self._streams) >= self.max_streams:
+            old = self._streams.pop(0)
+            for _, _, future in old.buffers:
+                future.cancel()
+        self._streams.append(ReadAheadStream(next_offset, self.initial_window))
+
+    def _advance(self, stream: ReadAheadStream, next_offset: int):
+        """顺序命中后扩大窗口，丢弃已消费的预读，并补充新的预读"""
+        stream.next_offset = next_offset
+        stream.window = min(stream.window * 2, self.max_window)
+        stream.buffers = [b for b in stream.buffers if b[0] + b[1] > next_offset]
+        end = stream.prefetch_end()
+        if end - next_offset < stream.window and end < self.size:
+            length = min(stream.window, self.size - end)
+            future = self._executor.submit(self.device.read_at, end, length)
+            stream.buffers.append((end, length, future))
+
+    @staticmethod
+    def _collect(buffers, offset: int, length: int) -> Optional[bytes]:
+        """从预读缓冲区拼出[offset, offset+length)，不能完整覆盖时返回None"""
+        pieces = []
+        position = offset
+        end = offset + length
+        for start, size, future in sorted(buffers, key=lambda b: b[0]):
+            if position >= end:
+                break
+            if start > position or start + size <= position:
+                continue
+            try:
+                data = future.result()
+            except Exception as e:
+                logging.debug(f"预读 {start}+{size} 失败: {str(e)}")
+                return None
+            piece = data[position - start:min(end, start + size) - start]
+            pieces.append(piece)
+            position += len(piece)
+            if len(data) < size:
+                # 预读到了设备末尾，按短读返回
+                return b''.join(pieces)
+        if position < end:
+            return None
+        return b''.join(pieces)
+
+    def data_extents(self, offset: int, length: int):
+        return self.device.data_extents(offset, length)
+
+    def stats(self) -> dict:
+        """返回预读命中统计"""
+        return {
+            'prefetch_hits': self.prefetch_hits,
+            'prefetch_misses': self.prefetch_misses,
+            'streams': len(self._streams),
+        }
+
+    def close(self):
+        with self._lock:
+            for stream in self._streams:
+                for _, _, future in stream.buffers:
+                    future.cancel()
+            self._streams.clear()
+        self._executor.shutdown(wait=False)
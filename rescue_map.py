@@ -0,0 +1,163 @@
+import os
+import bisect
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 区间状态，与GNU ddrescue的mapfile相同
+STATUS_UNTRIED = '?'      # 尚未读取
+STATUS_NON_TRIMMED = '*'  # 大块读取失败，还没有缩小块大小重试
+STATUS_NON_SCRAPED = '/'  # ddrescue的中间状态，按未逐扇区读取的失败区处理
+STATUS_BAD = '-'          # 逐扇区读取仍然失败的坏扇区
+STATUS_GOOD = '+'         # 已成功读取
+
+VALID_STATUSES = (STATUS_UNTRIED, STATUS_NON_TRIMMED, STATUS_NON_SCRAPED, STATUS_BAD, STATUS_GOOD)
+# 读取失败过、扫描和浏览时不应再去读取的状态
+FAILED_STATUSES = (STATUS_NON_TRIMMED, STATUS_NON_SCRAPED, STATUS_BAD)
+
+
+class RescueMap:
+    """设备的读取状态图：把[0, size)划分为连续的(起始, 长度, 状态)区间
+
+    文件格式与GNU ddrescue的mapfile兼容，抢救可以中断后从上次的状态继续，
+    也可以直接读取ddrescue生成的mapfile。所有方法都是线程安全的。
+    """
+
+    def __init__(self, size: int, path: Optional[str] = None):
+        self.size = size
+        self.path = path
+        self.current_pos = 0
+        self.current_status = STATUS_UNTRIED
+        self.current_pass = 1
+        self._starts = [0]
+        self._entries = [[0, size, STATUS_UNTRIED]] if size > 0 else []
+        if size <= 0:
+            self._starts = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, size: Optional[int] = None) -> 'RescueMap':
+        """读取mapfile；文件不存在时返回全部未读取的新状态图
+
+        Args:
+            path: mapfile路径
+            size: 设备大小，mapfile覆盖不到的部分按未读取处理
+        """
+        rescue_map = cls(size or 0, path)
+        if not os.path.exists(path):
+            if size is None:
+                raise FileNotFoundError(path)
+            return rescue_map
+        entries = []
+        status_line = True
+        with open(path, 'r', encoding='ascii', errors='replace') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                fields = line.split()
+                if status_line:
+                    # 第一行有效内容是当前位置、当前状态和当前轮次
+                    status_line = False
+                    rescue_map.current_pos = int(fields[0], 0)
+                    rescue_map.current_status = fields[1]
+                    if len(fields) > 2:
+                        rescue_map.current_pass = int(fields[2], 0)
+                    continue
+                start, length, status = int(fields[0], 0), int(fields[1], 0), fields[2]
+                if status not in VALID_STATUSES:
+                    raise ValueError(f"mapfile中有无效的状态: {line}")
+                entries.append((start, length, status))
+        mapped_size = max((start + length for start, length, _ in entries), default=0)
+        rescue_map.size = max(size or 0, mapped_size)
+        rescue_map._entries = [[0, rescue_map.size, STATUS_UNTRIED]] if rescue_map.size else []
+        rescue_map._starts = [0] if rescue_map.size else []
+        for start, length, status in entries:
+            rescue_map.mark(start, length, status)
+        logging.info(f"读取坏扇区图 {path}: {rescue_map.totals()}")
+        return rescue_map
+
+    def save(self, path: Optional[str] = None):
+        """写入mapfile(先写临时文件再替换，中途断电不会损坏原文件)"""
+        path = path or self.path
+        if not path:
+            raise ValueError("没有指定mapfile路径")
+        with self._lock:
+            lines = ["# Mapfile. Created by OpenHex\n",
+                     "# current_pos  current_status  current_pass\n",
+                     f"0x{self.current_pos:08X}     {self.current_status}               {self.current_pass}\n",
+                     "#      pos        size  status\n"]
+            lines.extend(f"0x{start:08X}  0x{length:08X}  {status}\n" for start, length, status in self._entries)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='ascii') as f:
+            f.writelines(lines)
+        os.replace(temp_path, path)
+        self.path = path
+
+    def _split_locked(self, offset: int) -> int:
+        """在offset处切开区间，返回从offset开始的区间序号"""
+        index = bisect.bisect_right(self._starts, offset) - 1
+        if index < 0:
+            return 0
+        start, length, status = self._entries[index]
+        if offset == start:
+            return index
+        if offset >= start + length:
+            return index + 1
+        self._entries[index][1] = offset - start
+        self._entries.insert(index + 1, [offset, start + length - offset, status])
+        self._starts.insert(index + 1, offset)
+        return index + 1
+
+    def mark(self, offset: int, length: int, status: str):
+        """把[offset, offset+length)标记为status，与相邻的同状态区间合并"""
+        end = min(offset + length, self.size)
+        if end <= offset:
+            return
+        with self._lock:
+            first = self._split_locked(offset)
+            last = self._split_locked(end)
+            self._entries[first:last] = [[offset, end - offset, status]]
+            self._starts[first:last] = [offset]
+            # 与前后同状态的区间合并
+            if first + 1 < len(self._entries) and self._entries[first + 1][2] == status:
+                self._entries[first][1] += self._entries[first + 1][1]
+                del self._entries[first + 1]
+                del self._starts[first + 1]
+            if first > 0 and self._entries[first - 1][2] == status:
+                self._entries[first - 1][1] += self._entries[first][1]
+                del self._entries[first]
+                del self._starts[first]
+
+    def extents(self, statuses, offset: int = 0, length: Optional[int] = None) -> List[Tuple[int, int, str]]:
+        """返回[offset, offset+length)中状态属于statuses的(起始, 长度, 状态)区间(裁剪到范围内)"""
+        end = self.size if length is None else min(self.size, offset + length)
+        result = []
+        with self._lock:
+            index = max(0, bisect.bisect_right(self._starts, offset) - 1)
+            while index < len(self._entries) and self._entries[index][0] < end:
+                start, size, status = self._entries[index]
+                if status in statuses and start + size > offset:
+                    begin = max(start, offset)
+                    result.append((begin, min(start + size, end) - begin, status))
+                index += 1
+        return result
+
+    def failed_extents(self, offset: int = 0, length: Optional[int] = None) -> List[Tuple[int, int]]:
+        """返回范围内读取失败过的(起始, 长度)区间"""
+        return [(start, size) for start, size, _ in self.extents(FAILED_STATUSES, offset, length)]
+
+    def status_at(self, offset: int) -> str:
+        with self._lock:
+            index = bisect.bisect_right(self._starts, offset) - 1
+            if index < 0 or offset >= self.size:
+                return STATUS_UNTRIED
+            return self._entries[index][2]
+
+    def totals(self) -> Dict[str, int]:
+        """各状态的总字节数"""
+        totals = {status: 0 for status in VALID_STATUSES}
+        with self._lock:
+            for _, length, status in self._entries:
+                totals[status] += length
+        return totals
@@ -0,0 +1,138 @@
+import os
+import re
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, List
+from block_device import BlockDevice, merge_extents
+
+# 分段原始镜像的扩展名: .000/.001/.002...
+SPLIT_EXTENSION_PATTERN = re.compile(r'^(.*)\.(\d{3,})$')
+
+
+def split_segment_paths(first_path: str) -> List[str]:
+    """按编号收集分段镜像的全部段文件，不是分段镜像时返回空列表
+
+    Args:
+        first_path: 任意一个段文件(通常是.001)的路径，从编号最小的段开始收集
+    """
+    match = SPLIT_EXTENSION_PATTERN.match(first_path)
+    if not match:
+        return []
+    base, digits = match.group(1), match.group(2)
+    width = len(digits)
+    # 从.000或.001开始，取实际存在的那个作为第一段
+    number = 0 if os.path.exists(f"{base}.{0:0{width}d}") else 1
+    paths = []
+    while True:
+        path = f"{base}.{number:0{width}d}"
+        if not os.path.isfile(path):
+            break
+        paths.append(path)
+        number += 1
+    return paths
+
+
+class SplitRawDevice(BlockDevice):
+    """把分段原始镜像(.001/.002/...)按顺序拼接成一个设备
+
+    打开时记录每段的累计起始偏移，全局偏移到段的换算是一次二分查找
+    (空段与下一段起始偏移相同，bisect_right自然跳过空段)；
+    跨段的读取自动拆成多段。段文件句柄按LRU缓存，最多同时打开max_open个，
+    正在读取的句柄不会被关闭。
+    """
+
+    def __init__(self, path: str, paths: List[str], opener: Callable[[str], BlockDevice], max_open: int = 16):
+        super().__init__(path)
+        self.paths = paths
+        self.opener = opener
+        self.max_open = max(1, max_open)
+        self.starts = []
+        total = 0
+        for segment_path in paths:
+            self.starts.append(total)
+            total += os.path.getsize(segment_path)
+        self.total_size = total
+        # 段序号 -> [设备, 正在使用的读取数]
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+        logging.info(f"分段镜像: {path} 共 {len(paths)} 段, 总大小 {total}")
+
+    @property
+    def size(self) -> int:
+        return self.total_size
+
+    def _segment_length(self, index: int) -> int:
+        end = self.starts[index + 1] if index + 1 < len(self.starts) else self.total_size
+        return end - self.starts[index]
+
+    def _acquire(self, index: int) -> BlockDevice:
+        with self._lock:
+            handle = self._handles.get(index)
+            if handle is None:
+                handle = [self.opener(self.paths[index]), 0]
+                self._handles[index] = handle
+                self._close_unused_locked()
+            else:
+                self._handles.move_to_end(index)
+            handle[1] += 1
+            return handle[0]
+
+    def _release(self, index: int):
+        with self._lock:
+            handle = self._handles.get(index)
+            if handle is not None:
+                handle[1] -= 1
+
+    def _close_unused_locked(self):
+        """句柄数超过上限时关闭最久未使用且没有读取在进行的段"""
+        for index in list(self._handles):
+            if len(self._handles) <= self.max_open:
+                break
+            device, users = self._handles[index]
+            if users == 0:
+                del self._handles[index]
+                device.close()
+
+    def readinto(self, offset: int, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        length = min(len(view), max(0, self.total_size - offset))
+        position = 0
+        while position < length:
+            index = bisect.bisect_right(self.starts, offset + position) - 1
+            within = offset + position - self.starts[index]
+            piece = min(self._segment_length(index) - within, length - position)
+            device = self._acquire(index)
+            try:
+                got = device.readinto(within, view[position:position + piece])
+            finally:
+                self._release(index)
+            if got < piece:
+                # 段文件在打开后被截短，剩余部分补0
+                view[position + got:position + piece] = bytes(piece - got)
+            position += piece
+        return length
+
+    def data_extents(self, offset: int, length: int):
+        length = min(length, max(0, self.total_size - offset))
+        extents = []
+        position = 0
+        while position < length:
+            index = bisect.bisect_right(self.starts, offset + position) - 1
+            within = offset + position - self.starts[index]
+            piece = min(self._segment_length(index) - within, length - position)
+            device = self._acquire(index)
+            try:
+                extents.extend((self.starts[index] + start, size)
+                               for start, size in device.data_extents(within, piece))
+            finally:
+                self._release(index)
+            position += piece
+        return merge_extents(extents)
+
+    def close(self):
+        with self._lock:
+            for device, _ in self._handles.values():
+                device.close()
+            self._handles.clear()
@@ -0,0 +1,200 @@
+import sys
+import struct
+import logging
+from array import array
+from block_device import BlockDevice, merge_extents
+from ewf_image import EwfBlockDevice, EWF_SIGNATURE, EWF2_SIGNATURE, LVF_SIGNATURE
+from metadata_snapshot import MetadataSnapshotDevice, SNAPSHOT_SIGNATURE
+from compressed_image import CompressedImageDevice, COMPRESSED_IMAGE_SIGNATURE
+
+# VHD磁盘类型
+VHD_TYPE_FIXED = 2
+VHD_TYPE_DYNAMIC = 3
+VHD_TYPE_DIFFERENCING = 4
+
+# BAT中表示未分配块的值
+VHD_UNALLOCATED = 0xFFFFFFFF
+
+# VMDK稀疏头中的标志位
+VMDK_FLAG_COMPRESSED = 1 << 16
+VMDK_GD_AT_END = 0xFFFFFFFFFFFFFFFF
+
+
+def _uint32_array(data: bytes, big_endian: bool) -> array:
+    """把字节数据解析成紧凑的uint32数组"""
+    table = array('I')
+    if table.itemsize != 4:
+        table = array('L')
+    table.frombytes(data)
+    if big_endian != (sys.byteorder == 'big'):
+        table.byteswap()
+    return table
+
+
+class VirtualDiskDevice(BlockDevice):
+    """虚拟磁盘容器的公共部分：按块把虚拟偏移映射到容器文件偏移
+
+    子类在构造时一次性载入分配表，_locate返回块在文件中的字节偏移，
+    未分配的块返回None，读取时直接补0，不产生任何I/O。
+    """
+
+    def __init__(self, base: BlockDevice, virtual_size: int, block_size: int):
+        super().__init__(base.path)
+        self.base = base
+        self.virtual_size = virtual_size
+        self.block_size = block_size
+
+    @property
+    def size(self) -> int:
+        return self.virtual_size
+
+    def _locate(self, block: int):
+        raise NotImplementedError
+
+    def readinto(self, offset: int, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        length = min(len(view), max(0, self.virtual_size - offset))
+        position = 0
+        while position < length:
+            block, within = divmod(offset + position, self.block_size)
+            piece = min(self.block_size - within, length - position)
+            file_offset = self._locate(block)
+            if file_offset is None:
+                view[position:position + piece] = bytes(piece)
+            else:
+                got = self.base.readinto(file_offset + within, view[position:position + piece])
+                if got < piece:
+                    view[position + got:position + piece] = bytes(piece - got)
+            position += piece
+        return length
+
+    def data_extents(self, offset: int, length: int):
+        """未分配的块是空洞；已分配的块再按容器文件自身的空洞细分"""
+        length = min(length, max(0, self.virtual_size - offset))
+        extents = []
+        position = 0
+        while position < length:
+            block, within = divmod(offset + position, self.block_size)
+            piece = min(self.block_size - within, length - position)
+            file_offset = self._locate(block)
+            if file_offset is not None:
+                shift = offset + position - (file_offset + within)
+                extents.extend((start + shift, size)
+                               for start, size in self.base.data_extents(file_offset + within, piece))
+            position += piece
+        return merge_extents(extents)
+
+    def close(self):
+        self.base.close()
+
+
+class VhdBlockDevice(VirtualDiskDevice):
+    """固定大小和动态扩展的VHD镜像
+
+    动态VHD的块分配表(BAT)在打开时整体读入uint32数组，
+    虚拟扇区到文件偏移的换算是一次数组下标访问。
+    """
+
+    def __init__(self, base: BlockDevice, footer: bytes):
+        current_size = struct.unpack(">Q", footer[48:56])[0]
+        self.disk_type = struct.unpack(">I", footer[60:64])[0]
+        if self.disk_type == VHD_TYPE_FIXED:
+            super().__init__(base, current_size, max(current_size, 1))
+            self.bat = None
+            return
+        if self.disk_type == VHD_TYPE_DIFFERENCING:
+            raise Exception("暂不支持差分VHD镜像")
+        if self.disk_type != VHD_TYPE_DYNAMIC:
+            raise Exception(f"未知的VHD磁盘类型: {self.disk_type}")
+
+        header_offset = struct.unpack(">Q", footer[16:24])[0]
+        header = base.read_at(header_offset, 1024)
+        if header[0:8] != b'cxsparse':
+            raise Exception("VHD动态磁盘头无效")
+        table_offset = struct.unpack(">Q", header[16:24])[0]
+        max_entries = struct.unpack(">I", header[28:32])[0]
+        block_size = struct.unpack(">I", header[32:36])[0]
+        super().__init__(base, current_size, block_size)
+
+        # 每个数据块前面有一个按512字节对齐的扇区位图
+        bitmap_bytes = (block_size // 512 + 7) // 8
+        self.bitmap_size = (bitmap_bytes + 511) // 512 * 512
+        self.bat = _uint32_array(base.read_at(table_offset, max_entries * 4), big_endian=True)
+        logging.info(f"VHD动态磁盘: 虚拟大小={current_size}, 块大小={block_size}, BAT项数={max_entries}")
+
+    def _locate(self, block: int):
+        if self.bat is None:
+            return 0
+        if block >= len(self.bat):
+            return None
+        sector = self.bat[block]
+        if sector == VHD_UNALLOCATED:
+            return None
+        return sector * 512 + self.bitmap_size
+
+
+class VmdkSparseBlockDevice(VirtualDiskDevice):
+    """单文件稀疏(monolithicSparse)VMDK镜像
+
+    打开时把grain目录和全部grain表展开成一个按grain编号索引的uint32数组，
+    值为0(未分配)或1(全零grain)时读取结果为0。
+    """
+
+    def __init__(self, base: BlockDevice, header: bytes):
+        (magic, version, flags, capacity, grain_size, _desc_offset, _desc_size,
+         gtes_per_gt, _rgd_offset, gd_offset, _overhead) = struct.unpack("<4sIIQQQQIQQQ", header[:72])
+        if flags & VMDK_FLAG_COMPRESSED or gd_offset == VMDK_GD_AT_END:
+            raise Exception("暂不支持压缩(streamOptimized)VMDK镜像")
+        grain_bytes = grain_size * 512
+        super().__init__(base, capacity * 512, grain_bytes)
+
+        total_grains = (capacity + grain_size - 1) // grain_size
+        gt_count = (total_grains + gtes_per_gt - 1) // gtes_per_gt
+        directory = _uint32_array(base.read_at(gd_offset * 512, gt_count * 4), big_endian=False)
+        self.grains = array(directory.typecode, bytes(total_grains * directory.itemsize))
+        for gt_index, gt_sector in enumerate(directory):
+            if gt_sector == 0:
+                continue
+            table = _uint32_array(base.read_at(gt_sector * 512, gtes_per_gt * 4), big_endian=False)
+            first = gt_index * gtes_per_gt
+            count = min(gtes_per_gt, total_grains - first)
+            self.grains[first:first + count] = table[:count]
+        logging.info(f"VMDK稀疏磁盘: 虚拟大小={capacity * 512}, grain大小={grain_bytes}, grain数={total_grains}")
+
+    def _locate(self, block: int):
+        if block >= len(self.grains):
+            return None
+        sector = self.grains[block]
+        if sector <= 1:
+            return None
+        return sector * 512
+
+
+def open_virtual_disk(base: BlockDevice) -> BlockDevice:
+    """识别VHD/VMDK/E01容器、分块压缩镜像和元数据快照，是容器时返回对应的虚拟磁盘设备，否则原样返回base"""
+    size = base.size
+    if size < 512:
+        return base
+    head = base.read_at(0, 512)
+    if head[0:8] == EWF_SIGNATURE:
+        return EwfBlockDevice(base)
+    if head[0:8] == SNAPSHOT_SIGNATURE:
+        return MetadataSnapshotDevice(base, head)
+    if head[0:8] == COMPRESSED_IMAGE_SIGNATURE:
+        return CompressedImageDevice(base, head)
+    if head[0:8] in (EWF2_SIGNATURE, LVF_SIGNATURE):
+        raise Exception("暂不支持Ex01/L01格式的证据文件，请导出为E01或原始镜像")
+    if head[0:4] == b'KDMV':
+        return VmdkSparseBlockDevice(base, head)
+    if head[0:21] == b'# Disk DescriptorFile':
+        raise Exception("暂不支持分离描述符的VMDK镜像，请直接打开对应的数据文件")
+    footer = base.read_at(size - 512, 512)
+    if footer[0:8] != b'conectix':
+        # 老版本工具生成的footer只有511字节
+        footer = base.read_at(size - 511, 511)
+    if footer[0:8] == b'conectix':
+        return VhdBlockDevice(base, footer)
+    if head[0:8] == b'conectix':
+        # 尾部footer损坏时使用头部的备份
+        return VhdBlockDevice(base, head)
+    return base